@@ -1,9 +1,18 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, UpdateMany, ReplaceOne, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError, DuplicateKeyError
 import os
+import re
+import io
+import csv
+import zlib
+import asyncio
 import logging
 import httpx
 import smtplib
@@ -12,13 +21,24 @@ import string
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, EmailStr
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
+import time
+import copy
+import json
+import hashlib
+import base64
 import jwt
 import bcrypt
 from datetime import datetime, timezone, timedelta
 
+try:
+    import h2  # noqa: F401 -- httpx speaks HTTP/2 only when h2 is installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -36,6 +56,79 @@ JWT_EXPIRY_HOURS = 24 * 7  # 7 days
 COINCONNECT_CREATE_USER = "https://cca.neuralaitraders.com/create_user_account/"
 COINCONNECT_BALANCE = "https://api.coinconnect.tech/get_account_balance/"
 COINCONNECT_WITHDRAW = "https://api.coinconnect.tech/withdraw/"
+COINCONNECT_MAX_CONNECTIONS = int(os.environ.get('COINCONNECT_MAX_CONNECTIONS', '50'))
+COINCONNECT_MAX_KEEPALIVE = int(os.environ.get('COINCONNECT_MAX_KEEPALIVE', '20'))
+COINCONNECT_CONNECT_TIMEOUT = 10.0
+BALANCE_CACHE_TTL_SECONDS = float(os.environ.get('BALANCE_CACHE_TTL_SECONDS', '20'))
+BALANCE_CACHE_MAX_ENTRIES = 10000
+BALANCE_FAILURE_TTL_SECONDS = 10  # A failed lookup isn't retried for this long, except on force_refresh
+COINCONNECT_TIMEOUTS = {  # Per-operation read timeouts (seconds)
+    "create_user": 30.0,
+    "balance": 30.0,
+    "withdraw": 60.0
+}
+
+# MLM Config
+MAX_INCOME_LEVELS = 10
+UPLINE_FETCH_BATCH = 50  # Upline members loaded per query during distribution
+
+# Email outbox config
+EMAIL_SMTP_POOL_SIZE = int(os.environ.get('EMAIL_SMTP_POOL_SIZE', '2'))  # Also the number of outbox workers
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 30  # Doubles per failed attempt
+EMAIL_LEASE_SECONDS = 120  # A "sending" email is reclaimed after this if its worker died
+EMAIL_POLL_INTERVAL_SECONDS = 5
+EMAIL_RETENTION_SECONDS = 7 * 24 * 3600  # Sent and failed emails are kept this long, without their body
+
+# Grace period sweeper config
+GRACE_SWEEP_INTERVAL_SECONDS = float(os.environ.get('GRACE_SWEEP_INTERVAL_SECONDS', '300'))
+GRACE_SWEEP_BATCH = 500  # Users forfeited per bulk write
+GRACE_SWEEP_LEASE_SECONDS = 120  # Renewed per batch; another worker takes over after this if the holder died
+
+# Team tree migration config
+TEAM_MIGRATION_LEASE_SECONDS = 3600  # One worker fills in team counters for users that predate them
+
+# Deposit watcher config
+DEPOSIT_WATCH_CONCURRENCY = int(os.environ.get('DEPOSIT_WATCH_CONCURRENCY', '10'))  # Balance lookups in flight, across all processes
+DEPOSIT_WATCH_BASE_INTERVAL_SECONDS = 10  # First re-check; doubles after every miss
+DEPOSIT_WATCH_MAX_INTERVAL_SECONDS = 300
+DEPOSIT_WATCH_MAX_AGE_SECONDS = 6 * 3600  # Stop watching a request that never got funded
+DEPOSIT_WATCH_LEASE_SECONDS = 120  # A claimed check is retried after this if its worker died
+DEPOSIT_WATCH_POLL_INTERVAL_SECONDS = 2
+
+# Withdrawal queue config
+WITHDRAWAL_WORKERS = int(os.environ.get('WITHDRAWAL_WORKERS', '4'))  # CoinConnect submissions in flight
+WITHDRAWAL_RATE_PER_SECOND = float(os.environ.get('WITHDRAWAL_RATE_PER_SECOND', '2'))  # Per process; 0 disables the limit
+WITHDRAWAL_LEASE_SECONDS = 120  # Longer than the withdraw timeout; a "submitted" row is resumed after this if its worker died
+WITHDRAWAL_POLL_INTERVAL_SECONDS = 2
+WITHDRAWAL_MAX_ATTEMPTS = 5  # Submissions that never reached CoinConnect, before the withdrawal fails
+WITHDRAWAL_RETRY_BASE_SECONDS = 30  # Doubles per unsent attempt
+
+# Idempotency key config
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', str(24 * 3600)))  # Replay window
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_LEASE_SECONDS = 90  # An in-progress key is taken over after this if its request died
+IDEMPOTENCY_WAIT_SECONDS = 30  # How long a duplicate waits for the first request to finish
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.2
+
+# Admin export config
+EXPORT_CURSOR_BATCH = 1000  # Documents per Motor round trip
+EXPORT_CHUNK_BYTES = 64 * 1024  # Encoded rows are buffered up to this before each write
+
+# Transaction history sync config
+# Sync cursors stay this far behind now, so rows stamped before a slow commit are still returned
+LEDGER_SYNC_SETTLE_SECONDS = float(os.environ.get('LEDGER_SYNC_SETTLE_SECONDS', '30'))
+
+# Platform stats config
+PLATFORM_STATS_VERIFY_INTERVAL_SECONDS = float(os.environ.get('PLATFORM_STATS_VERIFY_INTERVAL_SECONDS', '3600'))
+
+# Authenticated user cache config
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '5'))
+USER_CACHE_MAX_ENTRIES = 10000
+
+# Settings cache config
+SETTINGS_CACHE_TTL_SECONDS = float(os.environ.get('SETTINGS_CACHE_TTL_SECONDS', '300'))
+SETTINGS_VERSION_CHECK_SECONDS = float(os.environ.get('SETTINGS_VERSION_CHECK_SECONDS', '5'))
 
 app = FastAPI(title="GEM BOT MLM API")
 api_router = APIRouter(prefix="/api")
@@ -129,6 +222,19 @@ class MT5Credentials(BaseModel):
     mt5_password: str
     terms_accepted: bool
 
+class CoinConnectResponse(BaseModel):
+    status: str = "NOTOK"
+    message: Any = None
+    response: Optional[Dict[str, Any]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "OK"
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        return (self.response or {}).get("data") or {}
+
 class UserResponse(BaseModel):
     id: str
     email: str
@@ -159,6 +265,141 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+def _encode_cursor_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Unsupported cursor value: {value!r}")
+
+def _decode_cursor_value(obj: dict) -> Any:
+    if set(obj) == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+def encode_cursor(values: list) -> str:
+    """Opaque pagination cursor from the sort key values of the last returned row"""
+    return base64.urlsafe_b64encode(json.dumps(values, default=_encode_cursor_value).encode()).decode()
+
+def decode_cursor(cursor: str, size: int = 2) -> list:
+    """
+    Sort key values from a cursor; the last one is a row id.
+    Cursors come from clients and end up in queries, so anything but a scalar or a
+    date (an operator document, say) is rejected.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode(), object_hook=_decode_cursor_value)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size or not isinstance(values[-1], str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for value in values:
+        if isinstance(value, bool) or not (value is None or isinstance(value, (str, int, float, datetime))):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(field: str, value: Any, last_id: str, descending: bool = True) -> dict:
+    """
+    Query matching rows after (value, last_id) in a sort on (field, id).
+    Nulls sort lowest and range operators never match them, so they get an explicit clause.
+    """
+    op = "$lt" if descending else "$gt"
+    clauses = [{field: value, "id": {op: last_id}}]
+    if value is None:
+        if not descending:
+            clauses.append({field: {"$ne": None}})
+    else:
+        clauses.append({field: {op: value}})
+        if descending:
+            clauses.append({field: None})
+    return {"$or": clauses}
+
+LISTING_TOTAL_TTL_SECONDS = 60
+LISTING_TOTAL_MAX_ENTRIES = 1000
+_listing_totals: Dict[tuple, tuple] = {}  # (collection, query) -> (total, counted_at), oldest count first
+
+async def get_listing_total(collection_name: str, query: dict) -> int:
+    """
+    Total for an admin listing: metadata estimate when unfiltered, otherwise an
+    index-backed count reused for LISTING_TOTAL_TTL_SECONDS.
+    Queries with a time window get a new key as the window moves, so expired
+    counts are evicted on every store and the cache is capped.
+    """
+    if not query:
+        return await db[collection_name].estimated_document_count()
+    key = (collection_name, json.dumps(query, sort_keys=True, default=str))
+    cached = _listing_totals.get(key)
+    if cached and time.monotonic() - cached[1] < LISTING_TOTAL_TTL_SECONDS:
+        return cached[0]
+    total = await db[collection_name].count_documents(query)
+    now = time.monotonic()
+    _listing_totals.pop(key, None)
+    _listing_totals[key] = (total, now)
+    while _listing_totals:
+        oldest_key, (_, counted_at) = next(iter(_listing_totals.items()))
+        if now - counted_at < LISTING_TOTAL_TTL_SECONDS and len(_listing_totals) <= LISTING_TOTAL_MAX_ENTRIES:
+            break
+        del _listing_totals[oldest_key]
+    return total
+
+async def keyset_page(collection_name: str, query: dict, cursor: Optional[str], limit: int,
+                      sort_field: str = "created_at", projection: Optional[dict] = None,
+                      descending: bool = True) -> Tuple[List[dict], Optional[str]]:
+    """One page sorted by (sort_field, id), newest first by default, plus the cursor for the next page"""
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        after = keyset_filter(sort_field, last_value, last_id, descending)
+        query = {"$and": [query, after]} if query else after
+    direction = -1 if descending else 1
+    rows = await db[collection_name].find(query, projection or {"_id": 0}).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1].get(sort_field), rows[-1]["id"]])
+    return rows, next_cursor
+
+class DocumentCache:
+    """
+    Bounded LRU of user and admin documents by id, for the auth dependencies.
+    - Entries are reused for `ttl` seconds; writes in this process invalidate them
+      immediately, writes in other processes are picked up when the entry expires
+    - Misses are not cached
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[tuple, tuple] = {}  # (collection, id) -> (document, loaded_at), oldest use first
+        self._generation = 0
+
+    async def get(self, collection_name: str, doc_id: str) -> Optional[dict]:
+        key = (collection_name, doc_id)
+        entry = self._entries.pop(key, None)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            self._entries[key] = entry
+            return copy.deepcopy(entry[0])
+        generation = self._generation
+        doc = await db[collection_name].find_one({"id": doc_id}, {"_id": 0})
+        # Don't cache a read that raced with an invalidation
+        if doc is not None and generation == self._generation:
+            self._entries[key] = (doc, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        return copy.deepcopy(doc)
+
+    def invalidate(self, *user_ids: str):
+        """Drop cached user documents after writing to them"""
+        self._generation += 1
+        for user_id in user_ids:
+            self._entries.pop(("users", user_id), None)
+
+    def clear(self):
+        """Drop everything, after writes that touch many users at once"""
+        self._generation += 1
+        self._entries.clear()
+
+user_cache = DocumentCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+
 def create_token(data: dict, is_admin: bool = False) -> str:
     payload = {
         **data,
@@ -175,13 +416,16 @@ def decode_token(token: str) -> dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def user_id_from_credentials(credentials: Optional[HTTPAuthorizationCredentials]) -> str:
     if not credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
     payload = decode_token(credentials.credentials)
     if payload.get("is_admin"):
         raise HTTPException(status_code=403, detail="Admin token not allowed")
-    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+    return payload["user_id"]
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user = await user_cache.get("users", user_id_from_credentials(credentials))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -192,14 +436,198 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
     payload = decode_token(credentials.credentials)
     if not payload.get("is_admin"):
         raise HTTPException(status_code=403, detail="Admin access required")
-    admin = await db.admins.find_one({"id": payload["admin_id"]}, {"_id": 0})
+    admin = await user_cache.get("admins", payload["admin_id"])
     if not admin:
         raise HTTPException(status_code=404, detail="Admin not found")
     return admin
 
-async def get_smtp_settings():
-    settings = await db.settings.find_one({"type": "smtp"}, {"_id": 0})
-    return settings.get("data") if settings else None
+# ==================== INDEXES ====================
+
+# Every index the app relies on, matched to the query shapes in this module
+INDEX_CATALOGUE: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("referral_code", ASCENDING)], unique=True),
+        IndexModel([("sponsor_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("ancestors", ASCENDING)]),
+        # Team members newest first below level 1 (default sort)
+        IndexModel([("ancestors", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        # Team members sorted by status (level 1 by sponsor_id, deeper levels by ancestors)
+        IndexModel([("sponsor_id", ASCENDING), ("subscription_expires", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("ancestors", ASCENDING), ("subscription_expires", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("is_active", ASCENDING)]),
+        # Grace sweeper and listing: expired grace periods that still hold temporary income
+        IndexModel(
+            [("grace_ends_at", ASCENDING), ("id", ASCENDING)],
+            name="grace_ends_at_pending_forfeit",
+            partialFilterExpression={"temporary_wallet": {"$gt": 0}}
+        ),
+        # Grace listing: users whose grace window is open
+        IndexModel([("grace_ends_at", ASCENDING)]),
+        IndexModel([("subscription_expires", ASCENDING)]),
+        # Deposit watcher: users awaiting activation/renewal, next due first
+        IndexModel([("deposit_watch.next_check_at", ASCENDING)], sparse=True),
+    ],
+    "transactions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # User history, recent rows first (dashboard, transactions page)
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        # Transactions page delta sync: rows written or changed since the client's cursor
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)]),
+        # User history by type (income, withdrawals, transfers) and income aggregations
+        IndexModel([("user_id", ASCENDING), ("type", ASCENDING), ("created_at", DESCENDING)]),
+        # Pending grace income flush/forfeit
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)]),
+        # Admin ledger, optionally filtered by type
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        # Admin dashboard totals
+        IndexModel([("type", ASCENDING), ("status", ASCENDING)]),
+        # Withdrawal queue: queued or abandoned submissions, next due first
+        IndexModel([("queue_at", ASCENDING)], sparse=True),
+        # Withdrawals with an unknown payout outcome, for admin review
+        IndexModel([("needs_review", ASCENDING), ("created_at", ASCENDING)], sparse=True),
+    ],
+    "otps": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "admins": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "settings": [
+        IndexModel([("type", ASCENDING)], unique=True),
+    ],
+    "email_templates": [
+        IndexModel([("template_type", ASCENDING)], unique=True),
+    ],
+    "content": [
+        IndexModel([("type", ASCENDING)], unique=True),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+        # Delivered and given-up emails expire after EMAIL_RETENTION_SECONDS
+        IndexModel([("sent_at", ASCENDING)], expireAfterSeconds=EMAIL_RETENTION_SECONDS),
+        IndexModel([("failed_at", ASCENDING)], expireAfterSeconds=EMAIL_RETENTION_SECONDS),
+    ],
+    "user_income_summary": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "platform_stats": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "job_leases": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "idempotency_keys": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS),
+    ],
+    "additional_commissions": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+}
+
+async def ensure_indexes():
+    """Create every catalogued index; existing ones are a no-op. Failures are logged, not fatal."""
+    for collection_name, indexes in INDEX_CATALOGUE.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except PyMongoError as e:
+                logger.error(f"Index creation failed for {collection_name} {index.document['key']}: {e}")
+
+# ==================== SETTINGS CACHE ====================
+
+class SettingsCache:
+    """
+    In-process cache of db.settings documents, keyed by settings type (plus a few
+    other small, rarely written admin configurations loaded through `get_or_load`).
+    - Entries expire after `ttl` seconds
+    - Every save bumps a shared version document; readers compare against it at
+      most once per `version_check_interval`, so other workers drop stale entries
+      within that window
+    """
+
+    VERSION_TYPE = "settings_version"
+
+    def __init__(self, ttl: float, version_check_interval: float):
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries: Dict[str, tuple] = {}  # settings type -> (data, loaded_at)
+        self._version: Optional[int] = None
+        self._version_checked_at = 0.0
+        self._generation = 0
+
+    async def _sync_version(self):
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        doc = await db.settings.find_one({"type": self.VERSION_TYPE}, {"_id": 0, "version": 1})
+        version = doc.get("version", 0) if doc else 0
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._generation += 1
+
+    async def current_generation(self) -> int:
+        """Changes whenever cached settings are invalidated, locally or by another worker"""
+        await self._sync_version()
+        return self._generation
+
+    async def get(self, settings_type: str) -> Optional[Any]:
+        async def load():
+            settings = await db.settings.find_one({"type": settings_type}, {"_id": 0})
+            return settings.get("data") if settings else None
+        
+        return await self.get_or_load(settings_type, load)
+
+    async def get_or_load(self, key: str, loader) -> Optional[Any]:
+        """Cached value for `key`, filled by awaiting `loader()` on a miss; writers must call bump_version"""
+        await self._sync_version()
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return copy.deepcopy(entry[0])
+        generation = self._generation
+        data = await loader()
+        # Don't cache a read that raced with an invalidation
+        if generation == self._generation:
+            self._entries[key] = (data, time.monotonic())
+        return copy.deepcopy(data)
+
+    async def save(self, settings_type: str, data: Any):
+        """Write-through: persist the settings, then invalidate locally and for other workers"""
+        await db.settings.update_one(
+            {"type": settings_type},
+            {"$set": {"type": settings_type, "data": data}},
+            upsert=True
+        )
+        await self.bump_version()
+
+    async def bump_version(self):
+        doc = await db.settings.find_one_and_update(
+            {"type": self.VERSION_TYPE},
+            {"$inc": {"version": 1}, "$set": {"type": self.VERSION_TYPE}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._clear()
+        self._version = doc.get("version", 0)
+        self._version_checked_at = time.monotonic()
+
+settings_cache = SettingsCache(SETTINGS_CACHE_TTL_SECONDS, SETTINGS_VERSION_CHECK_SECONDS)
+
+async def get_smtp_settings() -> Optional[Dict[str, Any]]:
+    return await settings_cache.get("smtp")
 
 async def get_email_template(template_type: str):
     template = await db.email_templates.find_one({"template_type": template_type}, {"_id": 0})
@@ -223,114 +651,420 @@ async def get_email_template(template_type: str):
     return {"subject": defaults.get(template_type, {}).get("subject", "GEM BOT Notification"),
             "body": defaults.get(template_type, {}).get("body", "Notification from GEM BOT")}
 
-async def send_email(to_email: str, subject: str, body: str):
+# ==================== EMAIL OUTBOX ====================
+
+class SMTPConnectionPool:
+    """
+    Small pool of authenticated SMTP connections reused across sends.
+    smtplib is blocking, so connect and send run in worker threads.
+    Idle connections opened with different settings are discarded on checkout.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[tuple] = []  # (connection, settings key)
+        self._semaphore = asyncio.Semaphore(size)
+
+    @staticmethod
+    def _settings_key(smtp_settings: Dict[str, Any]) -> tuple:
+        return (smtp_settings['host'], smtp_settings['port'], smtp_settings['username'], smtp_settings['password'])
+
+    @staticmethod
+    def _connect(smtp_settings: Dict[str, Any]) -> smtplib.SMTP:
+        connection = smtplib.SMTP(smtp_settings['host'], smtp_settings['port'], timeout=30)
+        connection.starttls()
+        connection.login(smtp_settings['username'], smtp_settings['password'])
+        return connection
+
+    @staticmethod
+    def _discard(connection: Optional[smtplib.SMTP]):
+        if connection is None:
+            return
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _checkout(self, key: tuple) -> Optional[smtplib.SMTP]:
+        while self._idle:
+            connection, connection_key = self._idle.pop()
+            if connection_key == key:
+                return connection
+            self._discard(connection)
+        return None
+
+    async def send(self, smtp_settings: Dict[str, Any], message: MIMEMultipart):
+        key = self._settings_key(smtp_settings)
+        async with self._semaphore:
+            connection = self._checkout(key)
+            if connection is not None:
+                try:
+                    await asyncio.to_thread(connection.send_message, message)
+                    self._idle.append((connection, key))
+                    return
+                except Exception as e:
+                    # Never reuse a connection after an error. SMTP and socket errors (a dropped
+                    # idle connection, a 421 timeout reply) are retried on a fresh one
+                    self._discard(connection)
+                    if not isinstance(e, (smtplib.SMTPException, OSError)):
+                        raise
+            
+            connection = None
+            try:
+                connection = await asyncio.to_thread(self._connect, smtp_settings)
+                await asyncio.to_thread(connection.send_message, message)
+            except Exception:
+                self._discard(connection)
+                raise
+            self._idle.append((connection, key))
+
+    def close(self):
+        while self._idle:
+            self._discard(self._idle.pop()[0])
+
+class EmailOutboxWorker:
+    """
+    Drains db.email_outbox: claims due emails with a lease, delivers them through
+    the SMTP pool and reschedules failures with exponential backoff.
+    Bodies carry OTP codes, so they are dropped once an email is sent or given up.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.pool = SMTPConnectionPool(concurrency)
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.pool.close()
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                email = await self._claim()
+                if email is None:
+                    await self._fail_abandoned()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), EMAIL_POLL_INTERVAL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                await self._deliver(email)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e}")
+                await asyncio.sleep(EMAIL_POLL_INTERVAL_SECONDS)
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.email_outbox.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "lease_expires_at": {"$lt": now}, "attempts": {"$lt": EMAIL_MAX_ATTEMPTS}}
+            ]},
+            {
+                "$set": {"status": "sending", "lease_expires_at": now + timedelta(seconds=EMAIL_LEASE_SECONDS)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("next_attempt_at", ASCENDING)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _fail_abandoned(self):
+        """Give up on emails whose worker died during their last allowed attempt"""
+        now = datetime.now(timezone.utc)
+        await db.email_outbox.update_many(
+            {"status": "sending", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": EMAIL_MAX_ATTEMPTS}},
+            {
+                "$set": {"status": "failed", "failed_at": now, "last_error": "Worker stopped during the last attempt"},
+                "$unset": {"body": ""}
+            }
+        )
+
+    async def _deliver(self, email: dict):
+        try:
+            smtp_settings = await get_smtp_settings()
+            if not smtp_settings or not smtp_settings.get("host"):
+                raise RuntimeError("SMTP not configured")
+            
+            msg = MIMEMultipart()
+            msg['From'] = f"{smtp_settings['from_name']} <{smtp_settings['from_email']}>"
+            msg['To'] = email["to"]
+            msg['Subject'] = email["subject"]
+            msg.attach(MIMEText(email["body"], 'html'))
+            
+            await self.pool.send(smtp_settings, msg)
+        except Exception as e:
+            logger.error(f"Email send error: {e}")
+            if email["attempts"] >= EMAIL_MAX_ATTEMPTS:
+                update = {
+                    "$set": {"status": "failed", "failed_at": datetime.now(timezone.utc), "last_error": str(e)},
+                    "$unset": {"body": ""}
+                }
+            else:
+                backoff = EMAIL_RETRY_BASE_SECONDS * (2 ** (email["attempts"] - 1))
+                update = {"$set": {
+                    "status": "pending",
+                    "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=backoff),
+                    "last_error": str(e)
+                }}
+            await db.email_outbox.update_one({"id": email["id"]}, update)
+            return
+        
+        await db.email_outbox.update_one(
+            {"id": email["id"]},
+            {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)}, "$unset": {"body": ""}}
+        )
+
+email_worker = EmailOutboxWorker(EMAIL_SMTP_POOL_SIZE)
+
+async def send_email(to_email: str, subject: str, body: str) -> Optional[str]:
+    """Queue an email in the durable outbox; returns the outbox id (None when SMTP isn't configured)"""
     smtp_settings = await get_smtp_settings()
     if not smtp_settings:
-        logger.warning(f"SMTP not configured. Email to {to_email}: {subject} - {body}")
-        return False
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = f"{smtp_settings['from_name']} <{smtp_settings['from_email']}>"
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'html'))
-        
-        with smtplib.SMTP(smtp_settings['host'], smtp_settings['port']) as server:
-            server.starttls()
-            server.login(smtp_settings['username'], smtp_settings['password'])
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        logger.error(f"Email send error: {e}")
-        return False
+        logger.warning(f"SMTP not configured. Email to {to_email} not sent: {subject}")
+        return None
+    
+    email_id = str(uuid.uuid4())
+    await db.email_outbox.insert_one({
+        "id": email_id,
+        "to": to_email,
+        "subject": subject,
+        "body": body,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.now(timezone.utc),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    email_worker.wake()
+    return email_id
 
-async def get_coinconnect_credentials():
-    settings = await db.settings.find_one({"type": "coinconnect"}, {"_id": 0})
-    if settings and settings.get("data"):
-        return settings["data"]
+async def get_coinconnect_credentials() -> Dict[str, Any]:
+    data = await settings_cache.get("coinconnect")
+    if data:
+        return data
     return {
         "cca_key": os.environ.get("CCA_KEY", ""),
         "cca_secret": os.environ.get("CCA_SECRET", "")
     }
 
-async def create_coinconnect_wallet(email: str, first_name: str, last_name: str, mobile: str):
-    creds = await get_coinconnect_credentials()
-    if not creds.get("cca_key"):
-        logger.warning("CoinConnect credentials not configured")
-        return None
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(COINCONNECT_CREATE_USER, json={
-                "data": {
-                    "email": email,
-                    "first_name": first_name,
-                    "last_name": last_name,
-                    "mobile": mobile
-                },
+# ==================== COINCONNECT CLIENT ====================
+
+class CoinConnectClient:
+    """
+    Application-scoped CoinConnect API client.
+    - One pooled keep-alive httpx client (HTTP/2 when available)
+    - Credentials loaded once and reloaded only after the settings change
+    """
+
+    def __init__(self):
+        self._http = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=COINCONNECT_MAX_CONNECTIONS,
+                max_keepalive_connections=COINCONNECT_MAX_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(COINCONNECT_TIMEOUTS["balance"], connect=COINCONNECT_CONNECT_TIMEOUT)
+        )
+        self._credentials: Optional[Dict[str, Any]] = None
+        self._credentials_generation: Optional[int] = None
+
+    async def credentials(self) -> Dict[str, Any]:
+        generation = await settings_cache.current_generation()
+        if self._credentials is None or generation != self._credentials_generation:
+            self._credentials = await get_coinconnect_credentials()
+            self._credentials_generation = generation
+        return self._credentials
+
+    async def configured(self) -> bool:
+        return bool((await self.credentials()).get("cca_key"))
+
+    async def _post(self, url: str, data: Dict[str, Any], operation: str) -> CoinConnectResponse:
+        creds = await self.credentials()
+        response = await self._http.post(
+            url,
+            json={
+                "data": data,
                 "header": {
                     "cca_key": creds["cca_key"],
                     "cca_secret": creds["cca_secret"]
                 }
-            })
-            result = response.json()
-            if result.get("status") == "OK":
-                return result["message"]["address"]
+            },
+            timeout=httpx.Timeout(COINCONNECT_TIMEOUTS[operation], connect=COINCONNECT_CONNECT_TIMEOUT)
+        )
+        return CoinConnectResponse.model_validate(response.json())
+
+    async def create_user_account(self, email: str, first_name: str, last_name: str, mobile: str) -> CoinConnectResponse:
+        return await self._post(COINCONNECT_CREATE_USER, {
+            "email": email,
+            "first_name": first_name,
+            "last_name": last_name,
+            "mobile": mobile
+        }, "create_user")
+
+    async def get_account_balance(self, address: str) -> CoinConnectResponse:
+        return await self._post(COINCONNECT_BALANCE, {
+            "address": address,
+            "currency": "USDT"
+        }, "balance")
+
+    async def withdraw(self, user_email: str, user_address: str, to_address: str, amount: float, txn_id: str) -> CoinConnectResponse:
+        return await self._post(COINCONNECT_WITHDRAW, {
+            "currency": "USDT",
+            "to_address": to_address,
+            "txn_id": txn_id,
+            "user_address": user_address,
+            "user_email": user_email,
+            "value_in_usd": amount
+        }, "withdraw")
+
+    async def aclose(self):
+        await self._http.aclose()
+
+coinconnect_client: Optional[CoinConnectClient] = None
+
+def get_coinconnect_client() -> CoinConnectClient:
+    global coinconnect_client
+    if coinconnect_client is None:
+        coinconnect_client = CoinConnectClient()
+    return coinconnect_client
+
+async def create_coinconnect_wallet(email: str, first_name: str, last_name: str, mobile: str):
+    cc = get_coinconnect_client()
+    if not await cc.configured():
+        logger.warning("CoinConnect credentials not configured")
+        return None
+    try:
+        result = await cc.create_user_account(email, first_name, last_name, mobile)
+        if result.ok:
+            return result.message["address"]
     except Exception as e:
         logger.error(f"CoinConnect wallet creation error: {e}")
     return None
 
-async def get_wallet_balance(address: str):
-    creds = await get_coinconnect_credentials()
-    if not creds.get("cca_key") or not address:
-        return 0
+async def fetch_wallet_balance(address: str) -> Optional[float]:
+    """Live CoinConnect balance lookup; None when the provider call fails"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(COINCONNECT_BALANCE, json={
-                "data": {
-                    "address": address,
-                    "currency": "USDT"
-                },
-                "header": {
-                    "cca_key": creds["cca_key"],
-                    "cca_secret": creds["cca_secret"]
-                }
-            })
-            result = response.json()
-            if result.get("status") == "OK":
-                return float(result["response"]["data"].get("balance_in_usd", 0))
+        result = await get_coinconnect_client().get_account_balance(address)
+        if result.ok:
+            return float(result.data.get("balance_in_usd", 0))
     except Exception as e:
         logger.error(f"CoinConnect balance check error: {e}")
-    return 0
+    return None
 
-async def process_withdrawal(user_email: str, user_address: str, to_address: str, amount: float, txn_id: str):
-    creds = await get_coinconnect_credentials()
-    if not creds.get("cca_key"):
-        return {"status": "NOTOK", "message": "CoinConnect not configured"}
-    try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(COINCONNECT_WITHDRAW, json={
-                "data": {
-                    "currency": "USDT",
-                    "to_address": to_address,
-                    "txn_id": txn_id,
-                    "user_address": user_address,
-                    "user_email": user_email,
-                    "value_in_usd": amount
-                },
-                "header": {
-                    "cca_key": creds["cca_key"],
-                    "cca_secret": creds["cca_secret"]
-                }
-            })
-            return response.json()
-    except Exception as e:
-        logger.error(f"CoinConnect withdrawal error: {e}")
-        return {"status": "NOTOK", "message": str(e)}
+class BalanceCache:
+    """
+    Per-address cache of external balances.
+    - Entries are reused for `ttl` seconds
+    - A failed lookup returns (0, None) and is remembered for `failure_ttl` seconds, so
+      refreshes during a provider outage don't each wait on the timeout
+    - Single-flight: concurrent requests for one address share the in-flight lookup
+    """
+
+    def __init__(self, ttl: float, max_entries: int, failure_ttl: float):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.failure_ttl = failure_ttl
+        self._entries: Dict[str, tuple] = {}  # address -> (balance, fetched_at)
+        self._failures: Dict[str, float] = {}  # address -> failed_at
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, address: str, force_refresh: bool = False) -> Tuple[float, Optional[float]]:
+        """Return (balance, age in seconds of the value returned); the age is None when the lookup failed"""
+        if not force_refresh:
+            entry = self._entries.get(address)
+            if entry:
+                age = time.monotonic() - entry[1]
+                if age < self.ttl:
+                    return entry[0], age
+            failed_at = self._failures.get(address)
+            if failed_at is not None and time.monotonic() - failed_at < self.failure_ttl:
+                return 0, None
+        
+        task = self._inflight.get(address)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(address))
+            self._inflight[address] = task
+            task.add_done_callback(lambda _: self._inflight.pop(address, None))
+        # Shield so one cancelled caller doesn't cancel the lookup for the others
+        balance = await asyncio.shield(task)
+        if balance is None:
+            return 0, None
+        return balance, 0.0
+
+    async def _fetch(self, address: str) -> Optional[float]:
+        balance = await fetch_wallet_balance(address)
+        if balance is None:
+            self._failures.pop(address, None)
+            self._failures[address] = time.monotonic()
+            while len(self._failures) > self.max_entries:
+                self._failures.pop(next(iter(self._failures)))
+            return None
+        self._failures.pop(address, None)
+        self._entries.pop(address, None)
+        self._entries[address] = (balance, time.monotonic())
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        return balance
+
+    def peek(self, address: str) -> Optional[float]:
+        """The cached balance if it's still fresh, without a lookup"""
+        entry = self._entries.get(address)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def invalidate(self, address: str):
+        self._entries.pop(address, None)
+        self._failures.pop(address, None)
+
+balance_cache = BalanceCache(BALANCE_CACHE_TTL_SECONDS, BALANCE_CACHE_MAX_ENTRIES, BALANCE_FAILURE_TTL_SECONDS)
+
+async def get_wallet_balance(address: str, force_refresh: bool = False) -> float:
+    balance, _ = await get_wallet_balance_with_age(address, force_refresh)
+    return balance
 
-async def get_level_settings():
-    settings = await db.settings.find_one({"type": "levels"}, {"_id": 0})
-    if settings and settings.get("data"):
-        return settings["data"]
+async def get_wallet_balance_with_age(address: str, force_refresh: bool = False) -> Tuple[float, Optional[float]]:
+    """External balance plus its cache age in seconds (None when no lookup was possible or it failed)"""
+    if not address or not await get_coinconnect_client().configured():
+        return 0, None
+    return await balance_cache.get(address, force_refresh)
+
+class WithdrawalNotSent(Exception):
+    """The withdraw request never reached CoinConnect, so no payout can have happened"""
+
+async def process_withdrawal(user_email: str, user_address: str, to_address: str, amount: float, txn_id: str) -> CoinConnectResponse:
+    """
+    Submit a payout. A NOTOK response is a definitive rejection. Raises WithdrawalNotSent
+    when the connection was never made; any other error (timeouts, dropped connections,
+    unreadable responses) propagates, because the payout may or may not have happened.
+    """
+    cc = get_coinconnect_client()
+    if not await cc.configured():
+        return CoinConnectResponse(status="NOTOK", message="CoinConnect not configured")
+    try:
+        return await cc.withdraw(user_email, user_address, to_address, amount, txn_id)
+    except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+        raise WithdrawalNotSent(str(e)) from e
+
+async def get_level_settings() -> List[Dict[str, Any]]:
+    data = await settings_cache.get("levels")
+    if data:
+        return data
     # Default 10 levels with separate activation/renewal percentages
     return [
         {"level": 1, "activation_percentage": 10.0, "renewal_percentage": 10.0, "min_direct_referrals": 0},
@@ -345,16 +1079,16 @@ async def get_level_settings():
         {"level": 10, "activation_percentage": 0.2, "renewal_percentage": 0.2, "min_direct_referrals": 10}
     ]
 
-async def get_subscription_settings():
-    settings = await db.settings.find_one({"type": "subscription"}, {"_id": 0})
-    if settings and settings.get("data"):
-        return settings["data"]
+async def get_subscription_settings() -> Dict[str, Any]:
+    data = await settings_cache.get("subscription")
+    if data:
+        return data
     return {"activation_amount": 100.0, "renewal_amount": 70.0, "grace_period_hours": 48}
 
-async def get_wallet_settings():
-    settings = await db.settings.find_one({"type": "wallet"}, {"_id": 0})
-    if settings and settings.get("data"):
-        return settings["data"]
+async def get_wallet_settings() -> Dict[str, Any]:
+    data = await settings_cache.get("wallet")
+    if data:
+        return data
     return {
         "earnings_to_deposit_fee": 0,
         "deposit_to_earnings_fee": 0,
@@ -364,6 +1098,38 @@ async def get_wallet_settings():
         "min_withdrawal_amount": 10
     }
 
+async def increment_direct_referrals(sponsor_id: str):
+    """Bump the sponsor's direct_referrals counter"""
+    await db.users.update_one({"id": sponsor_id}, {"$inc": {"direct_referrals": 1}})
+    user_cache.invalidate(sponsor_id)
+
+async def reconcile_direct_referrals() -> int:
+    """Repair drift between the direct_referrals counter and the actual sponsor_id links"""
+    actual: Dict[str, int] = {}
+    counts = db.users.aggregate([
+        {"$match": {"sponsor_id": {"$ne": None}}},
+        {"$group": {"_id": "$sponsor_id", "count": {"$sum": 1}}}
+    ])
+    async for row in counts:
+        actual[row["_id"]] = row["count"]
+    
+    repaired = 0
+    ops = []
+    async for user in db.users.find({}, {"_id": 0, "id": 1, "direct_referrals": 1}):
+        count = actual.get(user["id"], 0)
+        if user.get("direct_referrals") != count:
+            ops.append(UpdateOne({"id": user["id"]}, {"$set": {"direct_referrals": count}}))
+        if len(ops) >= 1000:
+            await db.users.bulk_write(ops, ordered=False)
+            repaired += len(ops)
+            ops = []
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        repaired += len(ops)
+    
+    user_cache.clear()
+    return repaired
+
 def get_user_subscription_status(user: dict, grace_period_hours: int = 48) -> str:
     """
     Returns user subscription status:
@@ -385,6 +1151,613 @@ def get_user_subscription_status(user: dict, grace_period_hours: int = 48) -> st
     else:
         return "inactive"
 
+def grace_ends_at_expression(grace_period_hours: int) -> dict:
+    """
+    Aggregation expression for grace_ends_at (native date) from the ISO subscription_expires string.
+    Unparseable legacy values give null, which the sweeper never matches.
+    """
+    return {"$cond": [
+        {"$ifNull": ["$subscription_expires", False]},
+        {"$add": [
+            {"$dateFromString": {"dateString": "$subscription_expires", "onError": None, "onNull": None}},
+            grace_period_hours * 3600 * 1000
+        ]},
+        None
+    ]}
+
+async def refresh_grace_deadlines(grace_period_hours: int, only_missing: bool = False) -> int:
+    """
+    Recompute grace_ends_at from subscription_expires for every subscribed user
+    (after the grace period setting changes), or only for users that predate the field.
+    """
+    query = {"subscription_expires": {"$ne": None}}
+    if only_missing:
+        query["grace_ends_at"] = {"$exists": False}
+    result = await db.users.update_many(
+        query,
+        [{"$set": {"grace_ends_at": grace_ends_at_expression(grace_period_hours)}}]
+    )
+    user_cache.clear()
+    return result.modified_count
+
+# ==================== LEDGER WRITES ====================
+
+_transactions_supported: Optional[bool] = None
+
+async def run_in_transaction(callback):
+    """
+    Run `callback(session)` inside a MongoDB multi-document transaction.
+    Standalone servers can't run transactions; there the callback runs once with
+    session=None and its writes are applied without atomicity.
+    """
+    global _transactions_supported
+    if _transactions_supported is not False:
+        try:
+            async with await client.start_session() as session:
+                result = await session.with_transaction(callback)
+            _transactions_supported = True
+            return result
+        except OperationFailure as e:
+            # IllegalOperation: transaction numbers need a replica set member or mongos
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB transactions unavailable; ledger batches run without a transaction")
+    return await callback(None)
+
+class InsufficientBalance(Exception):
+    """A conditional debit found less than the requested amount in the balance field"""
+
+async def debit_user(user_id: str, field: str, amount: float, credit: Optional[Dict[str, float]] = None,
+                     session=None) -> dict:
+    """
+    Atomically take `amount` from `field` (and apply any same-user `credit`), only if the
+    balance covers it. Returns the updated user; raises InsufficientBalance otherwise,
+    which also aborts an enclosing run_in_transaction.
+    """
+    user = await db.users.find_one_and_update(
+        {"id": user_id, field: {"$gte": amount}},
+        {
+            "$inc": {field: -amount, **(credit or {})},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if user is None:
+        raise InsufficientBalance(field)
+    return user
+
+async def current_balance(user_id: str, field: str) -> float:
+    """Fresh balance for an error message after a failed conditional debit"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, field: 1})
+    return (user or {}).get(field, 0)
+
+# ==================== BACKGROUND TASKS ====================
+
+class PeriodicTask:
+    """
+    Runs `job()` every `interval` seconds on the event loop until stopped, the first time
+    after `initial_delay` seconds; failures are logged, not fatal
+    """
+
+    def __init__(self, name: str, interval: float, job, initial_delay: float = 0):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self.initial_delay = initial_delay
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                await self.job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+            await asyncio.sleep(self.interval)
+
+async def acquire_lease(name: str, owner: str, seconds: float) -> bool:
+    """
+    Take or renew the named lease in db.job_leases for `owner`, a token unique to one run
+    of the job. Returns False while any other run (in this process or another) holds an
+    unexpired lease, so only one run does the job at a time.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.find_one_and_update(
+            {"id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists and is held by someone else, so the upsert collided
+        return False
+
+async def release_lease(name: str, owner: str):
+    """Give the lease up, only if `owner` still holds it"""
+    await db.job_leases.update_one(
+        {"id": name, "owner": owner},
+        {"$set": {"expires_at": datetime.now(timezone.utc)}}
+    )
+
+# ==================== PLATFORM STATS ====================
+
+PLATFORM_STATS_ID = "platform"
+PLATFORM_STATS_FIELDS = ["total_users", "active_users", "total_income", "total_withdrawals"]
+
+async def increment_platform_stats(inc: Dict[str, float], session=None):
+    """Apply $inc to the platform_stats document, alongside the write that changed the totals"""
+    inc = {k: v for k, v in inc.items() if v}
+    if not inc:
+        return
+    await db.platform_stats.update_one(
+        {"id": PLATFORM_STATS_ID},
+        {"$inc": inc, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+        session=session
+    )
+
+async def compute_platform_stats() -> Dict[str, float]:
+    """Full recount of the admin dashboard totals from users and the transaction log"""
+    total_users = await db.users.count_documents({})
+    active_users = await db.users.count_documents({"is_active": True})
+    total_income = await db.transactions.aggregate([
+        {"$match": {"type": {"$in": ["activation", "renewal"]}}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    
+    total_withdrawals = await db.transactions.aggregate([
+        {"$match": {"type": "withdrawal", "status": "completed"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    
+    return {
+        "total_users": total_users,
+        "active_users": active_users,
+        "total_income": total_income[0]["total"] if total_income else 0,
+        "total_withdrawals": total_withdrawals[0]["total"] if total_withdrawals else 0
+    }
+
+async def verify_platform_stats() -> Dict[str, Any]:
+    """
+    Recount the totals and overwrite the counters if they drifted.
+    Increments that land while the recount runs may be lost; the next run picks them up.
+    """
+    computed = await compute_platform_stats()
+    stored = await db.platform_stats.find_one({"id": PLATFORM_STATS_ID}, {"_id": 0}) or {}
+    drift = {
+        field: computed[field] - stored.get(field, 0)
+        for field in PLATFORM_STATS_FIELDS
+        if abs(computed[field] - stored.get(field, 0)) > 1e-6
+    }
+    now = datetime.now(timezone.utc).isoformat()
+    update = {"verified_at": now}
+    if drift or not stored:
+        if stored:
+            logger.warning(f"Platform stats drifted, repairing: {drift}")
+        update.update(computed)
+        update["updated_at"] = now
+    await db.platform_stats.update_one({"id": PLATFORM_STATS_ID}, {"$set": update}, upsert=True)
+    return {"repaired": bool(drift), "drift": drift, "stats": computed}
+
+async def get_platform_stats() -> dict:
+    """Point read of the counters; the first read on a fresh deployment seeds them by recounting"""
+    stats = await db.platform_stats.find_one({"id": PLATFORM_STATS_ID}, {"_id": 0})
+    if not stats or not stats.get("verified_at"):
+        await verify_platform_stats()
+        stats = await db.platform_stats.find_one({"id": PLATFORM_STATS_ID}, {"_id": 0})
+    return stats
+
+async def scheduled_platform_stats_verification() -> Optional[Dict[str, Any]]:
+    """
+    Periodic recount, at most once per interval across every worker: the lease is held
+    (not released) for most of the interval, so the other workers' ticks skip it.
+    """
+    lease_seconds = PLATFORM_STATS_VERIFY_INTERVAL_SECONDS * 0.9
+    if not await acquire_lease("platform_stats_verifier", str(uuid.uuid4()), lease_seconds):
+        return None
+    return await verify_platform_stats()
+
+# First run one interval after boot; a fresh deployment is seeded by get_platform_stats
+platform_stats_verifier = PeriodicTask(
+    "Platform stats verification", PLATFORM_STATS_VERIFY_INTERVAL_SECONDS,
+    scheduled_platform_stats_verification, initial_delay=PLATFORM_STATS_VERIFY_INTERVAL_SECONDS
+)
+
+# ==================== INCOME SUMMARY ====================
+
+def income_summary_increments(transaction: dict) -> Dict[str, float]:
+    """$inc fields for a user's income summary when this ledger row is written"""
+    amount = transaction["amount"]
+    if transaction["type"] == "level_income":
+        inc = {
+            f"level_totals.{transaction['level']}": amount,
+            f"level_counts.{transaction['level']}": 1,
+            "level_income_total": amount,
+            "level_income_count": 1
+        }
+        if transaction.get("income_type"):
+            inc[f"income_by_type.{transaction['income_type']}"] = amount
+        if transaction.get("status") == "pending_grace":
+            inc["pending_grace_total"] = amount
+        return inc
+    if transaction["type"] == "additional_commission":
+        return {"additional_commission_total": amount, "additional_commission_count": 1}
+    return {}
+
+def income_summary_update(user_id: str, update: dict) -> UpdateOne:
+    update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return UpdateOne({"user_id": user_id}, update, upsert=True)
+
+def build_income_summary(user_id: str, rows: List[dict]) -> dict:
+    """Summary document from ledger rows grouped by type, level, income_type and status"""
+    summary = {
+        "user_id": user_id,
+        "level_totals": {},
+        "level_counts": {},
+        "income_by_type": {},
+        "level_income_total": 0,
+        "level_income_count": 0,
+        "pending_grace_total": 0,
+        "forfeited_total": 0,
+        "additional_commission_total": 0,
+        "additional_commission_count": 0
+    }
+    for row in rows:
+        if row["type"] == "level_income":
+            level = str(row.get("level"))
+            summary["level_totals"][level] = summary["level_totals"].get(level, 0) + row["total"]
+            summary["level_counts"][level] = summary["level_counts"].get(level, 0) + row["count"]
+            summary["level_income_total"] += row["total"]
+            summary["level_income_count"] += row["count"]
+            if row.get("income_type"):
+                income_type = row["income_type"]
+                summary["income_by_type"][income_type] = summary["income_by_type"].get(income_type, 0) + row["total"]
+            if row.get("status") == "pending_grace":
+                summary["pending_grace_total"] += row["total"]
+            elif row.get("status") == "forfeited":
+                summary["forfeited_total"] += row["total"]
+        elif row["type"] == "additional_commission":
+            summary["additional_commission_total"] += row["total"]
+            summary["additional_commission_count"] += row["count"]
+    return summary
+
+async def rebuild_income_summaries(user_id: Optional[str] = None) -> int:
+    """Recompute user_income_summary from the transaction log (one user, or everyone)"""
+    match = {"type": {"$in": ["level_income", "additional_commission"]}}
+    if user_id:
+        match["user_id"] = user_id
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "type": "$type",
+                "level": "$level",
+                "income_type": "$income_type",
+                "status": "$status"
+            },
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.user_id",
+            "rows": {"$push": {
+                "type": "$_id.type",
+                "level": "$_id.level",
+                "income_type": "$_id.income_type",
+                "status": "$_id.status",
+                "total": "$total",
+                "count": "$count"
+            }}
+        }}
+    ]
+    
+    rebuilt = 0
+    seen_target = False
+    ops = []
+    async for row in db.transactions.aggregate(pipeline, allowDiskUse=True):
+        seen_target = seen_target or row["_id"] == user_id
+        summary = build_income_summary(row["_id"], row["rows"])
+        summary["rebuilt_at"] = summary["updated_at"] = datetime.now(timezone.utc).isoformat()
+        ops.append(ReplaceOne({"user_id": row["_id"]}, summary, upsert=True))
+        if len(ops) >= 1000:
+            await db.user_income_summary.bulk_write(ops, ordered=False)
+            rebuilt += len(ops)
+            ops = []
+    # A single user with no income still gets a (zero) summary so it isn't rebuilt again
+    if user_id and not seen_target:
+        summary = build_income_summary(user_id, [])
+        summary["rebuilt_at"] = summary["updated_at"] = datetime.now(timezone.utc).isoformat()
+        ops.append(ReplaceOne({"user_id": user_id}, summary, upsert=True))
+    if ops:
+        await db.user_income_summary.bulk_write(ops, ordered=False)
+        rebuilt += len(ops)
+    return rebuilt
+
+async def get_income_summary(user_id: str) -> dict:
+    """
+    Point read of the user's income summary. Summaries that predate this document
+    (no rebuilt_at) are rebuilt from the ledger on first read.
+    """
+    summary = await db.user_income_summary.find_one({"user_id": user_id}, {"_id": 0})
+    if not summary or not summary.get("rebuilt_at"):
+        await rebuild_income_summaries(user_id)
+        summary = await db.user_income_summary.find_one({"user_id": user_id}, {"_id": 0})
+    return summary
+
+class LedgerBatch:
+    """
+    Collects balance increments and ledger rows for a payout, then applies them
+    with one users.bulk_write and one transactions.insert_many in a single transaction.
+    """
+
+    def __init__(self):
+        self.user_ids: List[str] = []
+        self.user_ops: List[UpdateOne] = []
+        self.transactions: List[dict] = []
+        self.summary_ops: List[UpdateOne] = []
+
+    def add(self, user_id: str, inc: Dict[str, float], transaction: dict):
+        now = datetime.now(timezone.utc).isoformat()
+        self.user_ids.append(user_id)
+        self.user_ops.append(UpdateOne(
+            {"id": user_id},
+            {"$inc": inc, "$set": {"updated_at": now}}
+        ))
+        self.transactions.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            **transaction,
+            "created_at": now,
+            "updated_at": now
+        })
+        summary_inc = income_summary_increments(transaction)
+        if summary_inc:
+            self.summary_ops.append(income_summary_update(user_id, {"$inc": summary_inc}))
+
+    async def commit(self):
+        if not self.user_ops and not self.transactions:
+            return
+        
+        async def apply(session):
+            if self.user_ops:
+                await db.users.bulk_write(self.user_ops, ordered=False, session=session)
+            if self.transactions:
+                # Copies so a retried transaction doesn't reuse the _id of an aborted attempt
+                await db.transactions.insert_many([dict(t) for t in self.transactions], session=session)
+            if self.summary_ops:
+                await db.user_income_summary.bulk_write(self.summary_ops, ordered=False, session=session)
+        
+        await run_in_transaction(apply)
+        user_cache.invalidate(*self.user_ids)
+
+async def get_user_ancestors(user: dict) -> List[str]:
+    """
+    Return the user's upline ids ordered nearest first (sponsor, sponsor's sponsor, ...).
+    Users created before ancestor paths existed get theirs computed by walking the
+    sponsor chain once, then persisted.
+    """
+    if user.get("ancestors") is not None:
+        return user["ancestors"]
+    
+    ancestors = []
+    seen = {user["id"]}
+    sponsor_id = user.get("sponsor_id")
+    while sponsor_id and sponsor_id not in seen:
+        sponsor = await db.users.find_one(
+            {"id": sponsor_id},
+            {"_id": 0, "id": 1, "sponsor_id": 1, "ancestors": 1}
+        )
+        if not sponsor:
+            break
+        ancestors.append(sponsor_id)
+        seen.add(sponsor_id)
+        if sponsor.get("ancestors") is not None:
+            # Reuse the sponsor's materialized path for the rest of the chain
+            for ancestor_id in sponsor["ancestors"]:
+                if ancestor_id in seen:
+                    break
+                ancestors.append(ancestor_id)
+                seen.add(ancestor_id)
+            break
+        sponsor_id = sponsor.get("sponsor_id")
+    
+    await db.users.update_one({"id": user["id"]}, {"$set": {"ancestors": ancestors}})
+    user_cache.invalidate(user["id"])
+    return ancestors
+
+async def iter_upline(ancestors: List[str], projection: dict):
+    """Yield upline user documents in ancestor order, loading them in batches with one $in query each"""
+    for start in range(0, len(ancestors), UPLINE_FETCH_BATCH):
+        batch_ids = ancestors[start:start + UPLINE_FETCH_BATCH]
+        docs = await db.users.find({"id": {"$in": batch_ids}}, projection).to_list(len(batch_ids))
+        docs_by_id = {doc["id"]: doc for doc in docs}
+        for ancestor_id in batch_ids:
+            doc = docs_by_id.get(ancestor_id)
+            if not doc:
+                return
+            yield doc
+
+async def backfill_ancestors() -> int:
+    """
+    Migration: compute the ancestors array for every user.
+    Walks the tree top-down from users without a sponsor, one generation per pass,
+    then falls back to a chain walk for anything unreachable (orphaned sponsors).
+    """
+    updated = 0
+    frontier: Dict[str, List[str]] = {}
+    
+    roots = db.users.find({"sponsor_id": None}, {"_id": 0, "id": 1})
+    ops = []
+    async for root in roots:
+        frontier[root["id"]] = []
+        ops.append(UpdateOne({"id": root["id"]}, {"$set": {"ancestors": []}}))
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        updated += len(ops)
+    
+    while frontier:
+        next_frontier: Dict[str, List[str]] = {}
+        frontier_ids = list(frontier.keys())
+        for start in range(0, len(frontier_ids), 1000):
+            chunk = frontier_ids[start:start + 1000]
+            children = db.users.find({"sponsor_id": {"$in": chunk}}, {"_id": 0, "id": 1, "sponsor_id": 1})
+            ops = []
+            async for child in children:
+                ancestors = [child["sponsor_id"]] + frontier[child["sponsor_id"]]
+                next_frontier[child["id"]] = ancestors
+                ops.append(UpdateOne({"id": child["id"]}, {"$set": {"ancestors": ancestors}}))
+            if ops:
+                await db.users.bulk_write(ops, ordered=False)
+                updated += len(ops)
+        frontier = next_frontier
+    
+    unreachable = db.users.find(
+        {"ancestors": {"$exists": False}},
+        {"_id": 0, "id": 1, "sponsor_id": 1}
+    )
+    async for user in unreachable:
+        await get_user_ancestors(user)
+        updated += 1
+    
+    user_cache.clear()
+    return updated
+
+async def increment_team_counters(ancestors: List[str]):
+    """A user joined below these ancestors: bump team_size on all, and the per-level count on the first 10"""
+    if not ancestors:
+        return
+    ops = [
+        UpdateOne({"id": ancestor_id}, {"$inc": {"team_size": 1, f"team_level_counts.{depth}": 1}})
+        for depth, ancestor_id in enumerate(ancestors[:MAX_INCOME_LEVELS], start=1)
+    ]
+    if len(ancestors) > MAX_INCOME_LEVELS:
+        ops.append(UpdateMany({"id": {"$in": ancestors[MAX_INCOME_LEVELS:]}}, {"$inc": {"team_size": 1}}))
+    await db.users.bulk_write(ops, ordered=False)
+    user_cache.invalidate(*ancestors)
+
+async def attach_downline(user_id: str, ancestors: List[str]) -> int:
+    """
+    A user without a sponsor got one: append the new upline to every descendant's
+    ancestors and count them on it. Returns the number of descendants moved.
+    """
+    # Descendants by position of user_id in their path (0 = direct referral)
+    depths = await db.users.aggregate([
+        {"$match": {"ancestors": user_id}},
+        {"$group": {"_id": {"$indexOfArray": ["$ancestors", user_id]}, "count": {"$sum": 1}}}
+    ]).to_list(None)
+    if not depths:
+        return 0
+    
+    # user_id was a root, so it ends every descendant's path
+    await db.users.update_many({"ancestors": user_id}, {"$push": {"ancestors": {"$each": ancestors}}})
+    moved = sum(row["count"] for row in depths)
+    ops = []
+    for depth, ancestor_id in enumerate(ancestors, start=1):
+        inc = {"team_size": moved}
+        for row in depths:
+            level = depth + row["_id"] + 1
+            if level <= MAX_INCOME_LEVELS:
+                inc[f"team_level_counts.{level}"] = row["count"]
+        ops.append(UpdateOne({"id": ancestor_id}, {"$inc": inc}))
+    await db.users.bulk_write(ops, ordered=False)
+    user_cache.clear()
+    return moved
+
+async def rebuild_team_counters() -> int:
+    """Recompute team_size and team_level_counts for every user from the ancestor paths"""
+    if await db.users.find_one({"ancestors": {"$exists": False}}, {"_id": 1}):
+        await backfill_ancestors()
+    
+    marker = str(uuid.uuid4())
+    pipeline = [
+        {"$match": {"ancestors.0": {"$exists": True}}},
+        {"$unwind": {"path": "$ancestors", "includeArrayIndex": "depth"}},
+        {"$group": {
+            "_id": {
+                "ancestor": "$ancestors",
+                "level": {"$cond": [{"$lt": ["$depth", MAX_INCOME_LEVELS]}, {"$add": ["$depth", 1]}, None]}
+            },
+            "count": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.ancestor",
+            "team_size": {"$sum": "$count"},
+            "levels": {"$push": {"level": "$_id.level", "count": "$count"}}
+        }}
+    ]
+    
+    rebuilt = 0
+    ops = []
+    async for row in db.users.aggregate(pipeline, allowDiskUse=True):
+        level_counts = {str(item["level"]): item["count"] for item in row["levels"] if item["level"] is not None}
+        ops.append(UpdateOne({"id": row["_id"]}, {"$set": {
+            "team_size": row["team_size"],
+            "team_level_counts": level_counts,
+            "team_counts_rebuild": marker
+        }}))
+        if len(ops) >= 1000:
+            await db.users.bulk_write(ops, ordered=False)
+            rebuilt += len(ops)
+            ops = []
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        rebuilt += len(ops)
+    
+    # Everyone not touched above has no downline; this also clears markers left by an interrupted run
+    await db.users.update_many(
+        {"team_counts_rebuild": {"$ne": marker}},
+        {"$set": {"team_size": 0, "team_level_counts": {}}, "$unset": {"team_counts_rebuild": ""}}
+    )
+    await db.users.update_many({"team_counts_rebuild": marker}, {"$unset": {"team_counts_rebuild": ""}})
+    user_cache.clear()
+    return rebuilt
+
+async def migrate_team_tree():
+    """
+    Fill in ancestors and team counters for users that predate them, once per deployment.
+    Runs in the background at startup under the "team_tree_migration" lease, so only one
+    worker rebuilds.
+    """
+    if await db.job_leases.find_one({"id": "team_tree_migration", "completed_at": {"$ne": None}}, {"_id": 1}):
+        return
+    lease_owner = str(uuid.uuid4())
+    if not await acquire_lease("team_tree_migration", lease_owner, TEAM_MIGRATION_LEASE_SECONDS):
+        return
+    try:
+        legacy = {"$or": [{"ancestors": {"$exists": False}}, {"team_size": {"$exists": False}}]}
+        if await db.users.find_one(legacy, {"_id": 1}):
+            # Backfills ancestors first when any are missing
+            rebuilt = await rebuild_team_counters()
+            logger.info(f"Team counters rebuilt for {rebuilt} users")
+        # Users created from here on start with counters, so later startups can skip the scan
+        await db.job_leases.update_one(
+            {"id": "team_tree_migration"},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}}
+        )
+    except Exception as e:
+        logger.error(f"Team tree migration failed: {e}")
+    finally:
+        await release_lease("team_tree_migration", lease_owner)
+
+_team_tree_migration: Optional[asyncio.Task] = None
+
 async def distribute_level_income(user_id: str, amount: float, income_type: str):
     """Distribute income to upline sponsors based on level settings
     income_type: 'activation' or 'renewal'
@@ -392,29 +1765,32 @@ async def distribute_level_income(user_id: str, amount: float, income_type: str)
     Features:
     - Compression: Skip inactive users, pass income to next active upline
     - Grace Period: Users in grace period get income stored in temporary_wallet
+    - All credits (including additional commissions) are committed as one ledger batch
     """
     level_settings = await get_level_settings()
     sub_settings = await get_subscription_settings()
     grace_period_hours = sub_settings.get("grace_period_hours", 48)
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1, "sponsor_id": 1, "ancestors": 1})
     if not user or not user.get("sponsor_id"):
         return
     
-    current_sponsor_id = user["sponsor_id"]
+    # Whole upline comes from the materialized ancestor path; compression is resolved in memory
+    ancestors = await get_user_ancestors(user)
+    batch = LedgerBatch()
     level = 1
     
-    while current_sponsor_id and level <= 10:
-        sponsor = await db.users.find_one({"id": current_sponsor_id}, {"_id": 0})
-        if not sponsor:
+    upline_projection = {"_id": 0, "id": 1, "subscription_expires": 1, "direct_referrals": 1}
+    async for sponsor in iter_upline(ancestors, upline_projection):
+        if level > MAX_INCOME_LEVELS:
             break
+        current_sponsor_id = sponsor["id"]
         
         # Get sponsor's subscription status
         sponsor_status = get_user_subscription_status(sponsor, grace_period_hours)
         
         # COMPRESSION: If sponsor is inactive, skip to next upline (don't increment level)
         if sponsor_status == "inactive":
-            current_sponsor_id = sponsor.get("sponsor_id")
             continue  # Skip this sponsor, don't increment level
         
         # Check if sponsor qualifies for this level income
@@ -422,9 +1798,7 @@ async def distribute_level_income(user_id: str, amount: float, income_type: str)
         if not level_config:
             break
         
-        sponsor_direct_referrals = await db.users.count_documents({"sponsor_id": current_sponsor_id})
-        
-        if sponsor_direct_referrals >= level_config["min_direct_referrals"]:
+        if sponsor.get("direct_referrals", 0) >= level_config["min_direct_referrals"]:
             # Use appropriate percentage based on income type
             if income_type == "activation":
                 percentage = level_config.get("activation_percentage", level_config.get("percentage", 0))
@@ -435,65 +1809,59 @@ async def distribute_level_income(user_id: str, amount: float, income_type: str)
             
             if sponsor_status == "active":
                 # Active user: Add to main wallet
-                await db.users.update_one(
-                    {"id": current_sponsor_id},
+                batch.add(
+                    current_sponsor_id,
+                    {"wallet_balance": income, "total_income": income},
                     {
-                        "$inc": {"wallet_balance": income, "total_income": income},
-                        "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                        "type": "level_income",
+                        "amount": income,
+                        "level": level,
+                        "from_user_id": user_id,
+                        "income_type": income_type,
+                        "status": "completed"
                     }
                 )
-                
-                # Record income transaction
-                await db.transactions.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "user_id": current_sponsor_id,
-                    "type": "level_income",
-                    "amount": income,
-                    "level": level,
-                    "from_user_id": user_id,
-                    "income_type": income_type,
-                    "status": "completed",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                })
             
             elif sponsor_status == "grace_period":
-                # Grace period: Store in temporary wallet
-                await db.users.update_one(
-                    {"id": current_sponsor_id},
+                # Grace period: Store in temporary wallet, recorded as pending until renewal or forfeit
+                batch.add(
+                    current_sponsor_id,
+                    {"temporary_wallet": income},
                     {
-                        "$inc": {"temporary_wallet": income},
-                        "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                        "type": "level_income",
+                        "amount": income,
+                        "level": level,
+                        "from_user_id": user_id,
+                        "income_type": income_type,
+                        "status": "pending_grace"
                     }
                 )
-                
-                # Record as pending transaction
-                await db.transactions.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "user_id": current_sponsor_id,
-                    "type": "level_income",
-                    "amount": income,
-                    "level": level,
-                    "from_user_id": user_id,
-                    "income_type": income_type,
-                    "status": "pending_grace",  # Pending until renewal or forfeit
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                })
         
-        current_sponsor_id = sponsor.get("sponsor_id")
         level += 1
     
     # Also distribute additional commissions
-    await distribute_additional_commissions(user_id, amount, income_type)
+    await distribute_additional_commissions(user_id, amount, income_type, batch)
+    await batch.commit()
+
+async def load_additional_commission_roster() -> List[dict]:
+    """Configured additional commissions with at least one non-zero percentage"""
+    return await db.additional_commissions.find(
+        {"$or": [{"activation_percentage": {"$gt": 0}}, {"renewal_percentage": {"$gt": 0}}]},
+        {"_id": 0, "user_id": 1, "activation_percentage": 1, "renewal_percentage": 1}
+    ).to_list(None)
+
+async def get_additional_commission_roster() -> List[dict]:
+    """
+    The additional-commission roster from the settings cache. Target users are checked
+    when the commission is configured, so payouts don't re-check them.
+    """
+    return await settings_cache.get_or_load("additional_commissions", load_additional_commission_roster)
 
-async def distribute_additional_commissions(user_id: str, amount: float, income_type: str):
-    """Distribute additional commissions to specially configured users"""
-    additional_commissions = await db.additional_commissions.find({}, {"_id": 0}).to_list(1000)
+async def distribute_additional_commissions(user_id: str, amount: float, income_type: str, batch: "LedgerBatch"):
+    """Add additional commissions for specially configured users to the payout batch"""
+    additional_commissions = await get_additional_commission_roster()
     
     for commission in additional_commissions:
-        target_user = await db.users.find_one({"id": commission["user_id"]}, {"_id": 0})
-        if not target_user:
-            continue
-        
         # Get percentage based on income type
         if income_type == "activation":
             percentage = commission.get("activation_percentage", 0)
@@ -505,26 +1873,17 @@ async def distribute_additional_commissions(user_id: str, amount: float, income_
         
         income = amount * (percentage / 100)
         
-        # Update user's wallet balance and total income
-        await db.users.update_one(
-            {"id": commission["user_id"]},
+        batch.add(
+            commission["user_id"],
+            {"wallet_balance": income, "total_income": income},
             {
-                "$inc": {"wallet_balance": income, "total_income": income},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                "type": "additional_commission",
+                "amount": income,
+                "from_user_id": user_id,
+                "income_type": income_type,
+                "status": "completed"
             }
         )
-        
-        # Record additional commission transaction
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": commission["user_id"],
-            "type": "additional_commission",
-            "amount": income,
-            "from_user_id": user_id,
-            "income_type": income_type,
-            "status": "completed",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
 
 async def flush_temporary_wallet(user_id: str):
     """
@@ -537,118 +1896,702 @@ async def flush_temporary_wallet(user_id: str):
     
     temp_balance = user.get("temporary_wallet", 0)
     if temp_balance > 0:
-        # Move temporary wallet to main wallet
-        await db.users.update_one(
-            {"id": user_id},
-            {
-                "$inc": {"wallet_balance": temp_balance, "total_income": temp_balance},
-                "$set": {"temporary_wallet": 0, "updated_at": datetime.now(timezone.utc).isoformat()}
-            }
+        now = datetime.now(timezone.utc).isoformat()
+        
+        async def apply(session):
+            # Move temporary wallet to main wallet
+            await db.users.update_one(
+                {"id": user_id},
+                {
+                    "$inc": {"wallet_balance": temp_balance, "total_income": temp_balance},
+                    "$set": {"temporary_wallet": 0, "updated_at": now}
+                },
+                session=session
+            )
+            
+            # Update pending_grace transactions to completed
+            await db.transactions.update_many(
+                {"user_id": user_id, "status": "pending_grace"},
+                {"$set": {"status": "completed", "flushed_at": now, "updated_at": now}},
+                session=session
+            )
+            
+            # Record flush transaction
+            await db.transactions.insert_one({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "type": "grace_period_flush",
+                "amount": temp_balance,
+                "status": "completed",
+                "created_at": now,
+                "updated_at": now
+            }, session=session)
+            
+            await db.user_income_summary.bulk_write(
+                [income_summary_update(user_id, {"$set": {"pending_grace_total": 0}})],
+                session=session
+            )
+        
+        await run_in_transaction(apply)
+        user_cache.invalidate(user_id)
+
+async def forfeit_grace_batch(users: List[dict], now: datetime) -> Tuple[int, float]:
+    """
+    Forfeit the temporary wallets of `users` ({"id", "temporary_wallet"} as read by the
+    sweeper). A wallet is only zeroed if it and the expired grace period are unchanged,
+    and every zeroed user is tagged with this run's token. The ledger rows, pending_grace
+    status changes and summary updates are then written for exactly the tagged users, so
+    the batch stays consistent without a transaction too. Users that renewed or gained
+    income since the read are left for the next sweep. Returns (users, amount) forfeited.
+    """
+    run = str(uuid.uuid4())
+    now_iso = now.isoformat()
+    user_ids = [u["id"] for u in users]
+    amounts = {u["id"]: u["temporary_wallet"] for u in users}
+    user_ops = [
+        UpdateOne(
+            {"id": u["id"], "temporary_wallet": u["temporary_wallet"], "grace_ends_at": {"$lte": now}},
+            {"$set": {"temporary_wallet": 0, "grace_forfeit_run": run, "updated_at": now_iso}}
         )
+        for u in users
+    ]
+    
+    async def apply(session):
+        await db.users.bulk_write(user_ops, ordered=False, session=session)
+        tagged = {"id": {"$in": user_ids}, "grace_forfeit_run": run}
+        forfeited = [u["id"] for u in await db.users.find(tagged, {"_id": 0, "id": 1}, session=session).to_list(len(user_ids))]
+        if not forfeited:
+            return []
         
-        # Update pending_grace transactions to completed
+        # Update pending_grace transactions to forfeited
         await db.transactions.update_many(
-            {"user_id": user_id, "status": "pending_grace"},
-            {"$set": {"status": "completed", "flushed_at": datetime.now(timezone.utc).isoformat()}}
+            {"user_id": {"$in": forfeited}, "status": "pending_grace"},
+            {"$set": {"status": "forfeited", "forfeited_at": now_iso, "updated_at": now_iso}},
+            session=session
         )
-        
-        # Record flush transaction
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "type": "grace_period_flush",
-            "amount": temp_balance,
-            "status": "completed",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        await db.transactions.insert_many([
+            {
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "type": "grace_period_forfeit",
+                "amount": amounts[user_id],
+                "status": "completed",
+                "created_at": now_iso,
+                "updated_at": now_iso
+            }
+            for user_id in forfeited
+        ], session=session)
+        await db.user_income_summary.bulk_write([
+            income_summary_update(user_id, {
+                "$set": {"pending_grace_total": 0},
+                "$inc": {"forfeited_total": amounts[user_id]}
+            })
+            for user_id in forfeited
+        ], ordered=False, session=session)
+        await db.users.update_many(tagged, {"$unset": {"grace_forfeit_run": ""}}, session=session)
+        return forfeited
+    
+    try:
+        forfeited = await run_in_transaction(apply)
+    finally:
+        user_cache.invalidate(*user_ids)
+    return len(forfeited), sum(amounts[user_id] for user_id in forfeited)
 
-async def forfeit_temporary_wallet(user_id: str):
+async def forfeit_temporary_wallet(user_id: str) -> float:
     """
     Forfeit temporary wallet when grace period expires without renewal.
     Income is lost forever.
     """
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    now = datetime.now(timezone.utc)
+    user = await db.users.find_one(
+        {"id": user_id, "temporary_wallet": {"$gt": 0}, "grace_ends_at": {"$lte": now}},
+        {"_id": 0, "id": 1, "temporary_wallet": 1}
+    )
     if not user:
-        return
+        return 0
+    _, amount = await forfeit_grace_batch([user], now)
+    return amount
+
+_grace_deadlines_backfilled = False
+
+async def sweep_expired_grace_periods() -> Optional[Dict[str, float]]:
+    """
+    Forfeit every temporary wallet whose grace period has ended, GRACE_SWEEP_BATCH users
+    at a time. Guarded by the "grace_sweeper" lease so concurrent workers don't overlap;
+    returns None when another worker holds it. Safe to re-run: forfeited wallets are 0
+    and drop out of the query.
+    """
+    global _grace_deadlines_backfilled
+    lease_owner = str(uuid.uuid4())
+    if not await acquire_lease("grace_sweeper", lease_owner, GRACE_SWEEP_LEASE_SECONDS):
+        return None
     
-    temp_balance = user.get("temporary_wallet", 0)
-    if temp_balance > 0:
-        # Clear temporary wallet (income is forfeited)
-        await db.users.update_one(
-            {"id": user_id},
-            {
-                "$set": {"temporary_wallet": 0, "updated_at": datetime.now(timezone.utc).isoformat()}
-            }
-        )
-        
-        # Update pending_grace transactions to forfeited
-        await db.transactions.update_many(
-            {"user_id": user_id, "status": "pending_grace"},
-            {"$set": {"status": "forfeited", "forfeited_at": datetime.now(timezone.utc).isoformat()}}
-        )
+    forfeited_count = 0
+    forfeited_total = 0.0
+    try:
+        if not _grace_deadlines_backfilled:
+            # Users missing a deadline are swept next time; the ones that have one still are now
+            try:
+                sub_settings = await get_subscription_settings()
+                await refresh_grace_deadlines(sub_settings.get("grace_period_hours", 48), only_missing=True)
+                _grace_deadlines_backfilled = True
+            except PyMongoError as e:
+                logger.error(f"Grace deadline backfill failed: {e}")
         
-        # Record forfeit transaction
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "type": "grace_period_forfeit",
-            "amount": temp_balance,
-            "status": "completed",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        now = datetime.now(timezone.utc)
+        while True:
+            users = await db.users.find(
+                {"temporary_wallet": {"$gt": 0}, "grace_ends_at": {"$lte": now}},
+                {"_id": 0, "id": 1, "temporary_wallet": 1}
+            ).sort("grace_ends_at", ASCENDING).limit(GRACE_SWEEP_BATCH).to_list(GRACE_SWEEP_BATCH)
+            if not users:
+                break
+            
+            count, amount = await forfeit_grace_batch(users, now)
+            forfeited_count += count
+            forfeited_total += amount
+            if not count:
+                # Everyone in the batch changed since it was read; the next sweep re-reads them
+                break
+            
+            if not await acquire_lease("grace_sweeper", lease_owner, GRACE_SWEEP_LEASE_SECONDS):
+                break
+    finally:
+        await release_lease("grace_sweeper", lease_owner)
+    
+    if forfeited_count:
+        logger.info(f"Grace sweeper forfeited {forfeited_total} from {forfeited_count} users")
+    return {"forfeited_count": forfeited_count, "forfeited_total": forfeited_total}
+
+grace_sweeper = PeriodicTask("Grace period sweep", GRACE_SWEEP_INTERVAL_SECONDS, sweep_expired_grace_periods)
+
+class ActivationConflict(Exception):
+    """Another caller activated or renewed the subscription after we read it"""
 
-async def check_and_activate_user(user_id: str):
-    """Check user's deposit and activate subscription if sufficient"""
+_activation_inflight: Dict[str, asyncio.Future] = {}
+
+def activation_requirement(user: dict, sub_settings: dict) -> Tuple[float, str]:
+    """Deposit the user needs now and the income type it's recorded as: renewal or activation"""
+    current_status = get_user_subscription_status(user, sub_settings.get("grace_period_hours", 48))
+    if current_status in ["active", "grace_period"]:
+        return sub_settings["renewal_amount"], "renewal"
+    return sub_settings["activation_amount"], "activation"
+
+async def check_and_activate_user(user_id: str) -> bool:
+    """
+    Check user's deposit and activate subscription if sufficient.
+    Single-flight per user: concurrent calls in this process share one balance
+    lookup and one activation, and all get its result.
+    """
+    task = _activation_inflight.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(_activate_if_funded(user_id))
+        _activation_inflight[user_id] = task
+        task.add_done_callback(lambda _: _activation_inflight.pop(user_id, None))
+    # Shield so one cancelled caller doesn't abandon the activation for the others
+    return await asyncio.shield(task)
+
+async def _activate_if_funded(user_id: str) -> bool:
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user or not user.get("wallet_address"):
         return False
     
-    balance = await get_wallet_balance(user["wallet_address"])
+    # Activation decisions always use a live balance
+    balance = await get_wallet_balance(user["wallet_address"], force_refresh=True)
     sub_settings = await get_subscription_settings()
     grace_period_hours = sub_settings.get("grace_period_hours", 48)
     
-    # Determine if this is activation or renewal
     current_status = get_user_subscription_status(user, grace_period_hours)
-    is_renewal = current_status in ["active", "grace_period"]
-    required_amount = sub_settings["renewal_amount"] if is_renewal else sub_settings["activation_amount"]
-    income_type = "renewal" if is_renewal else "activation"
+    required_amount, income_type = activation_requirement(user, sub_settings)
     
     if balance >= required_amount:
         expires = datetime.now(timezone.utc) + timedelta(days=30)
-        await db.users.update_one(
-            {"id": user_id},
-            {
-                "$set": {
-                    "is_active": True,
-                    "subscription_expires": expires.isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
-        )
+        
+        async def apply(session):
+            # Guarded on the expiry we read, so across processes only one caller pays out for it
+            previous = await db.users.find_one_and_update(
+                {"id": user_id, "subscription_expires": user.get("subscription_expires")},
+                {
+                    "$set": {
+                        "is_active": True,
+                        "subscription_expires": expires.isoformat(),
+                        "grace_ends_at": expires + timedelta(hours=grace_period_hours),
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    }
+                },
+                projection={"_id": 0, "is_active": 1},
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+            if previous is None:
+                raise ActivationConflict()
+            
+            # Record activation/renewal transaction
+            now = datetime.now(timezone.utc).isoformat()
+            await db.transactions.insert_one({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "type": income_type,
+                "amount": required_amount,
+                "status": "completed",
+                "created_at": now,
+                "updated_at": now
+            }, session=session)
+            
+            await increment_platform_stats({
+                "total_income": required_amount,
+                "active_users": 0 if previous.get("is_active") else 1
+            }, session=session)
+        
+        try:
+            await run_in_transaction(apply)
+        except ActivationConflict:
+            # The concurrent caller's activation stands; report the user as activated
+            return True
+        finally:
+            user_cache.invalidate(user_id)
         
         # If renewing during grace period, flush temporary wallet
         if current_status == "grace_period":
             await flush_temporary_wallet(user_id)
         
-        # Record activation/renewal transaction
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "type": income_type,
-            "amount": required_amount,
-            "status": "completed",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
         # Distribute level income with correct type
         await distribute_level_income(user_id, required_amount, income_type)
         return True
     return False
 
+# ==================== DEPOSIT WATCHER ====================
+
+async def watch_for_deposit(user_id: str) -> Optional[dict]:
+    """
+    Queue the user for a deposit check now; a repeat request restarts the watch instead
+    of adding lookups. Returns the updated user document.
+    """
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$set": {"deposit_watch": {
+            "since": datetime.now(timezone.utc),
+            "next_check_at": datetime.now(timezone.utc),
+            "interval": DEPOSIT_WATCH_BASE_INTERVAL_SECONDS
+        }}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    user_cache.invalidate(user_id)
+    deposit_watcher.wake()
+    return user
+
+class DepositWatcher:
+    """
+    Activates users awaiting activation or renewal once their deposit shows up.
+    Each worker claims the most overdue watched user with a lease, checks the
+    balance through check_and_activate_user and either clears the watch or
+    doubles that user's re-check interval, up to DEPOSIT_WATCH_MAX_INTERVAL_SECONDS.
+    A worker only claims users while it holds one of `concurrency` slot leases
+    shared by every process, so that many lookups are in flight in total.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.slots = [f"deposit_watch_slot:{i}" for i in range(concurrency)]
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        owner = str(uuid.uuid4())
+        slot = None
+        renew_at = 0.0
+        while True:
+            try:
+                if slot is None or time.monotonic() >= renew_at:
+                    slot = await self._hold_slot(owner, slot)
+                    if slot is None:
+                        # Every slot is taken; one frees up at the latest when its lease expires
+                        await asyncio.sleep(DEPOSIT_WATCH_LEASE_SECONDS / 2)
+                        continue
+                    renew_at = time.monotonic() + DEPOSIT_WATCH_LEASE_SECONDS / 2
+                user = await self._claim()
+                if user is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), DEPOSIT_WATCH_POLL_INTERVAL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                await self._check(user)
+            except asyncio.CancelledError:
+                if slot is not None:
+                    await release_lease(slot, owner)
+                raise
+            except Exception as e:
+                logger.error(f"Deposit watcher error: {e}")
+                await asyncio.sleep(DEPOSIT_WATCH_POLL_INTERVAL_SECONDS)
+
+    async def _hold_slot(self, owner: str, slot: Optional[str]) -> Optional[str]:
+        """Renew the slot this worker holds, or take any free one; None if all are held"""
+        if slot is not None and await acquire_lease(slot, owner, DEPOSIT_WATCH_LEASE_SECONDS):
+            return slot
+        for name in random.sample(self.slots, len(self.slots)):
+            if await acquire_lease(name, owner, DEPOSIT_WATCH_LEASE_SECONDS):
+                return name
+        return None
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.users.find_one_and_update(
+            {"deposit_watch.next_check_at": {"$lte": now}},
+            {"$set": {"deposit_watch.next_check_at": now + timedelta(seconds=DEPOSIT_WATCH_LEASE_SECONDS)}},
+            sort=[("deposit_watch.next_check_at", ASCENDING)],
+            projection={"_id": 0, "id": 1, "deposit_watch": 1}
+        )
+
+    async def _check(self, user: dict):
+        watch = user["deposit_watch"]
+        try:
+            activated = await check_and_activate_user(user["id"])
+        except Exception as e:
+            logger.error(f"Deposit check failed for {user['id']}: {e}")
+            activated = False
+        
+        if activated:
+            await db.users.update_one({"id": user["id"]}, {"$unset": {"deposit_watch": ""}})
+            user_cache.invalidate(user["id"])
+            return
+        
+        # Only touch the watch we claimed; a fresh request from the user restarts it instead
+        claimed = {"id": user["id"], "deposit_watch.since": watch["since"]}
+        now = datetime.now(timezone.utc)
+        if now - watch["since"].replace(tzinfo=timezone.utc) > timedelta(seconds=DEPOSIT_WATCH_MAX_AGE_SECONDS):
+            await db.users.update_one(claimed, {"$unset": {"deposit_watch": ""}})
+            user_cache.invalidate(user["id"])
+            return
+        # The schedule isn't part of what clients read, so the cached user can stay
+        await db.users.update_one(claimed, {"$set": {
+            "deposit_watch.next_check_at": now + timedelta(seconds=watch["interval"]),
+            "deposit_watch.interval": min(watch["interval"] * 2, DEPOSIT_WATCH_MAX_INTERVAL_SECONDS)
+        }})
+
+deposit_watcher = DepositWatcher(DEPOSIT_WATCH_CONCURRENCY)
+
+def activation_status(user: dict, grace_period_hours: int) -> dict:
+    """What the client shows while waiting for a deposit, from the user document alone"""
+    watch = user.get("deposit_watch")
+    subscription_status = get_user_subscription_status(user, grace_period_hours)
+    return {
+        "activated": subscription_status == "active" and not watch,
+        "pending": bool(watch),
+        "subscription_status": subscription_status,
+        "subscription_expires": user.get("subscription_expires")
+    }
+
+# ==================== WITHDRAWAL QUEUE ====================
+
+class RateLimiter:
+    """Spaces acquisitions at least 1/rate seconds apart across every caller in this process"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = self._next_slot - now
+        self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class WithdrawalQueue:
+    """
+    Submits reserved withdrawals to CoinConnect off the request path.
+    Lifecycle of a withdrawal transaction row:
+    - queued: funds reserved by /user/withdraw, waiting for a worker
+    - submitted: claimed by a worker with a lease and sent to CoinConnect
+    - completed / failed: failed rows have amount + fee returned to the earnings balance
+    Rows still waiting carry `queue_at` (when they are next due), which is removed once
+    they settle. `payout_sent` is set just before the provider call. Only a definitive
+    CoinConnect rejection refunds; a request that never connected is requeued. When the
+    outcome is unknown (timeout after sending, a worker that died after sending, or a
+    failed bookkeeping write) the row stays "submitted" with `needs_review` for an admin
+    to resolve. Such a row is never resubmitted automatically.
+    """
+
+    def __init__(self, concurrency: int, rate: float):
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate)
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.rate_limiter.acquire()
+                withdrawal = await self._claim()
+                if withdrawal is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), WITHDRAWAL_POLL_INTERVAL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                await self._submit(withdrawal)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Withdrawal queue worker error: {e}")
+                await asyncio.sleep(WITHDRAWAL_POLL_INTERVAL_SECONDS)
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.transactions.find_one_and_update(
+            {"queue_at": {"$lte": now}, "type": "withdrawal", "status": {"$in": ["queued", "submitted"]}},
+            {
+                "$set": {
+                    "status": "submitted",
+                    "submitted_at": now.isoformat(),
+                    "updated_at": now.isoformat(),
+                    "queue_at": now + timedelta(seconds=WITHDRAWAL_LEASE_SECONDS)
+                },
+                "$inc": {"submit_attempts": 1}
+            },
+            sort=[("queue_at", ASCENDING)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _submit(self, withdrawal: dict):
+        if withdrawal.get("payout_sent"):
+            # A previous attempt reached CoinConnect but never recorded the outcome
+            await self.hold_for_review(withdrawal, "Worker stopped after submitting the payout")
+            return
+        
+        user = await db.users.find_one(
+            {"id": withdrawal["user_id"]},
+            {"_id": 0, "email": 1, "wallet_address": 1}
+        )
+        if not user:
+            await self.settle_failed(withdrawal, "User not found")
+            return
+        
+        await db.transactions.update_one(
+            {"id": withdrawal["id"], "status": "submitted"},
+            {"$set": {"payout_sent": True}}
+        )
+        try:
+            result = await process_withdrawal(
+                user["email"],
+                user.get("wallet_address", ""),
+                withdrawal["to_address"],
+                withdrawal["amount"],
+                withdrawal["txn_id"]
+            )
+        except WithdrawalNotSent as e:
+            logger.warning(f"Withdrawal {withdrawal['id']} not sent: {e}")
+            await self._requeue(withdrawal, str(e))
+            return
+        except Exception as e:
+            logger.error(f"Withdrawal {withdrawal['id']} outcome unknown: {e}")
+            await self.hold_for_review(withdrawal, str(e))
+            return
+        
+        if not result.ok:
+            await self.settle_failed(withdrawal, result.message or "Withdrawal failed")
+            return
+        
+        balance_cache.invalidate(user.get("wallet_address"))
+        try:
+            await self.settle_completed(withdrawal, result.data.get("txn_hash"))
+        except Exception as e:
+            # Paid out but not recorded; never let the lease expiry submit it again
+            logger.error(f"Withdrawal {withdrawal['id']} paid but not recorded: {e}")
+            await self.hold_for_review(withdrawal, f"Payout succeeded (txn_hash {result.data.get('txn_hash')}) but was not recorded: {e}")
+
+    async def _requeue(self, withdrawal: dict, reason: str):
+        """Retry a submission that never reached CoinConnect, with backoff; fail it after WITHDRAWAL_MAX_ATTEMPTS"""
+        if withdrawal["submit_attempts"] >= WITHDRAWAL_MAX_ATTEMPTS:
+            await self.settle_failed(withdrawal, reason)
+            return
+        backoff = WITHDRAWAL_RETRY_BASE_SECONDS * (2 ** (withdrawal["submit_attempts"] - 1))
+        now = datetime.now(timezone.utc)
+        await db.transactions.update_one(
+            {"id": withdrawal["id"], "status": "submitted"},
+            {"$set": {
+                "status": "queued",
+                "payout_sent": False,
+                "last_error": reason,
+                "updated_at": now.isoformat(),
+                "queue_at": now + timedelta(seconds=backoff)
+            }}
+        )
+
+    async def hold_for_review(self, withdrawal: dict, reason: str):
+        """Park a withdrawal whose payout may have happened; the reservation is kept"""
+        await db.transactions.update_one(
+            {"id": withdrawal["id"], "status": "submitted"},
+            {
+                "$set": {"needs_review": True, "last_error": reason, "updated_at": datetime.now(timezone.utc).isoformat()},
+                "$unset": {"queue_at": ""}
+            }
+        )
+
+    async def settle_completed(self, withdrawal: dict, txn_hash: Optional[str]) -> bool:
+        """Mark a submitted withdrawal completed and count it, once"""
+        async def complete(session):
+            now = datetime.now(timezone.utc).isoformat()
+            updated = await db.transactions.update_one(
+                {"id": withdrawal["id"], "status": "submitted"},
+                {
+                    "$set": {
+                        "status": "completed",
+                        "txn_hash": txn_hash,
+                        "completed_at": now,
+                        "updated_at": now
+                    },
+                    "$unset": {"queue_at": "", "needs_review": ""}
+                },
+                session=session
+            )
+            if updated.modified_count:
+                await increment_platform_stats({"total_withdrawals": withdrawal["amount"]}, session=session)
+            return bool(updated.modified_count)
+        
+        return await run_in_transaction(complete)
+
+    async def settle_failed(self, withdrawal: dict, reason: str) -> bool:
+        """Mark a submitted withdrawal failed and release its reservation, once"""
+        async def refund(session):
+            now = datetime.now(timezone.utc).isoformat()
+            updated = await db.transactions.update_one(
+                {"id": withdrawal["id"], "status": "submitted"},
+                {
+                    "$set": {"status": "failed", "failure_reason": reason, "updated_at": now},
+                    "$unset": {"queue_at": "", "needs_review": ""}
+                },
+                session=session
+            )
+            if updated.modified_count:
+                await db.users.update_one(
+                    {"id": withdrawal["user_id"]},
+                    {
+                        "$inc": {"wallet_balance": withdrawal["amount"] + withdrawal["fee"]},
+                        "$set": {"updated_at": now}
+                    },
+                    session=session
+                )
+            return bool(updated.modified_count)
+        
+        try:
+            return await run_in_transaction(refund)
+        finally:
+            user_cache.invalidate(withdrawal["user_id"])
+
+withdrawal_queue = WithdrawalQueue(WITHDRAWAL_WORKERS, WITHDRAWAL_RATE_PER_SECOND)
+
+# ==================== IDEMPOTENCY ====================
+
+async def claim_idempotency_key(record_id: str, endpoint: str, fingerprint: str) -> bool:
+    """
+    Take the key for this request: insert it as in progress, or take over an in-progress
+    key for the same request whose holder's lease ran out. False when someone else has it.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.find_one_and_update(
+            {
+                "id": record_id,
+                "endpoint": endpoint,
+                "fingerprint": fingerprint,
+                "status": "in_progress",
+                "lease_expires_at": {"$lt": now}
+            },
+            {"$set": {"created_at": now, "lease_expires_at": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def run_idempotent(user_id: str, key: Optional[str], endpoint: str, payload: dict, handler, status_code: int = 200):
+    """
+    Run `handler` at most once per (user, Idempotency-Key).
+    - A completed key replays the stored status and body without running anything
+    - A duplicate of an in-flight request waits for it (up to IDEMPOTENCY_WAIT_SECONDS)
+    - Reusing a key for another endpoint or body is a 422
+    Client errors (4xx) are stored and replayed like successes; server errors free the
+    key so the retry runs again. Requests without a key run unguarded.
+    """
+    if key is None:
+        return await handler()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+    
+    record_id = f"{user_id}:{key}"
+    fingerprint = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while not await claim_idempotency_key(record_id, endpoint, fingerprint):
+        record = await db.idempotency_keys.find_one({"id": record_id}, {"_id": 0})
+        if record is None:
+            continue  # Expired between the claim and the read
+        if record["endpoint"] != endpoint or record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if record["status"] == "completed":
+            return JSONResponse(status_code=record["status_code"], content=record["response"])
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+    
+    async def store(code: int, body: Any):
+        await db.idempotency_keys.update_one(
+            {"id": record_id},
+            {
+                "$set": {"status": "completed", "status_code": code, "response": jsonable_encoder(body)},
+                "$unset": {"lease_expires_at": ""}
+            }
+        )
+    
+    try:
+        response = await handler()
+    except HTTPException as e:
+        if e.status_code < 500:
+            await store(e.status_code, {"detail": e.detail})
+        else:
+            await db.idempotency_keys.delete_one({"id": record_id, "status": "in_progress"})
+        raise
+    except Exception:
+        await db.idempotency_keys.delete_one({"id": record_id, "status": "in_progress"})
+        raise
+    await store(status_code, response)
+    return response
+
 # ==================== AUTH ENDPOINTS ====================
 
 @api_router.post("/auth/send-otp")
-async def send_otp(data: OTPRequest, background_tasks: BackgroundTasks):
+async def send_otp(data: OTPRequest):
     # Check if SMTP is configured
     smtp_settings = await get_smtp_settings()
     
@@ -663,7 +2606,8 @@ async def send_otp(data: OTPRequest, background_tasks: BackgroundTasks):
     
     await db.otps.update_one(
         {"email": data.email},
-        {"$set": {"otp": otp, "expires": expires.isoformat(), "email": data.email}},
+        # expires_at is a native date for the TTL index
+        {"$set": {"otp": otp, "expires": expires.isoformat(), "expires_at": expires, "email": data.email}},
         upsert=True
     )
     
@@ -673,7 +2617,7 @@ async def send_otp(data: OTPRequest, background_tasks: BackgroundTasks):
     
     # Only send email if SMTP is configured
     if smtp_settings and smtp_settings.get("host"):
-        background_tasks.add_task(send_email, data.email, subject, body)
+        await send_email(data.email, subject, body)
     else:
         logger.info(f"SMTP not configured. Default OTP '000000' set for {data.email}")
     
@@ -728,19 +2672,27 @@ async def verify_otp(data: OTPVerify):
         "wallet_address": None,
         "referral_code": generate_referral_code(),
         "sponsor_id": None,
+        "ancestors": [],  # Upline ids, nearest first
         "is_active": False,
         "subscription_expires": None,
+        "grace_ends_at": None,  # subscription_expires + grace period, for the sweeper
         "total_income": 0.0,
         "wallet_balance": 0.0,  # Earnings wallet
         "deposit_balance": 0.0,  # Deposit wallet (for activation/renewal)
         "temporary_wallet": 0.0,  # Grace period income storage
         "direct_referrals": 0,
+        "team_size": 0,  # Whole downline, all depths
+        "team_level_counts": {},  # Level ("1".."10") -> member count
         "created_at": datetime.now(timezone.utc).isoformat(),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.users.insert_one(new_user)
-    new_user.pop("_id", None)
+    async def apply(session):
+        # Copy so a retried transaction doesn't reuse the _id of an aborted attempt
+        await db.users.insert_one(dict(new_user), session=session)
+        await increment_platform_stats({"total_users": 1}, session=session)
+    
+    await run_in_transaction(apply)
     
     token = create_token({"user_id": new_user["id"], "email": new_user["email"]})
     
@@ -753,23 +2705,29 @@ async def verify_otp(data: OTPVerify):
 
 @api_router.post("/auth/complete-profile")
 async def complete_profile(data: UserProfile, referral_code: Optional[str] = None, user: dict = Depends(get_current_user)):
-    sponsor_id = None
-    if referral_code:
+    sponsor_id = user.get("sponsor_id")
+    ancestors = await get_user_ancestors(user)
+    placed = False
+    # The sponsor is assigned once; re-submitting the profile keeps the existing placement
+    if referral_code and not sponsor_id:
         sponsor = await db.users.find_one({"referral_code": referral_code}, {"_id": 0})
         if sponsor and sponsor["id"] != user["id"]:
-            sponsor_id = sponsor["id"]
-            # Increment sponsor's direct referrals
-            await db.users.update_one(
-                {"id": sponsor_id},
-                {"$inc": {"direct_referrals": 1}}
-            )
+            sponsor_ancestors = await get_user_ancestors(sponsor)
+            # Refuse placements that would make the user their own upline
+            if user["id"] not in sponsor_ancestors:
+                sponsor_id = sponsor["id"]
+                ancestors = [sponsor_id] + sponsor_ancestors
+                placed = True
+                # Increment sponsor's direct referrals and every ancestor's team counters
+                await increment_direct_referrals(sponsor_id)
+                await increment_team_counters(ancestors)
     
     # Create CoinConnect wallet
     wallet_address = await create_coinconnect_wallet(
         user["email"], data.first_name, data.last_name, data.mobile
     )
     
-    await db.users.update_one(
+    updated_user = await db.users.find_one_and_update(
         {"id": user["id"]},
         {
             "$set": {
@@ -777,13 +2735,18 @@ async def complete_profile(data: UserProfile, referral_code: Optional[str] = Non
                 "last_name": data.last_name,
                 "mobile": data.mobile,
                 "sponsor_id": sponsor_id,
+                "ancestors": ancestors,
                 "wallet_address": wallet_address,
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }
-        }
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0})
+    user_cache.invalidate(user["id"])
+    if placed:
+        # Anyone who joined under this user before they had a sponsor moves with them
+        await attach_downline(user["id"], ancestors)
     return {"message": "Profile completed", "user": updated_user}
 
 # ==================== USER ENDPOINTS ====================
@@ -794,7 +2757,7 @@ async def get_profile(user: dict = Depends(get_current_user)):
 
 @api_router.put("/user/profile")
 async def update_profile(data: UserProfile, user: dict = Depends(get_current_user)):
-    await db.users.update_one(
+    updated_user = await db.users.find_one_and_update(
         {"id": user["id"]},
         {
             "$set": {
@@ -803,16 +2766,18 @@ async def update_profile(data: UserProfile, user: dict = Depends(get_current_use
                 "mobile": data.mobile,
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }
-        }
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0})
+    user_cache.invalidate(user["id"])
     return updated_user
 
 @api_router.get("/user/dashboard")
 async def get_dashboard(user: dict = Depends(get_current_user)):
     # Get team stats
-    direct_count = await db.users.count_documents({"sponsor_id": user["id"]})
-    total_team = await get_total_team_count(user["id"])
+    direct_count = user.get("direct_referrals", 0)
+    total_team = user.get("team_size", 0)
     
     # Get recent transactions
     recent_txns = await db.transactions.find(
@@ -821,15 +2786,10 @@ async def get_dashboard(user: dict = Depends(get_current_user)):
     ).sort("created_at", -1).limit(5).to_list(5)
     
     # Get level-wise income
-    level_income = await db.transactions.aggregate([
-        {"$match": {"user_id": user["id"], "type": "level_income"}},
-        {"$group": {"_id": "$level", "total": {"$sum": "$amount"}}}
-    ]).to_list(10)
+    income_summary = await get_income_summary(user["id"])
     
-    # Check wallet balance from CoinConnect
-    wallet_balance = 0
-    if user.get("wallet_address"):
-        wallet_balance = await get_wallet_balance(user["wallet_address"])
+    # Check wallet balance from CoinConnect (cached briefly per address)
+    wallet_balance, wallet_balance_age = await get_wallet_balance_with_age(user.get("wallet_address"))
     
     sub_settings = await get_subscription_settings()
     grace_period_hours = sub_settings.get("grace_period_hours", 48)
@@ -846,72 +2806,129 @@ async def get_dashboard(user: dict = Depends(get_current_user)):
     return {
         "user": user,
         "wallet_balance": wallet_balance,
+        "wallet_balance_age_seconds": wallet_balance_age,
         "internal_balance": user.get("wallet_balance", 0),
         "temporary_wallet": user.get("temporary_wallet", 0),
         "total_income": user.get("total_income", 0),
         "direct_referrals": direct_count,
         "total_team": total_team,
         "recent_transactions": recent_txns,
-        "level_income": {str(li["_id"]): li["total"] for li in level_income},
+        "level_income": income_summary["level_totals"],
         "subscription_settings": sub_settings,
         "subscription_status": subscription_status,
         "grace_period_ends": grace_period_ends
     }
 
-async def get_total_team_count(user_id: str, visited: set = None) -> int:
-    if visited is None:
-        visited = set()
-    if user_id in visited:
-        return 0
-    visited.add(user_id)
-    
-    direct = await db.users.find({"sponsor_id": user_id}, {"_id": 0, "id": 1}).to_list(1000)
-    count = len(direct)
-    for d in direct:
-        count += await get_total_team_count(d["id"], visited)
-    return count
+TEAM_MEMBER_PROJECTION = {
+    "_id": 0, "id": 1, "email": 1, "first_name": 1, "last_name": 1, "referral_code": 1,
+    "is_active": 1, "subscription_expires": 1, "direct_referrals": 1, "team_size": 1, "created_at": 1
+}
+
+TEAM_MEMBER_SORTS = {
+    "joined": "created_at",  # Newest members first
+    "status": "subscription_expires"  # Active, then grace period, then inactive
+}
+
+def team_level_query(user_id: str, level: int) -> dict:
+    if level == 1:
+        return {"sponsor_id": user_id}
+    return {"ancestors": user_id, f"ancestors.{level - 1}": user_id}
 
 @api_router.get("/user/team")
 async def get_team(user: dict = Depends(get_current_user)):
-    """Get team hierarchy up to 10 levels"""
-    levels = []
-    current_level_ids = [user["id"]]
+    """
+    Team summary up to 10 levels: member counts per level with subscription status breakdown.
+    Counts come from the maintained team_level_counts; only members still active or in
+    their grace period are read, and everyone else at a level is inactive.
+    """
+    sub_settings = await get_subscription_settings()
+    grace_period_hours = sub_settings.get("grace_period_hours", 48)
     
-    for level in range(1, 11):
-        level_members = await db.users.find(
-            {"sponsor_id": {"$in": current_level_ids}},
-            {"_id": 0}
-        ).to_list(1000)
-        
-        if not level_members:
-            break
-        
+    # ISO timestamps compare correctly as strings, so status is classified inside the aggregation
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    grace_cutoff_iso = (now - timedelta(hours=grace_period_hours)).isoformat()
+    
+    # Only members within MAX_INCOME_LEVELS whose grace period hasn't ended
+    rows = await db.users.aggregate([
+        {"$match": {
+            "ancestors": user["id"],
+            "subscription_expires": {"$gte": grace_cutoff_iso},
+            "$or": [{f"ancestors.{depth}": user["id"]} for depth in range(MAX_INCOME_LEVELS)]
+        }},
+        {"$project": {
+            "_id": 0,
+            "level": {"$add": [{"$indexOfArray": ["$ancestors", user["id"]]}, 1]},
+            "subscription_expires": 1
+        }},
+        {"$group": {
+            "_id": "$level",
+            "active": {"$sum": {"$cond": [{"$gte": ["$subscription_expires", now_iso]}, 1, 0]}},
+            "grace_period": {"$sum": {"$cond": [{"$lt": ["$subscription_expires", now_iso]}, 1, 0]}}
+        }}
+    ]).to_list(MAX_INCOME_LEVELS)
+    statuses = {row["_id"]: row for row in rows}
+    
+    levels = []
+    level_counts = user.get("team_level_counts") or {}
+    for level in range(1, MAX_INCOME_LEVELS + 1):
+        status = statuses.get(level, {"active": 0, "grace_period": 0})
+        # The subscribed members were just counted, so the level can't be smaller than that
+        count = max(level_counts.get(str(level), 0), status["active"] + status["grace_period"])
+        if not count:
+            continue
         levels.append({
             "level": level,
-            "count": len(level_members),
-            "members": level_members
+            "count": count,
+            "active": status["active"],
+            "grace_period": status["grace_period"],
+            "inactive": count - status["active"] - status["grace_period"]
         })
-        
-        current_level_ids = [m["id"] for m in level_members]
     
     return {
         "levels": levels,
-        "total_team": sum(lvl["count"] for lvl in levels)
+        "total_team": sum(lvl["count"] for lvl in levels),
+        "total_active": sum(lvl["active"] for lvl in levels),
+        "total_grace_period": sum(lvl["grace_period"] for lvl in levels),
+        "total_inactive": sum(lvl["inactive"] for lvl in levels)
     }
 
+@api_router.get("/user/team/members")
+async def get_team_members(
+    level: int = 1,
+    sort: str = "joined",
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    user: dict = Depends(get_current_user)
+):
+    """Cursor-paginated members of one team level"""
+    if level < 1 or level > MAX_INCOME_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Level must be between 1 and {MAX_INCOME_LEVELS}")
+    if sort not in TEAM_MEMBER_SORTS:
+        raise HTTPException(status_code=400, detail="Invalid sort. Use 'joined' or 'status'")
+    limit = max(1, min(limit, 100))
+    sort_field = TEAM_MEMBER_SORTS[sort]
+    
+    members, next_cursor = await keyset_page(
+        "users", team_level_query(user["id"], level), cursor, limit,
+        sort_field=sort_field, projection=TEAM_MEMBER_PROJECTION
+    )
+    
+    sub_settings = await get_subscription_settings()
+    grace_period_hours = sub_settings.get("grace_period_hours", 48)
+    for member in members:
+        member["subscription_status"] = get_user_subscription_status(member, grace_period_hours)
+    
+    return {"level": level, "members": members, "next_cursor": next_cursor}
+
 @api_router.get("/user/income")
 async def get_income(user: dict = Depends(get_current_user)):
-    # Level-wise income breakdown
-    level_income = await db.transactions.aggregate([
-        {"$match": {"user_id": user["id"], "type": "level_income"}},
-        {"$group": {"_id": "$level", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
-    ]).to_list(10)
-    
-    # Total income by type
-    income_by_type = await db.transactions.aggregate([
-        {"$match": {"user_id": user["id"], "type": "level_income"}},
-        {"$group": {"_id": "$income_type", "total": {"$sum": "$amount"}}}
-    ]).to_list(10)
+    # Level-wise and by-type totals come from the maintained income summary
+    income_summary = await get_income_summary(user["id"])
+    level_income = [
+        {"level": int(level), "total": total, "count": income_summary["level_counts"].get(level, 0)}
+        for level, total in income_summary["level_totals"].items()
+    ]
     
     # Recent income transactions
     recent_income = await db.transactions.find(
@@ -922,8 +2939,10 @@ async def get_income(user: dict = Depends(get_current_user)):
     level_settings = await get_level_settings()
     
     return {
-        "level_income": sorted([{"level": li["_id"], "total": li["total"], "count": li["count"]} for li in level_income], key=lambda x: x["level"]),
-        "income_by_type": {ibt["_id"]: ibt["total"] for ibt in income_by_type},
+        "level_income": sorted(level_income, key=lambda x: x["level"]),
+        "income_by_type": income_summary["income_by_type"],
+        "pending_grace_total": income_summary["pending_grace_total"],
+        "forfeited_total": income_summary["forfeited_total"],
         "recent_income": recent_income,
         "total_income": user.get("total_income", 0),
         "level_settings": level_settings
@@ -931,14 +2950,12 @@ async def get_income(user: dict = Depends(get_current_user)):
 
 @api_router.get("/user/wallet")
 async def get_wallet(user: dict = Depends(get_current_user)):
-    wallet_balance = 0
-    if user.get("wallet_address"):
-        wallet_balance = await get_wallet_balance(user["wallet_address"])
+    wallet_balance, wallet_balance_age = await get_wallet_balance_with_age(user.get("wallet_address"))
     
     # Get withdrawal history
     withdrawals = await db.transactions.find(
         {"user_id": user["id"], "type": "withdrawal"},
-        {"_id": 0}
+        {"_id": 0, "queue_at": 0}
     ).sort("created_at", -1).limit(20).to_list(20)
     
     # Get transfer history
@@ -955,13 +2972,28 @@ async def get_wallet(user: dict = Depends(get_current_user)):
         "deposit_balance": user.get("deposit_balance", 0),  # Deposit wallet (for activation/renewal)
         "earnings_balance": user.get("wallet_balance", 0),  # Earnings wallet (level income)
         "external_balance": wallet_balance,  # CoinConnect balance
+        "external_balance_age_seconds": wallet_balance_age,
         "withdrawals": withdrawals,
         "transfers": transfers,
         "wallet_settings": wallet_settings
     }
 
-@api_router.post("/user/withdraw")
-async def withdraw(data: WithdrawRequest, user: dict = Depends(get_current_user)):
+@api_router.post("/user/withdraw", status_code=202)
+async def withdraw(
+    data: WithdrawRequest,
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Reserve amount + fee from the earnings balance and queue the payout; the withdrawal
+    queue submits it to CoinConnect. Poll /user/withdrawals/{id} for the outcome.
+    """
+    return await run_idempotent(
+        user["id"], idempotency_key, "withdraw", data.model_dump(),
+        lambda: queue_withdrawal(data, user), status_code=202
+    )
+
+async def queue_withdrawal(data: WithdrawRequest, user: dict) -> dict:
     wallet_settings = await get_wallet_settings()
     min_withdrawal = wallet_settings.get("min_withdrawal_amount", 10)
     withdrawal_fee = wallet_settings.get("withdrawal_fee", 0)
@@ -973,55 +3005,67 @@ async def withdraw(data: WithdrawRequest, user: dict = Depends(get_current_user)
         raise HTTPException(status_code=400, detail=f"Minimum withdrawal amount is ${min_withdrawal}")
     
     total_deduction = data.amount + withdrawal_fee
+    txn_id = f"GEM-{str(uuid.uuid4())[:8].upper()}"
+    withdrawal = {
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "type": "withdrawal",
+        "amount": data.amount,
+        "fee": withdrawal_fee,
+        "to_address": data.to_address,
+        "txn_id": txn_id,
+        "status": "queued",
+        "queue_at": datetime.now(timezone.utc),
+        "submit_attempts": 0,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
     
-    if total_deduction > user.get("wallet_balance", 0):
-        raise HTTPException(status_code=400, detail=f"Insufficient earnings balance. Need ${total_deduction} (${data.amount} + ${withdrawal_fee} fee)")
+    # Reserve the funds with the queued row, so parallel requests can't overdraw
+    async def reserve(session):
+        await debit_user(user["id"], "wallet_balance", total_deduction, session=session)
+        await db.transactions.insert_one(dict(withdrawal), session=session)
     
-    txn_id = f"GEM-{str(uuid.uuid4())[:8].upper()}"
+    try:
+        await run_in_transaction(reserve)
+    except InsufficientBalance:
+        raise HTTPException(status_code=400, detail=f"Insufficient earnings balance. Need ${total_deduction} (${data.amount} + ${withdrawal_fee} fee)")
+    finally:
+        user_cache.invalidate(user["id"])
     
-    # Process withdrawal via CoinConnect
-    result = await process_withdrawal(
-        user["email"],
-        user.get("wallet_address", ""),
-        data.to_address,
-        data.amount,
-        txn_id
+    withdrawal_queue.wake()
+    return {
+        "message": "Withdrawal queued",
+        "withdrawal_id": withdrawal["id"],
+        "txn_id": txn_id,
+        "status": "queued",
+        "amount": data.amount,
+        "fee": withdrawal_fee
+    }
+
+@api_router.get("/user/withdrawals/{withdrawal_id}")
+async def get_withdrawal_status(withdrawal_id: str, user: dict = Depends(get_current_user)):
+    withdrawal = await db.transactions.find_one(
+        {"id": withdrawal_id, "user_id": user["id"], "type": "withdrawal"},
+        {"_id": 0, "queue_at": 0}
     )
-    
-    if result.get("status") == "OK":
-        # Deduct from earnings balance (amount + fee)
-        await db.users.update_one(
-            {"id": user["id"]},
-            {"$inc": {"wallet_balance": -total_deduction}}
-        )
-        
-        # Record withdrawal transaction
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": user["id"],
-            "type": "withdrawal",
-            "amount": data.amount,
-            "fee": withdrawal_fee,
-            "to_address": data.to_address,
-            "txn_id": txn_id,
-            "txn_hash": result.get("response", {}).get("data", {}).get("txn_hash"),
-            "status": "completed",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
-        return {
-            "message": "Withdrawal successful", 
-            "txn_id": txn_id, 
-            "txn_hash": result.get("response", {}).get("data", {}).get("txn_hash"),
-            "amount": data.amount,
-            "fee": withdrawal_fee
-        }
-    else:
-        raise HTTPException(status_code=400, detail=result.get("message", "Withdrawal failed"))
+    if not withdrawal:
+        raise HTTPException(status_code=404, detail="Withdrawal not found")
+    return withdrawal
 
 @api_router.post("/user/internal-transfer")
-async def internal_transfer(data: InternalTransferRequest, user: dict = Depends(get_current_user)):
+async def internal_transfer(
+    data: InternalTransferRequest,
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Transfer between Earnings and Deposit wallets"""
+    return await run_idempotent(
+        user["id"], idempotency_key, "internal-transfer", data.model_dump(),
+        lambda: transfer_between_wallets(data, user)
+    )
+
+async def transfer_between_wallets(data: InternalTransferRequest, user: dict) -> dict:
     wallet_settings = await get_wallet_settings()
     min_amount = wallet_settings.get("min_transfer_amount", 1)
     
@@ -1033,12 +3077,10 @@ async def internal_transfer(data: InternalTransferRequest, user: dict = Depends(
     
     if data.transfer_type == "earnings_to_deposit":
         fee_percent = wallet_settings.get("earnings_to_deposit_fee", 0)
-        source_balance = user.get("wallet_balance", 0)
         source_field = "wallet_balance"
         dest_field = "deposit_balance"
     elif data.transfer_type == "deposit_to_earnings":
         fee_percent = wallet_settings.get("deposit_to_earnings_fee", 0)
-        source_balance = user.get("deposit_balance", 0)
         source_field = "deposit_balance"
         dest_field = "wallet_balance"
     else:
@@ -1048,46 +3090,55 @@ async def internal_transfer(data: InternalTransferRequest, user: dict = Depends(
     total_deduction = data.amount
     net_amount = data.amount - fee_amount
     
-    if total_deduction > source_balance:
-        raise HTTPException(status_code=400, detail=f"Insufficient balance. Available: ${source_balance}")
-    
-    # Perform transfer
-    await db.users.update_one(
-        {"id": user["id"]},
-        {
-            "$inc": {
-                source_field: -total_deduction,
-                dest_field: net_amount
-            },
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-        }
-    )
+    # Debit, credit and ledger row together; the debit only applies if the balance covers it
+    async def apply(session):
+        updated = await debit_user(user["id"], source_field, total_deduction, credit={dest_field: net_amount}, session=session)
+        await db.transactions.insert_one({
+            "id": str(uuid.uuid4()),
+            "user_id": user["id"],
+            "type": "internal_transfer",
+            "transfer_type": data.transfer_type,
+            "amount": data.amount,
+            "fee": fee_amount,
+            "fee_percent": fee_percent,
+            "net_amount": net_amount,
+            "status": "completed",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }, session=session)
+        return updated
     
-    # Record transaction
-    await db.transactions.insert_one({
-        "id": str(uuid.uuid4()),
-        "user_id": user["id"],
-        "type": "internal_transfer",
-        "transfer_type": data.transfer_type,
-        "amount": data.amount,
-        "fee": fee_amount,
-        "fee_percent": fee_percent,
-        "net_amount": net_amount,
-        "status": "completed",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    try:
+        updated_user = await run_in_transaction(apply)
+    except InsufficientBalance:
+        source_balance = await current_balance(user["id"], source_field)
+        raise HTTPException(status_code=400, detail=f"Insufficient balance. Available: ${source_balance}")
+    finally:
+        user_cache.invalidate(user["id"])
     
     return {
         "message": "Transfer successful",
         "amount": data.amount,
         "fee": fee_amount,
         "fee_percent": fee_percent,
-        "net_amount": net_amount
+        "net_amount": net_amount,
+        "earnings_balance": updated_user.get("wallet_balance", 0),
+        "deposit_balance": updated_user.get("deposit_balance", 0)
     }
 
 @api_router.post("/user/user-transfer")
-async def user_transfer(data: UserTransferRequest, user: dict = Depends(get_current_user)):
+async def user_transfer(
+    data: UserTransferRequest,
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Transfer from my Deposit wallet to another user's Deposit wallet"""
+    return await run_idempotent(
+        user["id"], idempotency_key, "user-transfer", data.model_dump(),
+        lambda: transfer_to_user(data, user)
+    )
+
+async def transfer_to_user(data: UserTransferRequest, user: dict) -> dict:
     wallet_settings = await get_wallet_settings()
     min_amount = wallet_settings.get("min_transfer_amount", 1)
     fee_percent = wallet_settings.get("user_transfer_fee", 0)
@@ -1112,64 +3163,65 @@ async def user_transfer(data: UserTransferRequest, user: dict = Depends(get_curr
     if recipient["id"] == user["id"]:
         raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
     
-    # Check sender's deposit balance
-    sender_balance = user.get("deposit_balance", 0)
     fee_amount = data.amount * (fee_percent / 100)
     total_deduction = data.amount
     net_amount = data.amount - fee_amount
-    
-    if total_deduction > sender_balance:
-        raise HTTPException(status_code=400, detail=f"Insufficient deposit balance. Available: ${sender_balance}")
-    
-    # Perform transfer
-    # Deduct from sender
-    await db.users.update_one(
-        {"id": user["id"]},
+    txn_id = f"TRF-{str(uuid.uuid4())[:8].upper()}"
+    now = datetime.now(timezone.utc).isoformat()
+    ledger_rows = [
+        # Sender transaction
         {
-            "$inc": {"deposit_balance": -total_deduction},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-        }
-    )
-    
-    # Add to recipient
-    await db.users.update_one(
-        {"id": recipient["id"]},
+            "id": str(uuid.uuid4()),
+            "user_id": user["id"],
+            "type": "user_transfer_sent",
+            "txn_id": txn_id,
+            "amount": data.amount,
+            "fee": fee_amount,
+            "fee_percent": fee_percent,
+            "net_amount": net_amount,
+            "recipient_id": recipient["id"],
+            "recipient_email": recipient["email"],
+            "status": "completed",
+            "created_at": now,
+            "updated_at": now
+        },
+        # Recipient transaction
         {
-            "$inc": {"deposit_balance": net_amount},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+            "id": str(uuid.uuid4()),
+            "user_id": recipient["id"],
+            "type": "user_transfer_received",
+            "txn_id": txn_id,
+            "amount": net_amount,
+            "sender_id": user["id"],
+            "sender_email": user["email"],
+            "status": "completed",
+            "created_at": now,
+            "updated_at": now
         }
-    )
-    
-    txn_id = f"TRF-{str(uuid.uuid4())[:8].upper()}"
+    ]
     
-    # Record sender transaction
-    await db.transactions.insert_one({
-        "id": str(uuid.uuid4()),
-        "user_id": user["id"],
-        "type": "user_transfer_sent",
-        "txn_id": txn_id,
-        "amount": data.amount,
-        "fee": fee_amount,
-        "fee_percent": fee_percent,
-        "net_amount": net_amount,
-        "recipient_id": recipient["id"],
-        "recipient_email": recipient["email"],
-        "status": "completed",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    # Debit sender, credit recipient and record both rows in one transaction
+    async def apply(session):
+        updated = await debit_user(user["id"], "deposit_balance", total_deduction, session=session)
+        await db.users.update_one(
+            {"id": recipient["id"]},
+            {
+                "$inc": {"deposit_balance": net_amount},
+                "$set": {"updated_at": now}
+            },
+            session=session
+        )
+        # Copies so a retried transaction doesn't reuse the _id of an aborted attempt
+        await db.transactions.insert_many([dict(row) for row in ledger_rows], session=session)
+        return updated
     
-    # Record recipient transaction
-    await db.transactions.insert_one({
-        "id": str(uuid.uuid4()),
-        "user_id": recipient["id"],
-        "type": "user_transfer_received",
-        "txn_id": txn_id,
-        "amount": net_amount,
-        "sender_id": user["id"],
-        "sender_email": user["email"],
-        "status": "completed",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    try:
+        updated_user = await run_in_transaction(apply)
+    except InsufficientBalance:
+        sender_balance = await current_balance(user["id"], "deposit_balance")
+        raise HTTPException(status_code=400, detail=f"Insufficient deposit balance. Available: ${sender_balance}")
+    finally:
+        user_cache.invalidate(user["id"], recipient["id"])
     
     return {
         "message": "Transfer successful",
@@ -1178,14 +3230,41 @@ async def user_transfer(data: UserTransferRequest, user: dict = Depends(get_curr
         "fee": fee_amount,
         "fee_percent": fee_percent,
         "net_amount": net_amount,
-        "recipient_email": recipient["email"]
+        "recipient_email": recipient["email"],
+        "deposit_balance": updated_user.get("deposit_balance", 0)
     }
 
 @api_router.post("/user/check-activation")
-async def check_activation(user: dict = Depends(get_current_user)):
-    activated = await check_and_activate_user(user["id"])
-    updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0})
-    return {"activated": activated, "user": updated_user}
+async def check_activation(
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Ask the deposit watcher to activate/renew once the deposit arrives; poll /user/activation-status"""
+    async def request_activation():
+        sub_settings = await get_subscription_settings()
+        grace_period_hours = sub_settings.get("grace_period_hours", 48)
+        # A balance looked up moments ago that's already short needs no watch
+        known_balance = balance_cache.peek(user["wallet_address"]) if user.get("wallet_address") else None
+        required_amount, _ = activation_requirement(user, sub_settings)
+        if known_balance is not None and known_balance < required_amount:
+            return {
+                **activation_status(user, grace_period_hours),
+                "activated": False,
+                "pending": False,
+                "message": f"Insufficient deposit balance: ${known_balance:.2f} of ${required_amount:.2f}",
+                "user": user
+            }
+        # Without a deposit address there's nothing to watch; report the current status
+        updated_user = await watch_for_deposit(user["id"]) if user.get("wallet_address") else user
+        return {**activation_status(updated_user, grace_period_hours), "user": updated_user}
+    
+    return await run_idempotent(user["id"], idempotency_key, "check-activation", {}, request_activation)
+
+@api_router.get("/user/activation-status")
+async def get_activation_status(user: dict = Depends(get_current_user)):
+    """Cheap status read for the client while the deposit watcher works; no CoinConnect calls"""
+    sub_settings = await get_subscription_settings()
+    return activation_status(user, sub_settings.get("grace_period_hours", 48))
 
 @api_router.post("/user/submit-mt5")
 async def submit_mt5_credentials(data: MT5Credentials, user: dict = Depends(get_current_user)):
@@ -1195,7 +3274,7 @@ async def submit_mt5_credentials(data: MT5Credentials, user: dict = Depends(get_
     if not data.terms_accepted:
         raise HTTPException(status_code=400, detail="You must accept the terms and conditions")
     
-    await db.users.update_one(
+    updated_user = await db.users.find_one_and_update(
         {"id": user["id"]},
         {
             "$set": {
@@ -1206,19 +3285,73 @@ async def submit_mt5_credentials(data: MT5Credentials, user: dict = Depends(get_
                 "mt5_submitted_at": datetime.now(timezone.utc).isoformat(),
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }
-        }
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0})
+    user_cache.invalidate(user["id"])
     return {"message": "MT5 credentials submitted successfully", "user": updated_user}
 
 @api_router.get("/user/transactions")
-async def get_transactions(user: dict = Depends(get_current_user)):
-    transactions = await db.transactions.find(
-        {"user_id": user["id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(50).to_list(50)
-    return {"transactions": transactions}
+async def get_transactions(
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = 50,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    The user's ledger newest first, keyset-paginated on (created_at, id), filtered by
+    type, status and created_at range.
+    - The first page returns `sync_cursor`; passing it back as `since` (with the same
+      type and date filters) returns rows written or changed since, by updated_at, plus a
+      new sync_cursor. Rows can repeat across syncs, so clients merge them by id. `has_more`
+      means more changed rows remain than fit in `limit`: call again with the new sync_cursor.
+    - The status filter doesn't apply to syncs, so rows that leave a status are still returned
+    - sync_cursor is null when the first page is empty; load the first page again instead
+    """
+    limit = max(1, min(limit, 200))
+    if cursor and since:
+        raise HTTPException(status_code=400, detail="Use either cursor or since, not both")
+    query = {"user_id": user["id"], **created_at_range(start, end)}
+    if type:
+        query["type"] = type
+    if status:
+        query["status"] = status
+    
+    # Rows stamped after the watermark may still have slower commits landing behind them
+    watermark = (datetime.now(timezone.utc) - timedelta(seconds=LEDGER_SYNC_SETTLE_SECONDS)).isoformat()
+    
+    if since:
+        # Walk forward on (updated_at, id); the cursor only advances over settled rows
+        query.pop("status", None)
+        rows, more = await keyset_page(
+            "transactions", query, since, limit,
+            sort_field="updated_at", projection={"_id": 0, "queue_at": 0}, descending=False
+        )
+        settled = [row for row in rows if row["updated_at"] <= watermark]
+        sync_cursor = encode_cursor([settled[-1]["updated_at"], settled[-1]["id"]]) if settled else since
+        return {
+            "transactions": rows[::-1],
+            "next_cursor": None,
+            "sync_cursor": sync_cursor,
+            # Unsettled rows are re-read from the same cursor, so only a full settled page continues
+            "has_more": more is not None and len(settled) == len(rows)
+        }
+    
+    transactions, next_cursor = await keyset_page("transactions", query, cursor, limit, projection={"_id": 0, "queue_at": 0})
+    sync_cursor = None
+    if not cursor and transactions:
+        sync_cursor = encode_cursor([watermark, ""])
+    return {
+        "transactions": transactions,
+        "next_cursor": next_cursor,
+        "sync_cursor": sync_cursor,
+        "has_more": False
+    }
 
 # ==================== ADMIN ENDPOINTS ====================
 
@@ -1233,35 +3366,28 @@ async def admin_login(data: AdminLogin):
 
 @api_router.get("/admin/dashboard")
 async def admin_dashboard(admin: dict = Depends(get_current_admin)):
-    total_users = await db.users.count_documents({})
-    active_users = await db.users.count_documents({"is_active": True})
-    total_income = await db.transactions.aggregate([
-        {"$match": {"type": {"$in": ["activation", "renewal"]}}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(1)
-    
-    total_withdrawals = await db.transactions.aggregate([
-        {"$match": {"type": "withdrawal", "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(1)
+    stats = await get_platform_stats()
     
     recent_users = await db.users.find({}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10)
     recent_txns = await db.transactions.find({}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10)
     
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "total_income": total_income[0]["total"] if total_income else 0,
-        "total_withdrawals": total_withdrawals[0]["total"] if total_withdrawals else 0,
+        "total_users": stats.get("total_users", 0),
+        "active_users": stats.get("active_users", 0),
+        "total_income": stats.get("total_income", 0),
+        "total_withdrawals": stats.get("total_withdrawals", 0),
+        "stats_verified_at": stats.get("verified_at"),
         "recent_users": recent_users,
         "recent_transactions": recent_txns
     }
 
 @api_router.get("/admin/users")
-async def admin_get_users(skip: int = 0, limit: int = 50, admin: dict = Depends(get_current_admin)):
-    users = await db.users.find({}, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.users.count_documents({})
-    return {"users": users, "total": total}
+async def admin_get_users(cursor: Optional[str] = None, limit: int = 50, admin: dict = Depends(get_current_admin)):
+    """Users newest first, keyset-paginated on (created_at, id); total is an estimate"""
+    limit = max(1, min(limit, 1000))
+    users, next_cursor = await keyset_page("users", {}, cursor, limit)
+    total = await get_listing_total("users", {})
+    return {"users": users, "total": total, "total_is_estimate": True, "next_cursor": next_cursor}
 
 @api_router.get("/admin/users/{user_id}")
 async def admin_get_user(user_id: str, admin: dict = Depends(get_current_admin)):
@@ -1279,8 +3405,32 @@ async def admin_update_user(user_id: str, data: dict, admin: dict = Depends(get_
     allowed_fields = ["is_active", "wallet_balance", "total_income", "subscription_expires"]
     update_data = {k: v for k, v in data.items() if k in allowed_fields}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if "subscription_expires" in update_data:
+        expires = None
+        if update_data["subscription_expires"]:
+            try:
+                expires = datetime.fromisoformat(update_data["subscription_expires"])
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"Invalid subscription_expires: {update_data['subscription_expires']}")
+        sub_settings = await get_subscription_settings()
+        update_data["grace_ends_at"] = (
+            expires + timedelta(hours=sub_settings.get("grace_period_hours", 48))
+        ) if expires else None
+    
+    async def apply(session):
+        previous = await db.users.find_one_and_update(
+            {"id": user_id},
+            {"$set": update_data},
+            projection={"_id": 0, "is_active": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous is not None and "is_active" in update_data:
+            was_active, is_active = bool(previous.get("is_active")), bool(update_data["is_active"])
+            await increment_platform_stats({"active_users": int(is_active) - int(was_active)}, session=session)
     
-    await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await run_in_transaction(apply)
+    user_cache.invalidate(user_id)
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     return user
 
@@ -1290,23 +3440,73 @@ async def admin_get_levels(admin: dict = Depends(get_current_admin)):
 
 @api_router.put("/admin/settings/levels")
 async def admin_update_levels(levels: List[LevelSettingsV2], admin: dict = Depends(get_current_admin)):
-    await db.settings.update_one(
-        {"type": "levels"},
-        {"$set": {"type": "levels", "data": [lvl.model_dump() for lvl in levels]}},
-        upsert=True
-    )
+    await settings_cache.save("levels", [lvl.model_dump() for lvl in levels])
     return {"message": "Level settings updated", "levels": [lvl.model_dump() for lvl in levels]}
 
 # ==================== ADDITIONAL COMMISSIONS ====================
 
+COMMISSION_USER_LOOKUP = [
+    {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+    # Only the display fields, or null when the user no longer exists
+    {"$set": {"user": {"$let": {
+        "vars": {"u": {"$arrayElemAt": ["$user", 0]}},
+        "in": {"$cond": [
+            {"$ifNull": ["$$u", False]},
+            {"email": "$$u.email", "first_name": "$$u.first_name", "last_name": "$$u.last_name"},
+            None
+        ]}
+    }}}},
+    {"$project": {"_id": 0}},
+]
+
 @api_router.get("/admin/additional-commissions")
-async def admin_get_additional_commissions(admin: dict = Depends(get_current_admin)):
-    commissions = await db.additional_commissions.find({}, {"_id": 0}).to_list(1000)
-    # Enrich with user details
-    for comm in commissions:
-        user = await db.users.find_one({"id": comm["user_id"]}, {"_id": 0, "email": 1, "first_name": 1, "last_name": 1})
-        comm["user"] = user
-    return {"commissions": commissions}
+async def admin_get_additional_commissions(cursor: Optional[str] = None, limit: int = 100, search: Optional[str] = None,
+                                           admin: dict = Depends(get_current_admin)):
+    """
+    Commissions newest first with the user's name and email joined in one aggregation.
+    `search` matches the user's email; exposure totals always cover the whole roster.
+    """
+    limit = max(1, min(limit, 500))
+    search_match = [{"$match": {"user.email": {"$regex": re.escape(search), "$options": "i"}}}] if search else []
+    page = []
+    if cursor:
+        last_created_at, last_id = decode_cursor(cursor)
+        page.append({"$match": keyset_filter("created_at", last_created_at, last_id)})
+    page += [
+        {"$sort": {"created_at": -1, "id": -1}},
+        *COMMISSION_USER_LOOKUP,
+        *search_match,
+        {"$limit": limit + 1},
+    ]
+    
+    result = await db.additional_commissions.aggregate([
+        {"$facet": {
+            "page": page,
+            "matching": [*COMMISSION_USER_LOOKUP, *search_match, {"$count": "count"}] if search else [{"$count": "count"}],
+            "exposure": [{"$group": {
+                "_id": None,
+                "users": {"$sum": 1},
+                "activation_percentage": {"$sum": "$activation_percentage"},
+                "renewal_percentage": {"$sum": "$renewal_percentage"}
+            }}]
+        }}
+    ]).to_list(1)
+    facets = result[0]
+    
+    commissions = facets["page"]
+    next_cursor = None
+    if len(commissions) > limit:
+        commissions = commissions[:limit]
+        next_cursor = encode_cursor([commissions[-1].get("created_at"), commissions[-1]["id"]])
+    exposure = facets["exposure"][0] if facets["exposure"] else {"users": 0, "activation_percentage": 0, "renewal_percentage": 0}
+    exposure.pop("_id", None)
+    
+    return {
+        "commissions": commissions,
+        "total": facets["matching"][0]["count"] if facets["matching"] else 0,
+        "next_cursor": next_cursor,
+        "exposure": exposure
+    }
 
 @api_router.post("/admin/additional-commissions")
 async def admin_add_additional_commission(data: AdditionalCommission, admin: dict = Depends(get_current_admin)):
@@ -1329,6 +3529,7 @@ async def admin_add_additional_commission(data: AdditionalCommission, admin: dic
     }
     await db.additional_commissions.insert_one(commission)
     commission.pop("_id", None)
+    await settings_cache.bump_version()
     return {"message": "Additional commission added", "commission": commission}
 
 @api_router.put("/admin/additional-commissions/{user_id}")
@@ -1343,6 +3544,7 @@ async def admin_update_additional_commission(user_id: str, data: AdditionalCommi
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Commission not found")
+    await settings_cache.bump_version()
     return {"message": "Additional commission updated"}
 
 @api_router.delete("/admin/additional-commissions/{user_id}")
@@ -1350,6 +3552,7 @@ async def admin_delete_additional_commission(user_id: str, admin: dict = Depends
     result = await db.additional_commissions.delete_one({"user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Commission not found")
+    await settings_cache.bump_version()
     return {"message": "Additional commission deleted"}
 
 @api_router.get("/admin/settings/subscription")
@@ -1358,11 +3561,10 @@ async def admin_get_subscription(admin: dict = Depends(get_current_admin)):
 
 @api_router.put("/admin/settings/subscription")
 async def admin_update_subscription(data: SubscriptionSettings, admin: dict = Depends(get_current_admin)):
-    await db.settings.update_one(
-        {"type": "subscription"},
-        {"$set": {"type": "subscription", "data": data.model_dump()}},
-        upsert=True
-    )
+    previous = await get_subscription_settings()
+    await settings_cache.save("subscription", data.model_dump())
+    if previous.get("grace_period_hours", 48) != data.grace_period_hours:
+        await refresh_grace_deadlines(data.grace_period_hours)
     return {"message": "Subscription settings updated", "settings": data.model_dump()}
 
 @api_router.get("/admin/settings/wallet")
@@ -1371,11 +3573,7 @@ async def admin_get_wallet_settings(admin: dict = Depends(get_current_admin)):
 
 @api_router.put("/admin/settings/wallet")
 async def admin_update_wallet_settings(data: WalletSettings, admin: dict = Depends(get_current_admin)):
-    await db.settings.update_one(
-        {"type": "wallet"},
-        {"$set": {"type": "wallet", "data": data.model_dump()}},
-        upsert=True
-    )
+    await settings_cache.save("wallet", data.model_dump())
     return {"message": "Wallet settings updated", "settings": data.model_dump()}
 
 @api_router.get("/admin/settings/smtp")
@@ -1385,11 +3583,7 @@ async def admin_get_smtp(admin: dict = Depends(get_current_admin)):
 
 @api_router.put("/admin/settings/smtp")
 async def admin_update_smtp(data: SMTPSettings, admin: dict = Depends(get_current_admin)):
-    await db.settings.update_one(
-        {"type": "smtp"},
-        {"$set": {"type": "smtp", "data": data.model_dump()}},
-        upsert=True
-    )
+    await settings_cache.save("smtp", data.model_dump())
     return {"message": "SMTP settings updated"}
 
 @api_router.get("/admin/settings/coinconnect")
@@ -1399,11 +3593,7 @@ async def admin_get_coinconnect(admin: dict = Depends(get_current_admin)):
 
 @api_router.put("/admin/settings/coinconnect")
 async def admin_update_coinconnect(data: dict, admin: dict = Depends(get_current_admin)):
-    await db.settings.update_one(
-        {"type": "coinconnect"},
-        {"$set": {"type": "coinconnect", "data": {"cca_key": data.get("cca_key"), "cca_secret": data.get("cca_secret")}}},
-        upsert=True
-    )
+    await settings_cache.save("coinconnect", {"cca_key": data.get("cca_key"), "cca_secret": data.get("cca_secret")})
     return {"message": "CoinConnect settings updated"}
 
 @api_router.get("/admin/email-templates")
@@ -1426,13 +3616,168 @@ async def admin_update_email_template(template_type: str, data: EmailTemplate, a
     return {"message": "Email template updated"}
 
 @api_router.get("/admin/transactions")
-async def admin_get_transactions(skip: int = 0, limit: int = 50, type: Optional[str] = None, admin: dict = Depends(get_current_admin)):
+async def admin_get_transactions(cursor: Optional[str] = None, limit: int = 50, type: Optional[str] = None, admin: dict = Depends(get_current_admin)):
+    """Ledger newest first, keyset-paginated on (created_at, id); the type filter uses the (type, created_at) index"""
+    limit = max(1, min(limit, 1000))
     query = {}
     if type:
         query["type"] = type
-    transactions = await db.transactions.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.transactions.count_documents(query)
-    return {"transactions": transactions, "total": total}
+    transactions, next_cursor = await keyset_page("transactions", query, cursor, limit)
+    total = await get_listing_total("transactions", query)
+    return {"transactions": transactions, "total": total, "total_is_estimate": True, "next_cursor": next_cursor}
+
+@api_router.get("/admin/withdrawals/review")
+async def admin_get_withdrawals_for_review(admin: dict = Depends(get_current_admin)):
+    """Withdrawals whose payout may or may not have happened; funds stay reserved until resolved"""
+    withdrawals = await db.transactions.find(
+        {"needs_review": True, "status": "submitted"},
+        {"_id": 0, "queue_at": 0}
+    ).sort("created_at", ASCENDING).to_list(500)
+    return {"withdrawals": withdrawals, "count": len(withdrawals)}
+
+@api_router.post("/admin/withdrawals/{withdrawal_id}/resolve")
+async def admin_resolve_withdrawal(withdrawal_id: str, data: dict, admin: dict = Depends(get_current_admin)):
+    """
+    Record the outcome of a withdrawal held for review, after checking it with CoinConnect:
+    {"outcome": "completed", "txn_hash": ...} or {"outcome": "failed", "reason": ...} (refunds)
+    """
+    withdrawal = await db.transactions.find_one(
+        {"id": withdrawal_id, "type": "withdrawal", "needs_review": True, "status": "submitted"},
+        {"_id": 0}
+    )
+    if not withdrawal:
+        raise HTTPException(status_code=404, detail="Withdrawal not awaiting review")
+    
+    outcome = data.get("outcome")
+    if outcome == "completed":
+        settled = await withdrawal_queue.settle_completed(withdrawal, data.get("txn_hash"))
+    elif outcome == "failed":
+        settled = await withdrawal_queue.settle_failed(withdrawal, data.get("reason") or "Rejected on review")
+    else:
+        raise HTTPException(status_code=400, detail="outcome must be completed or failed")
+    if not settled:
+        raise HTTPException(status_code=409, detail="Withdrawal was already settled")
+    return {"message": f"Withdrawal marked {outcome}"}
+
+# ==================== EXPORTS ====================
+
+TRANSACTION_EXPORT_FIELDS = [
+    "id", "created_at", "user_id", "type", "status", "amount", "fee", "fee_percent", "net_amount",
+    "level", "income_type", "from_user_id", "transfer_type", "recipient_id", "sender_id",
+    "to_address", "txn_id", "txn_hash", "failure_reason"
+]
+USER_EXPORT_FIELDS = [  # Never MT5 credentials
+    "id", "created_at", "email", "first_name", "last_name", "mobile", "referral_code", "sponsor_id",
+    "is_active", "subscription_expires", "wallet_address", "wallet_balance", "deposit_balance",
+    "temporary_wallet", "total_income", "direct_referrals", "team_size"
+]
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def created_at_range(start: Optional[str], end: Optional[str]) -> dict:
+    """created_at filter for [start, end); dates or ISO datetimes, naive values taken as UTC"""
+    bounds = {}
+    for op, value in (("$gte", start), ("$lt", end)):
+        if not value:
+            continue
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        # created_at is stored as an ISO string in UTC, so string order is time order
+        bounds[op] = parsed.astimezone(timezone.utc).isoformat()
+    return {"created_at": bounds} if bounds else {}
+
+def export_cell(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+async def export_chunks(cursor, fmt: str, fields: List[str], compress: bool):
+    """
+    Encode rows from a Motor cursor as NDJSON or CSV, optionally gzipped, yielding
+    roughly EXPORT_CHUNK_BYTES at a time. Memory stays at one cursor batch plus one chunk.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore") if fmt == "csv" else None
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+    
+    def drain() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+    
+    if writer:
+        writer.writeheader()
+    async for row in cursor:
+        if writer:
+            writer.writerow({k: export_cell(v) for k, v in row.items()})
+        else:
+            buffer.write(json.dumps(row, default=str))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            chunk = drain()
+            if chunk:
+                yield chunk
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+def export_response(collection_name: str, query: dict, projection: dict, fmt: str, fields: List[str], compress: bool) -> StreamingResponse:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    # Oldest first on (created_at, id), the order the listing indexes already provide
+    cursor = db[collection_name].find(query, projection).sort(
+        [("created_at", ASCENDING), ("id", ASCENDING)]
+    ).batch_size(EXPORT_CURSOR_BATCH)
+    filename = f"{collection_name}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    if compress:
+        filename += ".gz"
+    return StreamingResponse(
+        export_chunks(cursor, fmt, fields, compress),
+        media_type="application/gzip" if compress else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/admin/export/transactions")
+async def admin_export_transactions(
+    format: str = "ndjson",
+    gzip: bool = False,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    admin: dict = Depends(get_current_admin)
+):
+    """Full ledger, oldest first, streamed; NDJSON rows are complete documents, CSV has TRANSACTION_EXPORT_FIELDS"""
+    query = created_at_range(start, end)
+    if type:
+        query["type"] = type
+    if status:
+        query["status"] = status
+    return export_response("transactions", query, {"_id": 0, "queue_at": 0}, format, TRANSACTION_EXPORT_FIELDS, gzip)
+
+@api_router.get("/admin/export/users")
+async def admin_export_users(
+    format: str = "ndjson",
+    gzip: bool = False,
+    status: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    admin: dict = Depends(get_current_admin)
+):
+    """All users, oldest first, streamed with USER_EXPORT_FIELDS; status filters on is_active (active/inactive)"""
+    query = created_at_range(start, end)
+    if status:
+        if status not in ("active", "inactive"):
+            raise HTTPException(status_code=400, detail="status must be active or inactive")
+        query["is_active"] = status == "active"
+    projection = {"_id": 0, **{field: 1 for field in USER_EXPORT_FIELDS}}
+    return export_response("users", query, projection, format, USER_EXPORT_FIELDS, gzip)
 
 # ==================== PUBLIC ENDPOINTS ====================
 
@@ -1469,68 +3814,113 @@ async def root():
 @api_router.post("/admin/process-expired-grace-periods")
 async def process_expired_grace_periods(admin: dict = Depends(get_current_admin)):
     """
-    Admin endpoint to manually process expired grace periods.
+    Admin endpoint to run the grace period sweep now instead of waiting for the next interval.
     Forfeits temporary wallet for users whose grace period has expired.
     """
-    sub_settings = await get_subscription_settings()
-    grace_period_hours = sub_settings.get("grace_period_hours", 48)
-    
-    # Find users with temporary wallet balance
-    users_with_temp = await db.users.find(
-        {"temporary_wallet": {"$gt": 0}},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    forfeited_count = 0
-    forfeited_total = 0
-    
-    for user in users_with_temp:
-        status = get_user_subscription_status(user, grace_period_hours)
-        if status == "inactive":  # Grace period expired
-            temp_amount = user.get("temporary_wallet", 0)
-            await forfeit_temporary_wallet(user["id"])
-            forfeited_count += 1
-            forfeited_total += temp_amount
+    result = await sweep_expired_grace_periods()
+    if result is None:
+        raise HTTPException(status_code=409, detail="A grace period sweep is already running")
     
     return {
-        "message": f"Processed {forfeited_count} users",
-        "forfeited_count": forfeited_count,
-        "forfeited_total": forfeited_total
+        "message": f"Processed {result['forfeited_count']} users",
+        **result
     }
 
+GRACE_LISTING_PROJECTION = {
+    "_id": 0, "id": 1, "email": 1, "first_name": 1, "last_name": 1,
+    "subscription_expires": 1, "grace_ends_at": 1, "temporary_wallet": 1
+}
+
 @api_router.get("/admin/grace-period-users")
-async def get_grace_period_users(admin: dict = Depends(get_current_admin)):
+async def get_grace_period_users(cursor: Optional[str] = None, limit: int = 50, admin: dict = Depends(get_current_admin)):
     """
-    Get list of users currently in grace period or with pending temporary wallet.
+    Get list of users currently in grace period or with pending temporary wallet,
+    soonest grace end first, keyset-paginated on (grace_ends_at, id).
     """
+    limit = max(1, min(limit, 500))
     sub_settings = await get_subscription_settings()
     grace_period_hours = sub_settings.get("grace_period_hours", 48)
     
-    # Find all users with subscription
-    all_users = await db.users.find(
-        {"subscription_expires": {"$ne": None}},
-        {"_id": 0}
-    ).to_list(1000)
+    # Truncated to the minute so every page and the cached total see the same window
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    window_end = now + timedelta(hours=grace_period_hours)
+    # In grace: subscription_expires < now <= grace_ends_at, i.e. grace_ends_at in [now, now + grace period).
+    # Each branch is a range on its own grace_ends_at index.
+    query = {"$or": [
+        {"grace_ends_at": {"$gte": now, "$lt": window_end}},
+        {"temporary_wallet": {"$gt": 0}, "grace_ends_at": {"$lt": window_end}}
+    ]}
+    
+    users, next_cursor = await keyset_page(
+        "users", query, cursor, limit,
+        sort_field="grace_ends_at", projection=GRACE_LISTING_PROJECTION, descending=False
+    )
+    total = await get_listing_total("users", query)
     
     grace_period_users = []
-    for user in all_users:
-        status = get_user_subscription_status(user, grace_period_hours)
-        if status == "grace_period" or user.get("temporary_wallet", 0) > 0:
-            expires = datetime.fromisoformat(user["subscription_expires"])
-            grace_end = expires + timedelta(hours=grace_period_hours)
-            
-            grace_period_users.append({
-                "id": user["id"],
-                "email": user["email"],
-                "first_name": user.get("first_name"),
-                "last_name": user.get("last_name"),
-                "subscription_status": status,
-                "subscription_expires": user["subscription_expires"],
-                "grace_period_ends": grace_end.isoformat(),
-                "temporary_wallet": user.get("temporary_wallet", 0)
-            })
+    for user in users:
+        grace_end = user.pop("grace_ends_at").replace(tzinfo=timezone.utc)
+        grace_period_users.append({
+            **user,
+            "subscription_status": "grace_period" if grace_end >= now else "inactive",
+            "grace_period_ends": grace_end.isoformat()
+        })
     
-    return {"users": grace_period_users, "count": len(grace_period_users)}
+    return {"users": grace_period_users, "count": len(grace_period_users), "total": total, "next_cursor": next_cursor}
+
+# ==================== MAINTENANCE ====================
+
+@api_router.get("/admin/indexes")
+async def admin_index_stats(admin: dict = Depends(get_current_admin)):
+    """Usage stats for the indexes on every catalogued collection"""
+    collections = {}
+    for collection_name in INDEX_CATALOGUE:
+        stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(100)
+        collections[collection_name] = [
+            {
+                "name": stat["name"],
+                "key": stat["key"],
+                "ops": stat.get("accesses", {}).get("ops", 0),
+                "since": stat.get("accesses", {}).get("since")
+            }
+            for stat in stats
+        ]
+    return {"collections": collections}
+
+@api_router.post("/admin/indexes/ensure")
+async def admin_ensure_indexes(admin: dict = Depends(get_current_admin)):
+    """Re-apply the index catalogue (same as at startup)"""
+    await ensure_indexes()
+    return {"message": "Indexes ensured"}
+
+@api_router.post("/admin/maintenance/backfill-ancestors")
+async def admin_backfill_ancestors(admin: dict = Depends(get_current_admin)):
+    """Migration: materialize the ancestors array on every user"""
+    updated = await backfill_ancestors()
+    return {"message": f"Ancestor paths computed for {updated} users", "updated": updated}
+
+@api_router.post("/admin/maintenance/reconcile-direct-referrals")
+async def admin_reconcile_direct_referrals(admin: dict = Depends(get_current_admin)):
+    """Recount direct referrals from sponsor links"""
+    repaired = await reconcile_direct_referrals()
+    return {"message": f"Repaired direct referral counts for {repaired} users", "repaired": repaired}
+
+@api_router.post("/admin/maintenance/rebuild-team-counts")
+async def admin_rebuild_team_counts(admin: dict = Depends(get_current_admin)):
+    """Recompute team_size and per-level team counts from scratch"""
+    rebuilt = await rebuild_team_counters()
+    return {"message": f"Team counters rebuilt for {rebuilt} users with a downline", "rebuilt": rebuilt}
+
+@api_router.post("/admin/maintenance/rebuild-income-summaries")
+async def admin_rebuild_income_summaries(user_id: Optional[str] = None, admin: dict = Depends(get_current_admin)):
+    """Recompute income summaries from the transaction log (one user with ?user_id=, or everyone)"""
+    rebuilt = await rebuild_income_summaries(user_id)
+    return {"message": f"Income summaries rebuilt for {rebuilt} users", "rebuilt": rebuilt}
+
+@api_router.post("/admin/maintenance/verify-platform-stats")
+async def admin_verify_platform_stats(admin: dict = Depends(get_current_admin)):
+    """Recount the dashboard totals now and repair the counters if they drifted"""
+    return await verify_platform_stats()
 
 # ==================== SETUP ====================
 
@@ -1561,6 +3951,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def startup_team_tree_migration():
+    global _team_tree_migration
+    _team_tree_migration = asyncio.create_task(migrate_team_tree())
+
+@app.on_event("startup")
+async def startup_coinconnect_client():
+    get_coinconnect_client()
+
+@app.on_event("startup")
+async def startup_email_worker():
+    email_worker.start()
+
+@app.on_event("startup")
+async def startup_platform_stats_verifier():
+    platform_stats_verifier.start()
+
+@app.on_event("startup")
+async def startup_grace_sweeper():
+    grace_sweeper.start()
+
+@app.on_event("startup")
+async def startup_deposit_watcher():
+    deposit_watcher.start()
+
+@app.on_event("startup")
+async def startup_withdrawal_queue():
+    withdrawal_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_team_tree_migration():
+    if _team_tree_migration is not None:
+        _team_tree_migration.cancel()
+        await asyncio.gather(_team_tree_migration, return_exceptions=True)
+
+@app.on_event("shutdown")
+async def shutdown_withdrawal_queue():
+    await withdrawal_queue.stop()
+
+@app.on_event("shutdown")
+async def shutdown_deposit_watcher():
+    await deposit_watcher.stop()
+
+@app.on_event("shutdown")
+async def shutdown_grace_sweeper():
+    await grace_sweeper.stop()
+
+@app.on_event("shutdown")
+async def shutdown_platform_stats_verifier():
+    await platform_stats_verifier.stop()
+
+@app.on_event("shutdown")
+async def shutdown_email_worker():
+    await email_worker.stop()
+
+@app.on_event("shutdown")
+async def shutdown_coinconnect_client():
+    global coinconnect_client
+    if coinconnect_client is not None:
+        await coinconnect_client.aclose()
+        coinconnect_client = None
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,92 @@
+"""
+Test Admin Exports for GEM BOT MLM
+- Transactions and users stream as NDJSON or CSV
+- Gzip output decompresses to the same rows
+- Type, status and date range filters; invalid input is rejected
+"""
+
+import pytest
+import requests
+import os
+import csv
+import gzip
+import io
+import json
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ADMIN_EMAIL = "admin@gembot.com"
+ADMIN_PASSWORD = "admin123"
+
+
+class TestAdminExports:
+    """Test the streaming transaction and user exports"""
+
+    @pytest.fixture(scope="class")
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/admin/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        assert response.status_code == 200, f"Admin login failed: {response.text}"
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def test_transactions_ndjson(self, admin_headers):
+        """Every NDJSON line is one transaction, oldest first, matching the type filter"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/transactions",
+            params={"type": "level_income"},
+            headers=admin_headers
+        )
+        assert response.status_code == 200, f"Export failed: {response.text}"
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines() if line]
+        assert all(row["type"] == "level_income" for row in rows)
+        created = [row["created_at"] for row in rows]
+        assert created == sorted(created)
+
+    def test_transactions_csv_gzip(self, admin_headers):
+        """Gzipped CSV has the header row and a filename ending in .csv.gz"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/transactions",
+            params={"format": "csv", "gzip": "true", "start": "2020-01-01"},
+            headers=admin_headers
+        )
+        assert response.status_code == 200, f"Export failed: {response.text}"
+        assert ".csv.gz" in response.headers["content-disposition"]
+        reader = csv.DictReader(io.StringIO(gzip.decompress(response.content).decode()))
+        assert "amount" in reader.fieldnames
+        assert "type" in reader.fieldnames
+
+    def test_users_csv_excludes_credentials(self, admin_headers):
+        """User export never carries MT5 credentials"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/users",
+            params={"format": "csv", "status": "active"},
+            headers=admin_headers
+        )
+        assert response.status_code == 200, f"Export failed: {response.text}"
+        reader = csv.DictReader(io.StringIO(response.text))
+        assert "email" in reader.fieldnames
+        assert "mt5_password" not in reader.fieldnames
+        assert all(row["is_active"] == "True" for row in reader)
+
+    def test_invalid_parameters(self, admin_headers):
+        """Unknown formats and unparseable dates are 400s"""
+        bad_format = requests.get(
+            f"{BASE_URL}/api/admin/export/transactions",
+            params={"format": "xml"},
+            headers=admin_headers
+        )
+        assert bad_format.status_code == 400
+        bad_date = requests.get(
+            f"{BASE_URL}/api/admin/export/users",
+            params={"start": "last month"},
+            headers=admin_headers
+        )
+        assert bad_date.status_code == 400
+
+    def test_requires_admin(self):
+        """Exports are admin only"""
+        response = requests.get(f"{BASE_URL}/api/admin/export/transactions")
+        assert response.status_code in [401, 403]
@@ -0,0 +1,103 @@
+"""
+Test Admin Dashboard Counters for GEM BOT MLM
+- Dashboard totals come from the platform_stats counters
+- New users increment total_users without a recount
+- Verification recomputes the totals and reports drift
+- Additional commission listing reports payout exposure and supports search
+"""
+
+import pytest
+import requests
+import os
+from datetime import datetime
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ADMIN_EMAIL = "admin@gembot.com"
+ADMIN_PASSWORD = "admin123"
+DEFAULT_OTP = "000000"
+RUN_ID = datetime.now().strftime('%H%M%S%f')
+
+
+class TestPlatformStats:
+    """Test the incrementally maintained dashboard totals"""
+
+    @pytest.fixture(scope="class")
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/admin/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        assert response.status_code == 200, f"Admin login failed: {response.text}"
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def test_dashboard_totals(self, admin_headers):
+        """Dashboard returns the counters and when they were last verified"""
+        response = requests.get(f"{BASE_URL}/api/admin/dashboard", headers=admin_headers)
+        assert response.status_code == 200, f"Failed to get dashboard: {response.text}"
+        data = response.json()
+        for field in ["total_users", "active_users", "total_income", "total_withdrawals"]:
+            assert field in data
+        assert data["stats_verified_at"] is not None
+
+    def test_new_user_increments_total(self, admin_headers):
+        """Creating a user bumps total_users by one"""
+        before = requests.get(f"{BASE_URL}/api/admin/dashboard", headers=admin_headers).json()
+
+        requests.post(f"{BASE_URL}/api/auth/send-otp", json={"email": f"test_stats_{RUN_ID}@example.com"})
+        verify_response = requests.post(f"{BASE_URL}/api/auth/verify-otp", json={
+            "email": f"test_stats_{RUN_ID}@example.com",
+            "otp": DEFAULT_OTP
+        })
+        assert verify_response.status_code == 200
+        assert verify_response.json()["is_new_user"] is True
+
+        after = requests.get(f"{BASE_URL}/api/admin/dashboard", headers=admin_headers).json()
+        assert after["total_users"] >= before["total_users"] + 1
+
+    def test_verify_platform_stats(self, admin_headers):
+        """Verification recounts and leaves the counters matching the recount"""
+        response = requests.post(f"{BASE_URL}/api/admin/maintenance/verify-platform-stats", headers=admin_headers)
+        assert response.status_code == 200, f"Failed to verify stats: {response.text}"
+        data = response.json()
+        assert "repaired" in data
+        assert "drift" in data
+
+        dashboard = requests.get(f"{BASE_URL}/api/admin/dashboard", headers=admin_headers).json()
+        assert dashboard["total_users"] >= data["stats"]["total_users"]
+
+
+class TestAdditionalCommissionListing:
+    """Test the aggregated additional commissions listing"""
+
+    @pytest.fixture(scope="class")
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/admin/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        assert response.status_code == 200, f"Admin login failed: {response.text}"
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def test_listing_reports_exposure(self, admin_headers):
+        """Listing returns a page, a total and the summed percentages"""
+        response = requests.get(f"{BASE_URL}/api/admin/additional-commissions", headers=admin_headers)
+        assert response.status_code == 200, f"Failed to list commissions: {response.text}"
+        data = response.json()
+        assert "next_cursor" in data
+        assert data["total"] == data["exposure"]["users"]
+        assert data["exposure"]["activation_percentage"] >= 0
+        assert data["exposure"]["renewal_percentage"] >= 0
+
+    def test_search_by_email(self, admin_headers):
+        """An email search with no match returns nothing but keeps the exposure totals"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/additional-commissions",
+            params={"search": f"no-such-user-{RUN_ID}@example.com"},
+            headers=admin_headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["commissions"] == []
+        assert data["total"] == 0
+        assert "users" in data["exposure"]
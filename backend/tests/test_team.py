@@ -0,0 +1,136 @@
+"""
+Test Team Summary and Paginated Team Members for GEM BOT MLM
+- /user/team returns per-level counts with active/grace/inactive breakdown only
+- /user/team/members returns one level with projected fields and cursor pagination
+- Team counters (team_size, direct_referrals) follow new referrals
+"""
+
+import pytest
+import requests
+import os
+from datetime import datetime
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+DEFAULT_OTP = "000000"
+RUN_ID = datetime.now().strftime('%H%M%S%f')
+
+
+def login_user(email, referral_code=None):
+    """Create or log in a user via OTP and complete profile; returns (token, user)"""
+    requests.post(f"{BASE_URL}/api/auth/send-otp", json={"email": email})
+    verify_response = requests.post(f"{BASE_URL}/api/auth/verify-otp", json={
+        "email": email,
+        "otp": DEFAULT_OTP
+    })
+    assert verify_response.status_code == 200, f"Failed to verify OTP: {verify_response.text}"
+    data = verify_response.json()
+    token = data["token"]
+
+    if not data.get("is_profile_complete"):
+        url = f"{BASE_URL}/api/auth/complete-profile"
+        if referral_code:
+            url += f"?referral_code={referral_code}"
+        profile_response = requests.post(
+            url,
+            headers={"Authorization": f"Bearer {token}"},
+            json={"first_name": "Test", "last_name": "Team", "mobile": "+1234567890"}
+        )
+        assert profile_response.status_code == 200, f"Failed to complete profile: {profile_response.text}"
+        return token, profile_response.json()["user"]
+    return token, data["user"]
+
+
+class TestTeamSummary:
+    """Test team summary and members endpoints"""
+
+    @pytest.fixture(scope="class")
+    def sponsor_with_downline(self):
+        """Sponsor with two direct referrals, one of which has a referral of their own"""
+        sponsor_token, sponsor = login_user(f"test_team_sponsor_{RUN_ID}@example.com")
+        _, direct_a = login_user(f"test_team_a_{RUN_ID}@example.com", sponsor["referral_code"])
+        login_user(f"test_team_b_{RUN_ID}@example.com", sponsor["referral_code"])
+        login_user(f"test_team_c_{RUN_ID}@example.com", direct_a["referral_code"])
+        return sponsor_token
+
+    def test_team_summary_counts(self, sponsor_with_downline):
+        """Summary reports per-level counts and status breakdown without member lists"""
+        response = requests.get(
+            f"{BASE_URL}/api/user/team",
+            headers={"Authorization": f"Bearer {sponsor_with_downline}"}
+        )
+        assert response.status_code == 200, f"Failed to get team: {response.text}"
+        data = response.json()
+
+        assert data["total_team"] == 3
+        levels = {lvl["level"]: lvl for lvl in data["levels"]}
+        assert levels[1]["count"] == 2
+        assert levels[2]["count"] == 1
+        for lvl in data["levels"]:
+            assert "members" not in lvl, "Summary should not include member lists"
+            assert lvl["active"] + lvl["grace_period"] + lvl["inactive"] == lvl["count"]
+
+    def test_team_members_pagination(self, sponsor_with_downline):
+        """Level members come back one page at a time with a next_cursor"""
+        headers = {"Authorization": f"Bearer {sponsor_with_downline}"}
+        first_page = requests.get(f"{BASE_URL}/api/user/team/members?level=1&limit=1", headers=headers)
+        assert first_page.status_code == 200, f"Failed to get members: {first_page.text}"
+        first = first_page.json()
+        assert len(first["members"]) == 1
+        assert first["next_cursor"], "Expected a cursor for the second page"
+        member = first["members"][0]
+        assert "subscription_status" in member
+        assert "mt5_password" not in member, "Member projection should exclude sensitive fields"
+
+        second_page = requests.get(
+            f"{BASE_URL}/api/user/team/members",
+            params={"level": 1, "limit": 1, "cursor": first["next_cursor"]},
+            headers=headers
+        )
+        assert second_page.status_code == 200
+        second = second_page.json()
+        assert len(second["members"]) == 1
+        assert second["members"][0]["id"] != member["id"]
+        assert second["next_cursor"] is None
+
+    def test_team_members_invalid_level(self, sponsor_with_downline):
+        """Levels outside 1-10 are rejected"""
+        response = requests.get(
+            f"{BASE_URL}/api/user/team/members?level=11",
+            headers={"Authorization": f"Bearer {sponsor_with_downline}"}
+        )
+        assert response.status_code == 400
+
+    def test_dashboard_team_counters(self, sponsor_with_downline):
+        """Dashboard team numbers come from the maintained counters"""
+        response = requests.get(
+            f"{BASE_URL}/api/user/dashboard",
+            headers={"Authorization": f"Bearer {sponsor_with_downline}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["direct_referrals"] == 2
+        assert data["total_team"] == 3
+
+    def test_late_sponsor_brings_downline(self):
+        """A user who gets a sponsor after others joined under them moves with that downline"""
+        leader_token, leader = login_user(f"test_team_leader_{RUN_ID}@example.com")
+        late_token, late = login_user(f"test_team_late_{RUN_ID}@example.com")
+        login_user(f"test_team_late_member_{RUN_ID}@example.com", late["referral_code"])
+
+        response = requests.post(
+            f"{BASE_URL}/api/auth/complete-profile?referral_code={leader['referral_code']}",
+            headers={"Authorization": f"Bearer {late_token}"},
+            json={"first_name": "Test", "last_name": "Late", "mobile": "+1234567890"}
+        )
+        assert response.status_code == 200
+        assert response.json()["user"]["sponsor_id"] == leader["id"]
+
+        data = requests.get(
+            f"{BASE_URL}/api/user/team",
+            headers={"Authorization": f"Bearer {leader_token}"}
+        ).json()
+        assert data["total_team"] == 2
+        levels = {lvl["level"]: lvl for lvl in data["levels"]}
+        assert levels[1]["count"] == 1
+        assert levels[2]["count"] == 1
@@ -3,6 +3,10 @@ Test Wallet Features - GEM BOT MLM Platform
 Tests for:
 - Wallet page API returns wallet_settings with all fee configurations
 - Internal Transfer: Earnings <-> Deposit
+- Parallel debits never overdraw a balance
+- Queued withdrawals and their status
+- Idempotency-Key replays instead of repeating a transfer
+- Transaction history pagination, filters and delta sync
 - User-to-User Transfer
 - Admin Wallet Settings CRUD
 """
@@ -10,6 +14,10 @@ import pytest
 import requests
 import os
 import uuid
+import time
+import json
+import base64
+from concurrent.futures import ThreadPoolExecutor
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://gem-bot-mlm.preview.emergentagent.com')
 if BASE_URL.endswith('/'):
@@ -178,6 +186,47 @@ class TestUserWalletAPI:
         
         print(f"✅ User wallet returns wallet_settings: {settings}")
 
+    def test_profile_update_visible_within_cache_ttl(self, user_token_and_id):
+        """
+        Test a profile write is reflected by later reads despite the user cache: at once on the
+        worker that wrote it, within the cache TTL (5s by default) on any other worker
+        """
+        headers = {"Authorization": f"Bearer {user_token_and_id['token']}"}
+        requests.get(f"{BASE_URL}/api/user/profile", headers=headers)  # Warm the cache
+        response = requests.put(
+            f"{BASE_URL}/api/user/profile",
+            headers=headers,
+            json={"first_name": "Cached", "last_name": "Wallet", "mobile": "+1234567890"}
+        )
+        assert response.status_code == 200
+        assert response.json()["first_name"] == "Cached"
+
+        deadline = time.monotonic() + 7
+        while True:
+            response = requests.get(f"{BASE_URL}/api/user/profile", headers=headers)
+            assert response.status_code == 200
+            if response.json()["first_name"] == "Cached" or time.monotonic() > deadline:
+                break
+            time.sleep(0.5)
+        assert response.json()["first_name"] == "Cached", "Profile read stale past the user cache TTL"
+
+    def test_check_activation_returns_status(self, user_token_and_id):
+        """Test POST /api/user/check-activation queues a deposit check and returns the status"""
+        headers = {"Authorization": f"Bearer {user_token_and_id['token']}"}
+        response = requests.post(f"{BASE_URL}/api/user/check-activation", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        for field in ["activated", "pending", "subscription_status", "user"]:
+            assert field in data, f"Missing field in activation status: {field}"
+
+        # Status read mirrors the same fields without touching CoinConnect
+        response = requests.get(f"{BASE_URL}/api/user/activation-status", headers=headers)
+        assert response.status_code == 200
+        status = response.json()
+        assert status["subscription_status"] in ["active", "grace_period", "inactive"]
+        assert isinstance(status["pending"], bool)
+        print(f"✅ Activation status: {status}")
+
 
 class TestInternalTransfer:
     """Internal Transfer Tests - Earnings <-> Deposit"""
@@ -313,6 +362,260 @@ class TestInternalTransfer:
         print(f"✅ Below minimum correctly rejected")
 
 
+class TestConcurrentDebits:
+    """Parallel transfers against one balance - the conditional debit must let only the covered ones through"""
+    
+    @pytest.fixture(scope="class")
+    def admin_token(self):
+        response = requests.post(
+            f"{BASE_URL}/api/admin/login",
+            json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
+        )
+        assert response.status_code == 200
+        return response.json()["token"]
+    
+    @pytest.fixture(scope="class")
+    def funded_user(self, admin_token):
+        """User with exactly 100 in earnings"""
+        email = f"concurrent_test_{uuid.uuid4().hex[:8]}@example.com"
+        requests.post(f"{BASE_URL}/api/auth/send-otp", json={"email": email})
+        data = requests.post(
+            f"{BASE_URL}/api/auth/verify-otp",
+            json={"email": email, "otp": DEFAULT_OTP}
+        ).json()
+        token = data["token"]
+        requests.post(
+            f"{BASE_URL}/api/auth/complete-profile",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json={"first_name": "Concurrent", "last_name": "Test", "mobile": "+1234567890"}
+        )
+        requests.put(
+            f"{BASE_URL}/api/admin/users/{data['user']['id']}",
+            headers={"Authorization": f"Bearer {admin_token}", "Content-Type": "application/json"},
+            json={"wallet_balance": 100.0}
+        )
+        return {"token": token}
+    
+    def test_parallel_internal_transfers_do_not_overdraw(self, funded_user):
+        """Five parallel 30.0 transfers from a 100.0 balance: exactly three succeed"""
+        headers = {"Authorization": f"Bearer {funded_user['token']}", "Content-Type": "application/json"}
+        
+        def transfer(_):
+            return requests.post(
+                f"{BASE_URL}/api/user/internal-transfer",
+                headers=headers,
+                json={"amount": 30.0, "transfer_type": "earnings_to_deposit"}
+            ).status_code
+        
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            statuses = list(pool.map(transfer, range(5)))
+        
+        assert statuses.count(200) == 3, f"Unexpected results: {statuses}"
+        assert statuses.count(400) == 2
+        
+        wallet = requests.get(f"{BASE_URL}/api/user/wallet", headers=headers).json()
+        assert abs(wallet["earnings_balance"] - 10.0) < 1e-6, f"Earnings balance drifted: {wallet['earnings_balance']}"
+        print(f"✅ Parallel transfers: {statuses}, earnings left {wallet['earnings_balance']}")
+
+
+class TestIdempotencyKeys:
+    """Retried money-moving requests with an Idempotency-Key run once"""
+    
+    @pytest.fixture(scope="class")
+    def admin_token(self):
+        response = requests.post(
+            f"{BASE_URL}/api/admin/login",
+            json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
+        )
+        assert response.status_code == 200
+        return response.json()["token"]
+    
+    @pytest.fixture(scope="class")
+    def funded_user(self, admin_token):
+        """User with exactly 100 in earnings"""
+        email = f"idempotency_test_{uuid.uuid4().hex[:8]}@example.com"
+        requests.post(f"{BASE_URL}/api/auth/send-otp", json={"email": email})
+        data = requests.post(
+            f"{BASE_URL}/api/auth/verify-otp",
+            json={"email": email, "otp": DEFAULT_OTP}
+        ).json()
+        token = data["token"]
+        requests.post(
+            f"{BASE_URL}/api/auth/complete-profile",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json={"first_name": "Idempotency", "last_name": "Test", "mobile": "+1234567890"}
+        )
+        requests.put(
+            f"{BASE_URL}/api/admin/users/{data['user']['id']}",
+            headers={"Authorization": f"Bearer {admin_token}", "Content-Type": "application/json"},
+            json={"wallet_balance": 100.0}
+        )
+        return {"token": token}
+    
+    def test_retry_replays_first_response(self, funded_user):
+        """Sending the same transfer twice with one key debits once and returns the same body"""
+        headers = {
+            "Authorization": f"Bearer {funded_user['token']}",
+            "Content-Type": "application/json",
+            "Idempotency-Key": str(uuid.uuid4())
+        }
+        body = {"amount": 25.0, "transfer_type": "earnings_to_deposit"}
+        
+        first = requests.post(f"{BASE_URL}/api/user/internal-transfer", headers=headers, json=body)
+        second = requests.post(f"{BASE_URL}/api/user/internal-transfer", headers=headers, json=body)
+        assert first.status_code == 200, f"Transfer failed: {first.text}"
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        
+        wallet = requests.get(f"{BASE_URL}/api/user/wallet", headers=headers).json()
+        assert abs(wallet["earnings_balance"] - 75.0) < 1e-6, "Retry should not debit again"
+        print(f"✅ Retry replayed, earnings {wallet['earnings_balance']}")
+    
+    def test_key_reused_for_different_request(self, funded_user):
+        """Reusing a key with a different body is rejected"""
+        headers = {
+            "Authorization": f"Bearer {funded_user['token']}",
+            "Content-Type": "application/json",
+            "Idempotency-Key": str(uuid.uuid4())
+        }
+        requests.post(
+            f"{BASE_URL}/api/user/internal-transfer",
+            headers=headers,
+            json={"amount": 5.0, "transfer_type": "earnings_to_deposit"}
+        )
+        response = requests.post(
+            f"{BASE_URL}/api/user/internal-transfer",
+            headers=headers,
+            json={"amount": 6.0, "transfer_type": "earnings_to_deposit"}
+        )
+        assert response.status_code == 422
+
+
+class TestTransactionHistory:
+    """Paginated, filtered /user/transactions and its since-based delta sync"""
+    
+    @pytest.fixture(scope="class")
+    def admin_token(self):
+        response = requests.post(
+            f"{BASE_URL}/api/admin/login",
+            json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
+        )
+        assert response.status_code == 200
+        return response.json()["token"]
+    
+    @pytest.fixture(scope="class")
+    def user_headers(self, admin_token):
+        """User with 100 in earnings and three internal transfers"""
+        email = f"history_test_{uuid.uuid4().hex[:8]}@example.com"
+        requests.post(f"{BASE_URL}/api/auth/send-otp", json={"email": email})
+        data = requests.post(
+            f"{BASE_URL}/api/auth/verify-otp",
+            json={"email": email, "otp": DEFAULT_OTP}
+        ).json()
+        headers = {"Authorization": f"Bearer {data['token']}", "Content-Type": "application/json"}
+        requests.post(
+            f"{BASE_URL}/api/auth/complete-profile",
+            headers=headers,
+            json={"first_name": "History", "last_name": "Test", "mobile": "+1234567890"}
+        )
+        requests.put(
+            f"{BASE_URL}/api/admin/users/{data['user']['id']}",
+            headers={"Authorization": f"Bearer {admin_token}", "Content-Type": "application/json"},
+            json={"wallet_balance": 100.0}
+        )
+        for _ in range(3):
+            response = requests.post(
+                f"{BASE_URL}/api/user/internal-transfer",
+                headers=headers,
+                json={"amount": 5.0, "transfer_type": "earnings_to_deposit"}
+            )
+            assert response.status_code == 200
+        return headers
+    
+    def test_pagination_and_type_filter(self, user_headers):
+        """Pages of two follow next_cursor without repeating rows"""
+        first = requests.get(
+            f"{BASE_URL}/api/user/transactions",
+            params={"limit": 2, "type": "internal_transfer"},
+            headers=user_headers
+        )
+        assert first.status_code == 200
+        data = first.json()
+        assert len(data["transactions"]) == 2
+        assert all(txn["type"] == "internal_transfer" for txn in data["transactions"])
+        assert data["next_cursor"]
+        
+        second = requests.get(
+            f"{BASE_URL}/api/user/transactions",
+            params={"limit": 2, "type": "internal_transfer", "cursor": data["next_cursor"]},
+            headers=user_headers
+        ).json()
+        assert len(second["transactions"]) == 1
+        assert second["next_cursor"] is None
+        first_ids = {txn["id"] for txn in data["transactions"]}
+        assert second["transactions"][0]["id"] not in first_ids
+    
+    def test_since_returns_new_rows(self, user_headers):
+        """A sync_cursor from the first page picks up a row written after it"""
+        data = requests.get(f"{BASE_URL}/api/user/transactions", headers=user_headers).json()
+        assert data["sync_cursor"]
+        
+        response = requests.post(
+            f"{BASE_URL}/api/user/internal-transfer",
+            headers=user_headers,
+            json={"amount": 5.0, "transfer_type": "earnings_to_deposit"}
+        )
+        assert response.status_code == 200
+        delta = requests.get(
+            f"{BASE_URL}/api/user/transactions",
+            params={"since": data["sync_cursor"]},
+            headers=user_headers
+        ).json()
+        # Rows changed within the settle window come back again; clients merge them by id
+        seen = {txn["id"] for txn in data["transactions"]}
+        new_rows = [txn for txn in delta["transactions"] if txn["id"] not in seen]
+        assert len(new_rows) == 1
+        assert new_rows[0]["type"] == "internal_transfer"
+        assert all(txn["updated_at"] for txn in delta["transactions"])
+        assert delta["sync_cursor"]
+        assert delta["has_more"] is False
+    
+    def test_empty_history_has_no_sync_cursor(self):
+        """With no rows there's nothing to sync from; the client reloads the first page"""
+        email = f"history_empty_{uuid.uuid4().hex[:8]}@example.com"
+        requests.post(f"{BASE_URL}/api/auth/send-otp", json={"email": email})
+        token = requests.post(
+            f"{BASE_URL}/api/auth/verify-otp",
+            json={"email": email, "otp": DEFAULT_OTP}
+        ).json()["token"]
+        data = requests.get(
+            f"{BASE_URL}/api/user/transactions",
+            headers={"Authorization": f"Bearer {token}"}
+        ).json()
+        assert data["transactions"] == []
+        assert data["sync_cursor"] is None
+    
+    def test_cursor_and_since_together_rejected(self, user_headers):
+        """cursor walks back, since walks forward; both at once is a 400"""
+        data = requests.get(f"{BASE_URL}/api/user/transactions", headers=user_headers).json()
+        response = requests.get(
+            f"{BASE_URL}/api/user/transactions",
+            params={"since": data["sync_cursor"], "cursor": data["sync_cursor"]},
+            headers=user_headers
+        )
+        assert response.status_code == 400
+    
+    def test_operator_cursor_rejected(self, user_headers):
+        """A cursor carrying a query operator instead of a sort value is a 400"""
+        forged = base64.urlsafe_b64encode(json.dumps([{"$gt": ""}, ""]).encode()).decode()
+        response = requests.get(
+            f"{BASE_URL}/api/user/transactions",
+            params={"cursor": forged},
+            headers=user_headers
+        )
+        assert response.status_code == 400
+
+
 class TestUserToUserTransfer:
     """User-to-User Transfer Tests - My Deposit → Another User's Deposit"""
     
@@ -561,6 +864,63 @@ class TestWithdrawal:
         assert response.status_code == 400
         assert "Minimum" in response.json().get("detail", "")
         print(f"✅ Below minimum withdrawal correctly rejected")
+    
+    def test_withdrawal_is_queued(self, user_with_earnings):
+        """Test withdrawal reserves funds, returns 202 and settles in the background"""
+        headers = {"Authorization": f"Bearer {user_with_earnings['token']}", "Content-Type": "application/json"}
+        before = requests.get(f"{BASE_URL}/api/user/wallet", headers=headers).json()["earnings_balance"]
+        
+        response = requests.post(
+            f"{BASE_URL}/api/user/withdraw",
+            headers=headers,
+            json={
+                "amount": 20.0,
+                "to_address": "0x1234567890abcdef1234567890abcdef12345678"
+            }
+        )
+        assert response.status_code == 202, f"Withdrawal not queued: {response.text}"
+        data = response.json()
+        assert data["status"] == "queued"
+        reserved = data["amount"] + data["fee"]
+        
+        status = None
+        for _ in range(20):
+            status_response = requests.get(f"{BASE_URL}/api/user/withdrawals/{data['withdrawal_id']}", headers=headers)
+            assert status_response.status_code == 200
+            status = status_response.json()["status"]
+            assert status in ["queued", "submitted", "completed", "failed"]
+            if status in ["completed", "failed"]:
+                break
+            time.sleep(1)
+        
+        after = requests.get(f"{BASE_URL}/api/user/wallet", headers=headers).json()["earnings_balance"]
+        if status == "failed":
+            assert abs(after - before) < 1e-6, "Failed withdrawal should release the reservation"
+        else:
+            assert abs(after - (before - reserved)) < 1e-6
+        print(f"✅ Withdrawal queued and settled as {status}")
+    
+    def test_withdrawal_review_queue(self, admin_token):
+        """Test admins can list withdrawals held for review and only resolve held ones"""
+        headers = {"Authorization": f"Bearer {admin_token}", "Content-Type": "application/json"}
+        response = requests.get(f"{BASE_URL}/api/admin/withdrawals/review", headers=headers)
+        assert response.status_code == 200
+        assert all(w["status"] == "submitted" for w in response.json()["withdrawals"])
+        
+        response = requests.post(
+            f"{BASE_URL}/api/admin/withdrawals/{uuid.uuid4()}/resolve",
+            headers=headers,
+            json={"outcome": "failed"}
+        )
+        assert response.status_code == 404
+    
+    def test_withdrawal_status_not_found(self, user_with_earnings):
+        """Test status lookup for an unknown withdrawal"""
+        response = requests.get(
+            f"{BASE_URL}/api/user/withdrawals/{uuid.uuid4()}",
+            headers={"Authorization": f"Bearer {user_with_earnings['token']}"}
+        )
+        assert response.status_code == 404
 
 
 if __name__ == "__main__":
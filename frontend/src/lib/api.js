@@ -11,6 +11,10 @@ const api = axios.create({
   },
 });
 
+// One key per logical submission: resending with the same key replays the first result
+export const newIdempotencyKey = () => crypto.randomUUID();
+const withIdempotencyKey = (key) => (key ? { headers: { 'Idempotency-Key': key } } : undefined);
+
 // Request interceptor for auth token
 api.interceptors.request.use((config) => {
   const isAdminRoute = config.url?.includes('/admin');
@@ -56,21 +60,27 @@ export const userAPI = {
   updateProfile: (data) => api.put('/user/profile', data),
   getDashboard: () => api.get('/user/dashboard'),
   getTeam: () => api.get('/user/team'),
+  getTeamMembers: (level, cursor = null, limit = 20, sort = 'joined') => 
+    api.get('/user/team/members', { params: { level, cursor, limit, sort } }),
   getIncome: () => api.get('/user/income'),
   getWallet: () => api.get('/user/wallet'),
-  withdraw: (data) => api.post('/user/withdraw', data),
-  internalTransfer: (data) => api.post('/user/internal-transfer', data),
-  userTransfer: (data) => api.post('/user/user-transfer', data),
-  checkActivation: () => api.post('/user/check-activation'),
+  withdraw: (data, idempotencyKey) => api.post('/user/withdraw', data, withIdempotencyKey(idempotencyKey)),
+  getWithdrawal: (withdrawalId) => api.get(`/user/withdrawals/${withdrawalId}`),
+  internalTransfer: (data, idempotencyKey) =>
+    api.post('/user/internal-transfer', data, withIdempotencyKey(idempotencyKey)),
+  userTransfer: (data, idempotencyKey) => api.post('/user/user-transfer', data, withIdempotencyKey(idempotencyKey)),
+  checkActivation: (idempotencyKey) => api.post('/user/check-activation', null, withIdempotencyKey(idempotencyKey)),
+  getActivationStatus: () => api.get('/user/activation-status'),
   submitMT5: (data) => api.post('/user/submit-mt5', data),
-  getTransactions: () => api.get('/user/transactions'),
+  // params: cursor (older page) or since (sync_cursor, newer rows only), limit, type, status, start, end
+  getTransactions: (params = {}) => api.get('/user/transactions', { params }),
 };
 
 // Admin APIs
 export const adminAPI = {
   login: (email, password) => api.post('/admin/login', { email, password }),
   getDashboard: () => api.get('/admin/dashboard'),
-  getUsers: (skip = 0, limit = 50) => api.get(`/admin/users?skip=${skip}&limit=${limit}`),
+  getUsers: (cursor = null, limit = 50) => api.get('/admin/users', { params: { cursor, limit } }),
   getUser: (userId) => api.get(`/admin/users/${userId}`),
   updateUser: (userId, data) => api.put(`/admin/users/${userId}`, data),
   getLevels: () => api.get('/admin/settings/levels'),
@@ -85,11 +95,15 @@ export const adminAPI = {
   updateCoinConnect: (data) => api.put('/admin/settings/coinconnect', data),
   getEmailTemplates: () => api.get('/admin/email-templates'),
   updateEmailTemplate: (type, data) => api.put(`/admin/email-templates/${type}`, data),
-  getTransactions: (skip = 0, limit = 50, type = null) => 
-    api.get(`/admin/transactions?skip=${skip}&limit=${limit}${type ? `&type=${type}` : ''}`),
+  getTransactions: (cursor = null, limit = 50, type = null) => 
+    api.get('/admin/transactions', { params: { cursor, limit, type } }),
+  // Full exports, streamed by the server; params: format (ndjson|csv), gzip, type, status, start, end
+  exportTransactions: (params) => api.get('/admin/export/transactions', { params, responseType: 'blob' }),
+  exportUsers: (params) => api.get('/admin/export/users', { params, responseType: 'blob' }),
   updateContent: (type, content) => api.put(`/admin/content/${type}`, { content }),
   // Additional Commissions
-  getAdditionalCommissions: () => api.get('/admin/additional-commissions'),
+  getAdditionalCommissions: (cursor = null, limit = 100, search = null) =>
+    api.get('/admin/additional-commissions', { params: { cursor, limit, search } }),
   addAdditionalCommission: (data) => api.post('/admin/additional-commissions', data),
   updateAdditionalCommission: (userId, data) => api.put(`/admin/additional-commissions/${userId}`, data),
   deleteAdditionalCommission: (userId) => api.delete(`/admin/additional-commissions/${userId}`),
@@ -31,6 +31,9 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogDescription } f
 import { toast } from "sonner";
 import { userAPI, publicAPI } from "../lib/api";
 
+const ACTIVATION_STATUS_POLLS = 6;
+const ACTIVATION_STATUS_POLL_MS = 2500;
+
 export default function Dashboard() {
   const navigate = useNavigate();
   const [loading, setLoading] = useState(true);
@@ -94,15 +97,23 @@ export default function Dashboard() {
     
     setActivating(true);
     try {
-      const response = await userAPI.checkActivation();
-      if (response.data.activated) {
+      let status = (await userAPI.checkActivation()).data;
+      // The server checks the deposit in the background; wait on the cheap status read
+      for (let attempt = 0; status.pending && attempt < ACTIVATION_STATUS_POLLS; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, ACTIVATION_STATUS_POLL_MS));
+        status = (await userAPI.getActivationStatus()).data;
+      }
+      if (status.activated) {
         toast.success("Account activated successfully!");
         setActivateOpen(false);
         // Show MT5 modal after activation
         setMt5Open(true);
         fetchDashboard();
+      } else if (status.pending) {
+        toast.info("Waiting for your deposit to confirm. Your account will activate automatically.");
+        setActivateOpen(false);
       } else {
-        toast.error("Insufficient deposit balance. Please top up from Wallet page.");
+        toast.error(`${status.message || "Insufficient deposit balance"}. Please top up from Wallet page.`);
       }
     } catch (error) {
       toast.error("Failed to check activation");
@@ -37,6 +37,7 @@ export default function Team() {
   const [refreshing, setRefreshing] = useState(false);
   const [data, setData] = useState(null);
   const [openLevels, setOpenLevels] = useState({});
+  const [levelMembers, setLevelMembers] = useState({});
   const [copied, setCopied] = useState(false);
   const [activeTab, setActiveTab] = useState("direct");
 
@@ -44,11 +45,19 @@ export default function Team() {
     fetchTeam();
   }, []);
 
+  // Members are fetched per level, the first time a level is opened
+  useEffect(() => {
+    Object.entries(openLevels).forEach(([level, open]) => {
+      if (open) loadLevelMembers(Number(level));
+    });
+  }, [openLevels]);
+
   const fetchTeam = async (showRefresh = false) => {
     if (showRefresh) setRefreshing(true);
     try {
       const response = await userAPI.getTeam();
       setData(response.data);
+      setLevelMembers({});
       // Open first two levels by default
       if (response.data.levels.length > 0) {
         setOpenLevels({ 1: true, 2: true });
@@ -62,6 +71,46 @@ export default function Team() {
     }
   };
 
+  const loadLevelMembers = async (level, more = false) => {
+    const current = levelMembers[level];
+    if (current?.loading || (!more && current?.loaded)) return;
+    // Nothing to fetch for empty levels
+    if (!data?.levels?.some(l => l.level === level)) return;
+    setLevelMembers(prev => ({ ...prev, [level]: { members: [], ...prev[level], loading: true } }));
+    try {
+      const response = await userAPI.getTeamMembers(level, more ? current?.nextCursor : null);
+      setLevelMembers(prev => ({
+        ...prev,
+        [level]: {
+          members: more ? [...(prev[level]?.members || []), ...response.data.members] : response.data.members,
+          nextCursor: response.data.next_cursor,
+          loaded: true,
+          loading: false
+        }
+      }));
+    } catch (error) {
+      toast.error("Failed to load team members");
+      setLevelMembers(prev => ({ ...prev, [level]: { ...prev[level], loading: false } }));
+    }
+  };
+
+  const renderLoadMore = (level) => {
+    const state = levelMembers[level];
+    if (!state?.nextCursor) return null;
+    return (
+      <Button
+        variant="ghost"
+        size="sm"
+        className="w-full"
+        onClick={() => loadLevelMembers(level, true)}
+        disabled={state.loading}
+      >
+        {state.loading ? <Loader2 className="w-4 h-4 mr-2 animate-spin" /> : null}
+        Load more
+      </Button>
+    );
+  };
+
   const toggleLevel = (level) => {
     setOpenLevels(prev => ({ ...prev, [level]: !prev[level] }));
   };
@@ -112,10 +161,14 @@ export default function Team() {
   const totalTeam = data?.total_team || 0;
   const directCount = data?.levels?.[0]?.count || 0;
   const activeLevels = data?.levels?.length || 0;
-  const totalActive = data?.levels?.reduce((sum, l) => 
-    sum + l.members.filter(m => m.is_active).length, 0) || 0;
+  const totalActive = data?.total_active || 0;
   const totalInactive = totalTeam - totalActive;
 
+  // First level in the "All Members" list that still has members to fetch
+  const nextMembersLevel = data?.levels?.find(l => 
+    !levelMembers[l.level]?.loaded || levelMembers[l.level]?.nextCursor
+  )?.level;
+
   // Calculate level distribution for chart
   const maxMembers = Math.max(...(data?.levels?.map(l => l.count) || [1]));
 
@@ -243,7 +296,7 @@ export default function Team() {
               const levelData = data?.levels?.find(l => l.level === levelNum);
               const count = levelData?.count || 0;
               const percentage = maxMembers > 0 ? (count / maxMembers) * 100 : 0;
-              const activeCount = levelData?.members?.filter(m => m.is_active).length || 0;
+              const activeCount = levelData?.active || 0;
               
               return (
                 <div key={levelNum} className="flex items-center gap-4">
@@ -307,7 +360,7 @@ export default function Team() {
             <CardContent>
               {directCount > 0 ? (
                 <div className="space-y-3">
-                  {data?.levels?.find(l => l.level === 1)?.members.map((member, idx) => (
+                  {levelMembers[1]?.members?.map((member, idx) => (
                     <div 
                       key={member.id}
                       className="flex items-center justify-between p-4 bg-gradient-to-r from-emerald-50 to-green-50 border border-emerald-100 rounded-xl hover:shadow-md transition-all"
@@ -317,7 +370,7 @@ export default function Team() {
                       <div className="flex items-center gap-4">
                         <Avatar className="w-12 h-12 ring-2 ring-emerald-200 ring-offset-2">
                           <AvatarFallback className={`font-semibold text-lg ${
-                            member.is_active 
+                            member.subscription_status === "active" 
                               ? 'bg-emerald-500 text-white' 
                               : 'bg-neutral-200 text-neutral-500'
                           }`}>
@@ -341,7 +394,7 @@ export default function Team() {
                         </div>
                       </div>
                       <div className="flex flex-col items-end gap-2">
-                        {member.is_active ? (
+                        {member.subscription_status === "active" ? (
                           <Badge className="bg-emerald-500 text-white">
                             <UserCheck className="w-3.5 h-3.5 mr-1" /> Active
                           </Badge>
@@ -353,6 +406,7 @@ export default function Team() {
                       </div>
                     </div>
                   ))}
+                  {renderLoadMore(1)}
                 </div>
               ) : (
                 <div className="text-center py-16">
@@ -395,7 +449,7 @@ export default function Team() {
                     <div>
                       <p className="text-neutral-500 text-xs uppercase tracking-wider">Active Direct</p>
                       <p className="font-heading text-2xl font-bold text-emerald-600 num-display mt-1">
-                        {data?.levels?.find(l => l.level === 1)?.members.filter(m => m.is_active).length || 0}
+                        {data?.levels?.[0]?.active || 0}
                       </p>
                     </div>
                     <div className="w-12 h-12 rounded-xl bg-emerald-50 flex items-center justify-center">
@@ -410,7 +464,7 @@ export default function Team() {
                     <div>
                       <p className="text-neutral-500 text-xs uppercase tracking-wider">Inactive Direct</p>
                       <p className="font-heading text-2xl font-bold text-amber-600 num-display mt-1">
-                        {data?.levels?.find(l => l.level === 1)?.members.filter(m => !m.is_active).length || 0}
+                        {directCount - (data?.levels?.[0]?.active || 0)}
                       </p>
                     </div>
                     <div className="w-12 h-12 rounded-xl bg-amber-50 flex items-center justify-center">
@@ -444,7 +498,7 @@ export default function Team() {
               {data?.levels?.length > 0 ? (
                 <div className="space-y-2">
                   {data.levels.map((level) => {
-                    const activeMembers = level.members.filter(m => m.is_active).length;
+                    const activeMembers = level.active;
                     
                     return (
                       <Collapsible
@@ -492,7 +546,7 @@ export default function Team() {
                         </CollapsibleTrigger>
                         <CollapsibleContent>
                           <div className="ml-6 mt-2 space-y-2 border-l-2 border-blue-200 pl-4">
-                            {level.members.map((member, idx) => (
+                            {levelMembers[level.level]?.members?.map((member, idx) => (
                               <div 
                                 key={member.id}
                                 className="flex items-center justify-between p-4 bg-white border border-neutral-100 rounded-xl hover:shadow-sm transition-shadow"
@@ -502,7 +556,7 @@ export default function Team() {
                                 <div className="flex items-center gap-3">
                                   <Avatar className="w-10 h-10">
                                     <AvatarFallback className={`font-semibold ${
-                                      member.is_active 
+                                      member.subscription_status === "active" 
                                         ? 'bg-emerald-100 text-emerald-700' 
                                         : 'bg-neutral-100 text-neutral-500'
                                     }`}>
@@ -521,7 +575,7 @@ export default function Team() {
                                   </div>
                                 </div>
                                 <div className="flex items-center gap-2">
-                                  {member.is_active ? (
+                                  {member.subscription_status === "active" ? (
                                     <Badge className="bg-emerald-100 text-emerald-700">
                                       <UserCheck className="w-3 h-3 mr-1" /> Active
                                     </Badge>
@@ -533,6 +587,12 @@ export default function Team() {
                                 </div>
                               </div>
                             ))}
+                            {levelMembers[level.level]?.loading && !levelMembers[level.level]?.members?.length && (
+                              <div className="flex justify-center py-4">
+                                <Loader2 className="w-5 h-5 animate-spin text-blue-500" />
+                              </div>
+                            )}
+                            {renderLoadMore(level.level)}
                           </div>
                         </CollapsibleContent>
                       </Collapsible>
@@ -576,7 +636,7 @@ export default function Team() {
               {totalTeam > 0 ? (
                 <div className="space-y-2">
                   {data?.levels?.flatMap(level => 
-                    level.members.map(member => ({ ...member, level: level.level }))
+                    (levelMembers[level.level]?.members || []).map(member => ({ ...member, level: level.level }))
                   ).map((member, idx) => (
                     <div 
                       key={member.id}
@@ -586,7 +646,7 @@ export default function Team() {
                       <div className="flex items-center gap-4">
                         <Avatar className="w-12 h-12">
                           <AvatarFallback className={`font-semibold text-lg ${
-                            member.is_active 
+                            member.subscription_status === "active" 
                               ? 'bg-emerald-100 text-emerald-700' 
                               : 'bg-neutral-200 text-neutral-500'
                           }`}>
@@ -604,7 +664,7 @@ export default function Team() {
                         <Badge variant="outline" className="font-mono">
                           L{member.level}
                         </Badge>
-                        {member.is_active ? (
+                        {member.subscription_status === "active" ? (
                           <Badge className="bg-emerald-100 text-emerald-700">
                             <UserCheck className="w-3 h-3 mr-1" /> Active
                           </Badge>
@@ -616,6 +676,17 @@ export default function Team() {
                       </div>
                     </div>
                   ))}
+                  {nextMembersLevel && (
+                    <Button
+                      variant="ghost"
+                      size="sm"
+                      className="w-full"
+                      onClick={() => loadLevelMembers(nextMembersLevel, Boolean(levelMembers[nextMembersLevel]?.loaded))}
+                      disabled={levelMembers[nextMembersLevel]?.loading}
+                    >
+                      Load more
+                    </Button>
+                  )}
                 </div>
               ) : (
                 <div className="text-center py-12">
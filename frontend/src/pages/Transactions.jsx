@@ -9,23 +9,59 @@ import {
 } from "lucide-react";
 import { Card, CardContent, CardHeader, CardTitle } from "../components/ui/card";
 import { Badge } from "../components/ui/badge";
+import { Button } from "../components/ui/button";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "../components/ui/select";
 import { toast } from "sonner";
 import { userAPI } from "../lib/api";
 
+const PAGE_SIZE = 50;
+
+// Last loaded view, kept across visits so coming back only fetches rows changed since sync_cursor
+let cachedView = null;
+
+const newestFirst = (a, b) =>
+  b.created_at.localeCompare(a.created_at) || b.id.localeCompare(a.id);
+
 export default function Transactions() {
-  const [loading, setLoading] = useState(true);
-  const [data, setData] = useState(null);
-  const [filter, setFilter] = useState("all");
+  // Another login in this tab must not see the previous user's rows
+  if (cachedView && cachedView.token !== localStorage.getItem("gembot_token")) {
+    cachedView = null;
+  }
+
+  const [loading, setLoading] = useState(!cachedView);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [filter, setFilter] = useState(cachedView?.filter || "all");
+  const [transactions, setTransactions] = useState(cachedView?.transactions || []);
+  const [nextCursor, setNextCursor] = useState(cachedView?.nextCursor || null);
 
   useEffect(() => {
-    fetchTransactions();
-  }, []);
+    if (cachedView && cachedView.filter === filter && cachedView.syncCursor) {
+      syncTransactions();
+    } else {
+      fetchTransactions();
+    }
+  }, [filter]);
+
+  const typeParam = filter === "all" ? undefined : filter;
+
+  const remember = (view) => {
+    cachedView = { ...cachedView, ...view };
+    setTransactions(cachedView.transactions);
+    setNextCursor(cachedView.nextCursor);
+  };
 
   const fetchTransactions = async () => {
+    setLoading(true);
     try {
-      const response = await userAPI.getTransactions();
-      setData(response.data);
+      const response = await userAPI.getTransactions({ limit: PAGE_SIZE, type: typeParam });
+      cachedView = null;
+      remember({
+        token: localStorage.getItem("gembot_token"),
+        filter,
+        transactions: response.data.transactions,
+        nextCursor: response.data.next_cursor,
+        syncCursor: response.data.sync_cursor
+      });
     } catch (error) {
       toast.error("Failed to load transactions");
     } finally {
@@ -33,6 +69,49 @@ export default function Transactions() {
     }
   };
 
+  const syncTransactions = async () => {
+    try {
+      let since = cachedView.syncCursor;
+      const changed = new Map();
+      let hasMore = true;
+      while (hasMore) {
+        const response = await userAPI.getTransactions({ since, limit: PAGE_SIZE, type: typeParam });
+        response.data.transactions.forEach(txn => changed.set(txn.id, txn));
+        since = response.data.sync_cursor;
+        hasMore = response.data.has_more;
+      }
+      // Changed rows replace their cached copy; rows older than the loaded pages are left for loadMore
+      const loaded = cachedView.transactions;
+      const oldest = loaded[loaded.length - 1];
+      const inView = txn => !cachedView.nextCursor || !oldest || newestFirst(txn, oldest) <= 0;
+      const kept = loaded.filter(txn => !changed.has(txn.id));
+      const merged = [...kept, ...[...changed.values()].filter(inView)].sort(newestFirst);
+      remember({
+        transactions: merged,
+        syncCursor: since
+      });
+    } catch (error) {
+      toast.error("Failed to refresh transactions");
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await userAPI.getTransactions({ cursor: nextCursor, limit: PAGE_SIZE, type: typeParam });
+      remember({
+        transactions: [...cachedView.transactions, ...response.data.transactions],
+        nextCursor: response.data.next_cursor
+      });
+    } catch (error) {
+      toast.error("Failed to load more transactions");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const getIcon = (type) => {
     switch (type) {
       case "withdrawal":
@@ -64,11 +143,6 @@ export default function Transactions() {
     }
   };
 
-  const filteredTransactions = data?.transactions?.filter(txn => {
-    if (filter === "all") return true;
-    return txn.type === filter;
-  }) || [];
-
   if (loading) {
     return (
       <div className="flex items-center justify-center min-h-[60vh]">
@@ -111,9 +185,9 @@ export default function Transactions() {
           </CardTitle>
         </CardHeader>
         <CardContent>
-          {filteredTransactions.length > 0 ? (
+          {transactions.length > 0 ? (
             <div className="space-y-3">
-              {filteredTransactions.map((txn) => (
+              {transactions.map((txn) => (
                 <div 
                   key={txn.id}
                   className="flex items-center justify-between p-4 bg-neutral-50 rounded-xl hover:bg-neutral-100 transition-colors"
@@ -156,6 +230,17 @@ export default function Transactions() {
                   </div>
                 </div>
               ))}
+              {nextCursor && (
+                <Button
+                  variant="outline"
+                  className="w-full"
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  data-testid="transactions-load-more-btn"
+                >
+                  {loadingMore ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load More"}
+                </Button>
+              )}
             </div>
           ) : (
             <div className="text-center py-12">
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { 
   Wallet as WalletIcon, 
   Copy, 
@@ -24,7 +24,11 @@ import { Badge } from "../components/ui/badge";
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from "../components/ui/dialog";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "../components/ui/tabs";
 import { toast } from "sonner";
-import { userAPI } from "../lib/api";
+import { userAPI, newIdempotencyKey } from "../lib/api";
+
+// Withdrawals are submitted in the background; follow one briefly for the outcome
+const WITHDRAWAL_STATUS_POLLS = 10;
+const WITHDRAWAL_STATUS_POLL_MS = 3000;
 
 export default function Wallet() {
   const [loading, setLoading] = useState(true);
@@ -47,6 +51,11 @@ export default function Wallet() {
   // User transfer state
   const [userTransferOpen, setUserTransferOpen] = useState(false);
   const [userTransferring, setUserTransferring] = useState(false);
+  
+  // Idempotency keys: kept across a resend after a network error, replaced once the server answers
+  const withdrawKey = useRef(newIdempotencyKey());
+  const transferKey = useRef(newIdempotencyKey());
+  const userTransferKey = useRef(newIdempotencyKey());
   const [userTransferForm, setUserTransferForm] = useState({
     amount: "",
     recipient_identifier: "",
@@ -94,6 +103,27 @@ export default function Wallet() {
     }
   };
 
+  const followWithdrawal = async (withdrawalId) => {
+    try {
+      for (let attempt = 0; attempt < WITHDRAWAL_STATUS_POLLS; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, WITHDRAWAL_STATUS_POLL_MS));
+        const withdrawal = (await userAPI.getWithdrawal(withdrawalId)).data;
+        if (withdrawal.status === "completed") {
+          toast.success(`Withdrawal completed! TxID: ${withdrawal.txn_id}`);
+          fetchWallet();
+          return;
+        }
+        if (withdrawal.status === "failed") {
+          toast.error(`Withdrawal failed: ${withdrawal.failure_reason || "Unknown error"}. Funds returned to earnings.`);
+          fetchWallet();
+          return;
+        }
+      }
+    } catch (error) {
+      // The wallet history still shows the status once it settles
+    }
+  };
+
   // Withdraw handler
   const handleWithdraw = async (e) => {
     e.preventDefault();
@@ -128,12 +158,15 @@ export default function Wallet() {
       const response = await userAPI.withdraw({
         amount,
         to_address: withdrawForm.to_address
-      });
-      toast.success(`Withdrawal successful! TxID: ${response.data.txn_id}`);
+      }, withdrawKey.current);
+      withdrawKey.current = newIdempotencyKey();
+      toast.success(`Withdrawal queued. TxID: ${response.data.txn_id}`);
       setWithdrawOpen(false);
       setWithdrawForm({ amount: "", to_address: "" });
       fetchWallet();
+      followWithdrawal(response.data.withdrawal_id);
     } catch (error) {
+      if (error.response) withdrawKey.current = newIdempotencyKey();
       toast.error(error.response?.data?.detail || "Withdrawal failed");
     } finally {
       setWithdrawing(false);
@@ -171,13 +204,15 @@ export default function Wallet() {
       const response = await userAPI.internalTransfer({
         amount,
         transfer_type: transferType
-      });
+      }, transferKey.current);
+      transferKey.current = newIdempotencyKey();
       const feeMsg = response.data.fee > 0 ? ` (Fee: $${response.data.fee.toFixed(2)})` : "";
       toast.success(`Transfer successful! Net: $${response.data.net_amount.toFixed(2)}${feeMsg}`);
       setTransferOpen(false);
       setTransferAmount("");
       fetchWallet();
     } catch (error) {
+      if (error.response) transferKey.current = newIdempotencyKey();
       toast.error(error.response?.data?.detail || "Transfer failed");
     } finally {
       setTransferring(false);
@@ -217,13 +252,15 @@ export default function Wallet() {
         amount,
         recipient_identifier: userTransferForm.recipient_identifier,
         identifier_type: userTransferForm.identifier_type
-      });
+      }, userTransferKey.current);
+      userTransferKey.current = newIdempotencyKey();
       const feeMsg = response.data.fee > 0 ? ` (Fee: $${response.data.fee.toFixed(2)})` : "";
       toast.success(`Sent $${response.data.net_amount.toFixed(2)} to ${response.data.recipient_email}${feeMsg}`);
       setUserTransferOpen(false);
       setUserTransferForm({ amount: "", recipient_identifier: "", identifier_type: "email" });
       fetchWallet();
     } catch (error) {
+      if (error.response) userTransferKey.current = newIdempotencyKey();
       toast.error(error.response?.data?.detail || "Transfer failed");
     } finally {
       setUserTransferring(false);
@@ -636,7 +673,7 @@ export default function Wallet() {
                       </div>
                       <div>
                         <p className="font-medium text-neutral-900 text-sm">
-                          {txn.type === "withdrawal" && "Withdrawal"}
+                          {txn.type === "withdrawal" && (txn.status && txn.status !== "completed" ? `Withdrawal (${txn.status})` : "Withdrawal")}
                           {txn.type === "internal_transfer" && `Internal (${txn.transfer_type?.replace("_", " → ")})`}
                           {txn.type === "user_transfer_sent" && `Sent to ${txn.recipient_email}`}
                           {txn.type === "user_transfer_received" && `Received from ${txn.sender_email}`}
@@ -27,6 +27,8 @@ export default function AdminLevels() {
   
   // Additional Commissions state
   const [commissions, setCommissions] = useState([]);
+  const [commissionsCursor, setCommissionsCursor] = useState(null);
+  const [commissionExposure, setCommissionExposure] = useState({ users: 0, activation_percentage: 0, renewal_percentage: 0 });
   const [loadingCommissions, setLoadingCommissions] = useState(true);
   const [addCommissionOpen, setAddCommissionOpen] = useState(false);
   const [savingCommission, setSavingCommission] = useState(false);
@@ -63,10 +65,13 @@ export default function AdminLevels() {
     }
   };
 
-  const fetchCommissions = async () => {
+  const fetchCommissions = async (more = false) => {
     try {
-      const response = await adminAPI.getAdditionalCommissions();
-      setCommissions(response.data.commissions || []);
+      const response = await adminAPI.getAdditionalCommissions(more ? commissionsCursor : null);
+      const page = response.data.commissions || [];
+      setCommissions(prev => more ? [...prev, ...page] : page);
+      setCommissionsCursor(response.data.next_cursor);
+      setCommissionExposure(response.data.exposure);
     } catch (error) {
       console.error("Failed to load additional commissions");
     } finally {
@@ -76,7 +81,7 @@ export default function AdminLevels() {
 
   const fetchUsers = async () => {
     try {
-      const response = await adminAPI.getUsers(0, 1000);
+      const response = await adminAPI.getUsers(null, 1000);
       setAllUsers(response.data.users || []);
     } catch (error) {
       console.error("Failed to load users");
@@ -353,6 +358,17 @@ export default function AdminLevels() {
                   </div>
                 </div>
               ))}
+              {commissionsCursor && (
+                <Button
+                  variant="outline"
+                  size="sm"
+                  className="w-full"
+                  onClick={() => fetchCommissions(true)}
+                  data-testid="load-more-commissions"
+                >
+                  Load more
+                </Button>
+              )}
             </div>
           ) : (
             <p className="text-center text-neutral-500 py-4">
@@ -479,7 +495,10 @@ export default function AdminLevels() {
             <div className="p-4 bg-purple-50 rounded-xl">
               <p className="text-purple-600 text-sm">Additional Users</p>
               <p className="font-heading text-2xl font-bold text-purple-700 num-display">
-                {commissions.length}
+                {commissionExposure.users}
+              </p>
+              <p className="text-xs text-purple-500">
+                +{commissionExposure.activation_percentage.toFixed(1)}% activation / +{commissionExposure.renewal_percentage.toFixed(1)}% renewal
               </p>
             </div>
           </div>
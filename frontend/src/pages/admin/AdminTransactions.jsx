@@ -5,7 +5,8 @@ import {
   Loader2,
   ArrowUpRight,
   ArrowDownRight,
-  TrendingUp
+  TrendingUp,
+  Download
 } from "lucide-react";
 import { Card, CardContent, CardHeader, CardTitle } from "../../components/ui/card";
 import { Button } from "../../components/ui/button";
@@ -20,19 +21,28 @@ export default function AdminTransactions() {
   const [total, setTotal] = useState(0);
   const [filter, setFilter] = useState("all");
   const [page, setPage] = useState(0);
+  const [cursors, setCursors] = useState([null]); // Cursor that loads each visited page
+  const [nextCursor, setNextCursor] = useState(null);
+  const [exporting, setExporting] = useState(false);
   const limit = 30;
 
   useEffect(() => {
     fetchTransactions();
   }, [page, filter]);
 
+  const goToNextPage = () => {
+    setCursors(prev => [...prev.slice(0, page + 1), nextCursor]);
+    setPage(p => p + 1);
+  };
+
   const fetchTransactions = async () => {
     setLoading(true);
     try {
       const type = filter === "all" ? null : filter;
-      const response = await adminAPI.getTransactions(page * limit, limit, type);
+      const response = await adminAPI.getTransactions(cursors[page], limit, type);
       setTransactions(response.data.transactions);
       setTotal(response.data.total);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       toast.error("Failed to load transactions");
     } finally {
@@ -40,6 +50,24 @@ export default function AdminTransactions() {
     }
   };
 
+  const exportTransactions = async () => {
+    setExporting(true);
+    try {
+      const type = filter === "all" ? null : filter;
+      const response = await adminAPI.exportTransactions({ format: "csv", type });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = `transactions${type ? `-${type}` : ""}.csv`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      toast.error("Failed to export transactions");
+    } finally {
+      setExporting(false);
+    }
+  };
+
   const getIcon = (type) => {
     switch (type) {
       case "withdrawal":
@@ -72,19 +100,30 @@ export default function AdminTransactions() {
           </h1>
           <p className="text-neutral-500">View all system transactions</p>
         </div>
-        <Select value={filter} onValueChange={(v) => { setFilter(v); setPage(0); }}>
-          <SelectTrigger className="w-full md:w-48" data-testid="admin-transaction-filter">
-            <Filter className="w-4 h-4 mr-2" />
-            <SelectValue placeholder="Filter" />
-          </SelectTrigger>
-          <SelectContent>
-            <SelectItem value="all">All Transactions</SelectItem>
-            <SelectItem value="level_income">Level Income</SelectItem>
-            <SelectItem value="activation">Activation</SelectItem>
-            <SelectItem value="renewal">Renewal</SelectItem>
-            <SelectItem value="withdrawal">Withdrawal</SelectItem>
-          </SelectContent>
-        </Select>
+        <div className="flex flex-col md:flex-row gap-2">
+          <Button
+            variant="outline"
+            onClick={exportTransactions}
+            disabled={exporting}
+            data-testid="admin-transactions-export-btn"
+          >
+            {exporting ? <Loader2 className="w-4 h-4 mr-2 animate-spin" /> : <Download className="w-4 h-4 mr-2" />}
+            Export CSV
+          </Button>
+          <Select value={filter} onValueChange={(v) => { setFilter(v); setPage(0); setCursors([null]); }}>
+            <SelectTrigger className="w-full md:w-48" data-testid="admin-transaction-filter">
+              <Filter className="w-4 h-4 mr-2" />
+              <SelectValue placeholder="Filter" />
+            </SelectTrigger>
+            <SelectContent>
+              <SelectItem value="all">All Transactions</SelectItem>
+              <SelectItem value="level_income">Level Income</SelectItem>
+              <SelectItem value="activation">Activation</SelectItem>
+              <SelectItem value="renewal">Renewal</SelectItem>
+              <SelectItem value="withdrawal">Withdrawal</SelectItem>
+            </SelectContent>
+          </Select>
+        </div>
       </div>
 
       {/* Stats */}
@@ -183,7 +222,7 @@ export default function AdminTransactions() {
           )}
 
           {/* Pagination */}
-          {total > limit && (
+          {(page > 0 || nextCursor) && (
             <div className="flex justify-center gap-2 mt-6">
               <Button
                 variant="outline"
@@ -194,13 +233,13 @@ export default function AdminTransactions() {
                 Previous
               </Button>
               <span className="px-4 py-2 text-sm text-neutral-600">
-                Page {page + 1} of {Math.ceil(total / limit)}
+                Page {page + 1} of ~{Math.max(page + 1, Math.ceil(total / limit))}
               </span>
               <Button
                 variant="outline"
                 size="sm"
-                onClick={() => setPage(p => p + 1)}
-                disabled={(page + 1) * limit >= total}
+                onClick={goToNextPage}
+                disabled={!nextCursor}
               >
                 Next
               </Button>
@@ -22,6 +22,8 @@ export default function AdminUsers() {
   const [total, setTotal] = useState(0);
   const [search, setSearch] = useState("");
   const [page, setPage] = useState(0);
+  const [cursors, setCursors] = useState([null]); // Cursor that loads each visited page
+  const [nextCursor, setNextCursor] = useState(null);
   const limit = 20;
 
   useEffect(() => {
@@ -31,9 +33,10 @@ export default function AdminUsers() {
   const fetchUsers = async () => {
     setLoading(true);
     try {
-      const response = await adminAPI.getUsers(page * limit, limit);
+      const response = await adminAPI.getUsers(cursors[page], limit);
       setUsers(response.data.users);
       setTotal(response.data.total);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       toast.error("Failed to load users");
     } finally {
@@ -41,6 +44,11 @@ export default function AdminUsers() {
     }
   };
 
+  const goToNextPage = () => {
+    setCursors(prev => [...prev.slice(0, page + 1), nextCursor]);
+    setPage(p => p + 1);
+  };
+
   const filteredUsers = users.filter(user => 
     user.email?.toLowerCase().includes(search.toLowerCase()) ||
     user.first_name?.toLowerCase().includes(search.toLowerCase()) ||
@@ -174,7 +182,7 @@ export default function AdminUsers() {
           )}
 
           {/* Pagination */}
-          {total > limit && (
+          {(page > 0 || nextCursor) && (
             <div className="flex justify-center gap-2 mt-6">
               <Button
                 variant="outline"
@@ -185,13 +193,13 @@ export default function AdminUsers() {
                 Previous
               </Button>
               <span className="px-4 py-2 text-sm text-neutral-600">
-                Page {page + 1} of {Math.ceil(total / limit)}
+                Page {page + 1} of ~{Math.max(page + 1, Math.ceil(total / limit))}
               </span>
               <Button
                 variant="outline"
                 size="sm"
-                onClick={() => setPage(p => p + 1)}
-                disabled={(page + 1) * limit >= total}
+                onClick={goToNextPage}
+                disabled={!nextCursor}
               >
                 Next
               </Button>